@@ -5,6 +5,22 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Запуск под uvicorn (подбор столиков, занятость дня и ближайшие слоты —
+асинхронные представления и не держат поток на ожидании Redis):
+
+    uvicorn config.asgi:application --workers 4 --loop uvloop \
+        --limit-concurrency 500 --timeout-keep-alive 5
+
+Синхронные представления выполняются в пуле потоков asgiref, поэтому
+CONN_MAX_AGE должен оставаться 0: постоянные соединения под ASGI не
+переиспользуются между потоками и копятся. Быстрый путь без базы работает
+только при заданном REDIS_URL.
+
+Поток занятости /api/hall-day/<id>/stream/ (reservation.live) обслуживается
+здесь же, до Django: соединения долгие, а отключение клиента должно сразу
+освобождать общую подписку Redis. Каждый открытый поток держит соединение,
+поэтому --limit-concurrency считается с учётом открытых форм брони.
 """
 
 import os
@@ -13,4 +29,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from reservation.live import AvailabilityStream  # noqa: E402 — после настройки Django
+
+application = AvailabilityStream(django_application)
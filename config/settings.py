@@ -1,5 +1,6 @@
 import os.path
 from pathlib import Path
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,11 +23,14 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "reservation",
     "users",
 ]
 
 MIDDLEWARE = [
+    "reservation.middleware.RequestInstrumentationMiddleware",
+    "reservation.middleware.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -36,11 +40,17 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+REQUEST_INSTRUMENTATION = os.getenv('REQUEST_INSTRUMENTATION', 'False') == 'True'
+REQUEST_INSTRUMENTATION_LOG = os.getenv('REQUEST_INSTRUMENTATION_LOG', '')
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": (
+            "reservation.templating.InstrumentedDjangoTemplates" if REQUEST_INSTRUMENTATION
+            else "django.template.backends.django.DjangoTemplates"
+        ),
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -67,6 +77,28 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICAS=host[:port][/name],...
+# Пользователь и пароль те же, что у основной базы
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1):
+    address, _, name = replica.strip().partition("/")
+    host, _, port = address.partition(":")
+    alias = f"replica_{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host or DATABASES["default"]["HOST"],
+        "PORT": port or DATABASES["default"]["PORT"],
+        "NAME": name or DATABASES["default"]["NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["reservation.routers.ReplicaRouter"]
+
+# Сколько секунд после записи клиент читает основную базу (не меньше отставания реплик)
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", 5))
+REPLICA_PIN_COOKIE = "db_primary"
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -101,8 +133,35 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Изображения залов: ширины копий для srcset и ограничения загрузки
+HALL_IMAGE_WIDTHS = (320, 640, 1024, 1600)
+HALL_IMAGE_MAX_PIXELS = 40_000_000
+HALL_IMAGE_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+
 
 
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "instrumentation": {
+            "class": "logging.FileHandler" if REQUEST_INSTRUMENTATION_LOG else "logging.StreamHandler",
+            "formatter": "message",
+            **({"filename": REQUEST_INSTRUMENTATION_LOG} if REQUEST_INSTRUMENTATION_LOG else {}),
+        },
+    },
+    "loggers": {
+        "reservation.instrumentation": {
+            "handlers": ["instrumentation"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = 'users.User'
@@ -121,3 +180,46 @@ ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', '')
 
 SERVER_EMAIL = EMAIL_HOST_USER
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_DELAY = 30
+EMAIL_RETRY_MAX_DELAY = 60 * 60
+# Срок, на который письмо забирается воркером: после него его отправит следующий обход
+EMAIL_SEND_LEASE = 10 * 60
+
+REDIS_URL = os.getenv('REDIS_URL', '')
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT') or 0.5)
+OCCUPANCY_INDEX_TTL = int(os.getenv('OCCUPANCY_INDEX_TTL') or 60 * 60 * 6)
+# Поток занятости (reservation.live): комментарий раз в N секунд не даёт прокси
+# закрыть соединение; медленный клиент отключается после N неотправленных событий
+AVAILABILITY_STREAM_HEARTBEAT = int(os.getenv('AVAILABILITY_STREAM_HEARTBEAT') or 15)
+AVAILABILITY_STREAM_QUEUE = 100
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+
+CELERY_BEAT_SCHEDULE = {
+    'complete-past-reservations': {
+        'task': 'reservation.tasks.complete_past_reservations',
+        'schedule': crontab(minute=5),
+    },
+    'send-queued-emails': {
+        'task': 'reservation.tasks.send_queued_emails',
+        'schedule': crontab(),
+    },
+    'expire-waitlist': {
+        'task': 'reservation.tasks.expire_waitlist',
+        'schedule': crontab(minute=10, hour=0),
+    },
+}
@@ -1,21 +1,59 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.utils import timezone
-from datetime import datetime
-from .models import Hall, Table, Reservation
+from datetime import timedelta
+from django.db import IntegrityError, connections, transaction
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect
+from django.db.models import Count
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import Hall, Table, Reservation, ReservationQuerySet, ReservationSeries, WaitlistEntry, OutgoingEmail
+from .caching import ReferenceCache
+from .exports import ReservationExport
+from .forms import ReservationSeriesForm
+from .pagination import EstimatedCountPaginator
+from .series import SeriesBooking
+from .transitions import ReservationTransitions
 
 
 @admin.register(Hall)
 class HallAdmin(admin.ModelAdmin):
-    list_display = ['name', 'width', 'height', 'description_short']
+    list_display = [
+        'name', 'width', 'height', 'description_short', 'tables_total', 'active_tables_total',
+        'capacity_total', 'seats_booked_today', 'seats_booked_tonight',
+    ]
     list_filter = ['width', 'height']
     search_fields = ['name', 'description']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_stats()
+
     def description_short(self, obj):
         return obj.description[:50] + '...' if obj.description else ''
 
     description_short.short_description = 'Описание'
 
+    @admin.display(description='Столиков', ordering='tables_total')
+    def tables_total(self, obj):
+        return obj.tables_total
+
+    @admin.display(description='Активных столиков', ordering='active_tables_total')
+    def active_tables_total(self, obj):
+        return obj.active_tables_total
+
+    @admin.display(description='Вместимость', ordering='capacity_total')
+    def capacity_total(self, obj):
+        return obj.capacity_total
+
+    @admin.display(description='Мест занято сегодня', ordering='seats_booked_today')
+    def seats_booked_today(self, obj):
+        return obj.seats_booked_today
+
+    @admin.display(description='Мест занято вечером', ordering='seats_booked_tonight')
+    def seats_booked_tonight(self, obj):
+        return obj.seats_booked_tonight
+
 
 @admin.register(Table)
 class TableAdmin(admin.ModelAdmin):
@@ -27,19 +65,81 @@ class TableAdmin(admin.ModelAdmin):
 
     actions = ['activate_tables', 'deactivate_tables']
 
+    @staticmethod
+    def _set_active(queryset, is_active):
+        """Массово меняет доступность столиков и сбрасывает кэш их залов"""
+        hall_ids = list(queryset.order_by().values_list('hall_id', flat=True).distinct())
+        updated = queryset.update(is_active=is_active)
+        transaction.on_commit(lambda: ReferenceCache.bump(*hall_ids))
+        return updated
+
     def activate_tables(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = self._set_active(queryset, True)
         self.message_user(request, f'{updated} столиков активировано', messages.SUCCESS)
 
     activate_tables.short_description = 'Активировать выбранные столики'
 
     def deactivate_tables(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = self._set_active(queryset, False)
         self.message_user(request, f'{updated} столиков деактивировано', messages.SUCCESS)
 
     deactivate_tables.short_description = 'Деактивировать выбранные столики'
 
 
+class SeatingListFilter(admin.SimpleListFilter):
+    """Брони, идущие прямо сейчас, и заканчивающиеся в ближайшие ENDING_SOON"""
+
+    title = 'Сейчас в зале'
+    parameter_name = 'seating'
+    ENDING_SOON = timedelta(minutes=30)
+
+    def lookups(self, request, model_admin):
+        return [
+            ('seated', 'Гости за столиком'),
+            ('ending', 'Заканчиваются в ближайшие 30 минут'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'seated':
+            return queryset.seated()
+        if self.value() == 'ending':
+            return queryset.ending_within(self.ENDING_SOON)
+        return queryset
+
+
+class DateHierarchyQuerySet(ReservationQuerySet):
+    """
+    Брони для списка в админке: годы, месяцы и дни date_hierarchy ищутся
+    одним рекурсивным запросом — проходом по индексу даты с шагом в период
+    (min(date) не раньше начала следующего периода) вместо SELECT DISTINCT
+    по всем броням, попавшим под фильтры.
+    """
+
+    STEPS = {'year': '1 year', 'month': '1 month', 'day': '1 day'}
+
+    def dates(self, field_name, kind, order='ASC'):
+        connection = connections[self.db]
+        column = connection.ops.quote_name(self.model._meta.get_field(field_name).column)
+        sql, params = self.order_by().values(field_name).query.sql_with_params()
+        query = f"""
+            WITH RECURSIVE period (start) AS (
+                SELECT date_trunc(%s, min(f.{column})::timestamp)::date FROM ({sql}) f
+                UNION ALL
+                SELECT (
+                    SELECT date_trunc(%s, min(f.{column})::timestamp)::date FROM ({sql}) f
+                    WHERE f.{column} >= p.start + %s::interval
+                )
+                FROM period p
+                WHERE p.start IS NOT NULL
+            )
+            SELECT start FROM period WHERE start IS NOT NULL
+            ORDER BY start {'DESC' if order == 'DESC' else 'ASC'}
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(query, [kind, *params, kind, *params, self.STEPS[kind]])
+            return [start for start, in cursor.fetchall()]
+
+
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
     list_display = [
@@ -57,6 +157,7 @@ class ReservationAdmin(admin.ModelAdmin):
     ]
 
     list_filter = [
+        SeatingListFilter,
         'status',
         'source',
         'date',
@@ -75,16 +176,21 @@ class ReservationAdmin(admin.ModelAdmin):
     ]
 
     list_editable = ['status']
-    readonly_fields = ['created_at', 'updated_at', 'end_time_display']
-    date_hierarchy = 'date'
+    readonly_fields = ['created_at', 'updated_at', 'end_time_display', 'series']
     list_per_page = 30
+    # Без запросов по всей таблице броней на каждой загрузке списка: общее
+    # число — оценка из статистики, на страницах с фильтром не считается,
+    # периоды date_hierarchy строит DateHierarchyQuerySet по индексу даты
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = 'date'
 
     fieldsets = (
         ('Основная информация', {
             'fields': ('user', 'table', 'date', 'start_time', 'duration', 'guests_count')
         }),
         ('Статус и детали', {
-            'fields': ('status', 'event', 'extended_by_admin', 'source', 'staff_user')
+            'fields': ('status', 'event', 'extended_by_admin', 'source', 'staff_user', 'series')
         }),
         ('Системная информация', {
             'fields': ('created_at', 'updated_at'),
@@ -92,38 +198,225 @@ class ReservationAdmin(admin.ModelAdmin):
         }),
     )
 
-    actions = ['mark_confirmed', 'mark_completed', 'mark_canceled']
+    actions = ['mark_confirmed', 'mark_completed', 'mark_canceled', 'export_csv', 'export_xlsx']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DateHierarchyQuerySet(self.model, query=queryset.query, using=queryset._db)
 
     def end_time_display(self, obj):
-        return obj.end_time.strftime('%H:%M') if obj.end_time else '-'
+        if not obj.ends_at:
+            return '-'
+        ends_at = timezone.localtime(obj.ends_at)
+        # Бронь, переходящая через полночь, заканчивается на другой день
+        days = (ends_at.date() - obj.date).days
+        return ends_at.strftime('%H:%M') + (f' (+{days})' if days else '')
 
     end_time_display.short_description = 'Окончание'
+    end_time_display.admin_order_field = 'ends_at'
 
     def created_at_short(self, obj):
         return obj.created_at.strftime('%d.%m.%Y %H:%M')
 
     created_at_short.short_description = 'Создано'
 
+    REJECTED_SHOWN = 10
+
+    def _transition(self, request, queryset, status, done):
+        """Смена статуса через ReservationTransitions с отчётом об отклонённых"""
+        try:
+            result = ReservationTransitions.apply(queryset, status)
+        except IntegrityError:
+            self.message_user(
+                request,
+                'Статусы не изменены: во время проверки столик заняла другая бронь, повторите действие',
+                messages.ERROR,
+            )
+            return
+        if result.updated:
+            self.message_user(request, f'{result.updated} броней {done}', messages.SUCCESS)
+        if result.unchanged:
+            self.message_user(request, f'{result.unchanged} броней уже в этом статусе', messages.INFO)
+        if result.rejected:
+            lines = [f'#{pk}: {reason}' for pk, reason in result.rejected[:self.REJECTED_SHOWN]]
+            if len(result.rejected) > self.REJECTED_SHOWN:
+                lines.append(f'и ещё {len(result.rejected) - self.REJECTED_SHOWN}')
+            self.message_user(
+                request,
+                f'{len(result.rejected)} броней не изменено: ' + '; '.join(lines),
+                messages.WARNING,
+            )
+
     def mark_confirmed(self, request, queryset):
-        updated = queryset.update(status='confirmed')
-        self.message_user(request, f'{updated} броней подтверждено', messages.SUCCESS)
+        self._transition(request, queryset, 'confirmed', 'подтверждено')
 
     mark_confirmed.short_description = 'Подтвердить выбранные брони'
 
     def mark_completed(self, request, queryset):
-        updated = queryset.update(status='completed')
-        self.message_user(request, f'{updated} броней завершено', messages.SUCCESS)
+        self._transition(request, queryset, 'completed', 'завершено')
 
     mark_completed.short_description = 'Завершить выбранные брони'
 
     def mark_canceled(self, request, queryset):
-        updated = queryset.update(status='canceled')
-        self.message_user(request, f'{updated} броней отменено', messages.SUCCESS)
+        self._transition(request, queryset, 'canceled', 'отменено')
 
     mark_canceled.short_description = 'Отменить выбранные брони'
 
+    def export_csv(self, request, queryset):
+        return ReservationExport.csv_response(request, queryset.order_by('date', 'start_time', 'id'))
+
+    export_csv.short_description = 'Выгрузить выбранные брони в CSV'
+
+    def export_xlsx(self, request, queryset):
+        return ReservationExport.xlsx_response(request, queryset.order_by('date', 'start_time', 'id'))
+
+    export_xlsx.short_description = 'Выгрузить выбранные брони в XLSX'
+
+    def get_urls(self):
+        urls = [
+            path(
+                'export/<str:file_format>/',
+                self.admin_site.admin_view(self.export_changelist_view),
+                name='reservation_reservation_export',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_changelist_view(self, request, file_format):
+        """Выгрузка всех броней, попавших под текущие фильтры и поиск списка"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        queryset = self.get_changelist_instance(request).get_queryset(request)
+        if file_format == 'xlsx':
+            return ReservationExport.xlsx_response(request, queryset)
+        return ReservationExport.csv_response(request, queryset)
+
     def save_model(self, request, obj, form, change):
         """Автоматически заполняем staff_user если админ меняет бронь"""
         if change and request.user.is_staff and not obj.staff_user:
             obj.staff_user = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+    def lookup_allowed(self, lookup, value):
+        # Ссылка «Брони серии» из ReservationSeriesAdmin; в list_filter серия
+        # не выводится — список всех серий на каждой загрузке не нужен
+        if lookup == 'series__id__exact':
+            return True
+        return super().lookup_allowed(lookup, value)
+
+
+@admin.register(ReservationSeries)
+class ReservationSeriesAdmin(admin.ModelAdmin):
+    form = ReservationSeriesForm
+    list_display = [
+        'id', 'user', 'first_date', 'frequency', 'interval', 'start_time',
+        'guests_count', 'reservations_link', 'staff_user', 'created_at',
+    ]
+    list_filter = ['frequency']
+    search_fields = ['user__email', 'event']
+    raw_id_fields = ['user']
+    filter_horizontal = ['tables']
+    list_per_page = 30
+
+    fieldsets = (
+        ('Гость и столики', {
+            'fields': ('user', 'tables', 'guests_count', 'event')
+        }),
+        ('Повторение', {
+            'fields': ('first_date', 'frequency', 'interval', 'count', 'until', 'start_time', 'duration')
+        }),
+        ('Создание', {
+            'fields': ('skip_conflicts',),
+            'description': 'Все даты проверяются сразу; брони создаются вместе с серией',
+        }),
+    )
+
+    def get_queryset(self, request):
+        return (
+            super().get_queryset(request)
+            .select_related('user', 'staff_user')
+            .annotate(reservations_count=Count('reservations'))
+        )
+
+    def get_fieldsets(self, request, obj=None):
+        if obj:
+            # Серия уже развёрнута в брони — меняются сами брони, не правило
+            return self.fieldsets[:2] + (('Создание', {'fields': ('staff_user', 'created_at')}),)
+        return self.fieldsets
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj:
+            return [
+                'user', 'tables', 'guests_count', 'event', 'first_date', 'frequency', 'interval',
+                'count', 'until', 'start_time', 'duration', 'staff_user', 'created_at',
+            ]
+        return []
+
+    def reservations_link(self, obj):
+        url = reverse('admin:reservation_reservation_changelist') + f'?series__id__exact={obj.pk}'
+        return format_html('<a href="{}">{}</a>', url, obj.reservations_count)
+
+    reservations_link.short_description = 'Брони'
+    reservations_link.admin_order_field = 'reservations_count'
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.staff_user = request.user
+        super().save_model(request, obj, form, change)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except IntegrityError:
+            if object_id is not None:
+                raise
+            # Серия без броней не нужна: транзакция changeform_view уже откатила её
+            self.message_user(
+                request,
+                'Серия не создана: во время проверки столик заняла другая бронь, повторите',
+                messages.ERROR,
+            )
+            return HttpResponseRedirect(request.get_full_path())
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            return
+        # IntegrityError поднимается до changeform_view вместе с откатом серии
+        reservations = SeriesBooking.create(form.instance, form.plan)
+        self.message_user(request, f'Создано броней: {len(reservations)}', messages.SUCCESS)
+        if form.plan.conflicts:
+            self.message_user(
+                request,
+                'Пропущены занятые даты: ' + ', '.join(
+                    f'{date_val:%d.%m.%Y}' for date_val in sorted(form.plan.conflicts)
+                ),
+                messages.WARNING,
+            )
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'user', 'hall', 'date', 'earliest_time', 'latest_time',
+        'guests_count', 'status', 'reservation', 'created_at',
+    ]
+    list_filter = ['status', 'hall']
+    search_fields = ['user__email']
+    raw_id_fields = ['user', 'reservation']
+    readonly_fields = ['created_at', 'promoted_at']
+    list_select_related = ['user', 'hall', 'reservation']
+    list_per_page = 30
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subject', 'recipients', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = [
+        'subject', 'from_email', 'recipients', 'status', 'attempts',
+        'last_error', 'next_attempt_at', 'created_at', 'sent_at',
+    ]
+    exclude = ['body']
+    list_per_page = 30
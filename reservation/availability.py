@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from reservation.caching import ReferenceCache
+from reservation.occupancy import OccupancyIndex
+from reservation.validators import FIRST_START_TIME, LAST_START_TIME
+
+DEFAULT_DURATION = timedelta(hours=3)
+
+
+class TableAvailability:
+    """
+    Подбор свободных столиков зала.
+    Занятые интервалы всех столиков зала на дату берутся из OccupancyIndex
+    (Redis, при промахе — один запрос к базе), пересечения проверяются
+    одним проходом по отсортированным интервалам.
+    """
+
+    @staticmethod
+    def busy_intervals(hall_id, date_val):
+        """Занятые интервалы: {table_id: [(start, end, reservation_id), ...]}, отсортированы по началу"""
+        return OccupancyIndex.busy_intervals(hall_id, date_val)
+
+    @staticmethod
+    def find_conflict(intervals, start, end, exclude_pk=None):
+        """Первый занятый интервал, пересекающийся с [start, end), или None"""
+        for interval in intervals:
+            busy_start, busy_end, pk = interval
+            if busy_start >= end:
+                break
+            if start < busy_end and pk != exclude_pk:
+                return interval
+        return None
+
+    @classmethod
+    def is_free(cls, intervals, start, end):
+        """Свободен ли интервал [start, end) относительно отсортированного списка занятых"""
+        return cls.find_conflict(intervals, start, end) is None
+
+    @classmethod
+    def _free(cls, tables, busy, date_val, start_time, guests, duration):
+        """Свободные из tables при занятости busy; без даты и времени — все подходящие по вместимости"""
+        tables = [
+            {'id': table.id, 'number': table.number, 'capacity': table.capacity}
+            for table in tables
+            if table.capacity >= guests
+        ]
+        if not date_val or not start_time:
+            return tables
+
+        start = datetime.combine(date_val, start_time)
+        end = start + duration
+        return [
+            table for table in tables
+            if cls.is_free(busy.get(table['id'], ()), start, end)
+        ]
+
+    @classmethod
+    def free_tables(cls, hall_id, date_val, start_time, guests=1, duration=DEFAULT_DURATION):
+        """
+        Свободные столики зала в формате для JSON.
+        Столики берутся из ReferenceCache, брони — из OccupancyIndex,
+        число запросов не зависит от количества столиков в зале.
+        """
+        busy = cls.busy_intervals(hall_id, date_val) if date_val and start_time else {}
+        return cls._free(ReferenceCache.tables(hall_id), busy, date_val, start_time, guests, duration)
+
+    @classmethod
+    async def afree_tables(cls, hall_id, date_val, start_time, guests=1, duration=DEFAULT_DURATION):
+        """Асинхронный free_tables"""
+        tables = await ReferenceCache.atables(hall_id)
+        busy = await OccupancyIndex.abusy_intervals(hall_id, date_val) if date_val and start_time else {}
+        return cls._free(tables, busy, date_val, start_time, guests, duration)
+
+    @staticmethod
+    def _candidate_starts(date_val, preferred_time, window, step):
+        """
+        Сетка времени начала с шагом step в пределах window от желаемого времени
+        и часов работы, по возрастанию удалённости от желаемого времени.
+        """
+        preferred = datetime.combine(date_val, preferred_time)
+        first = max(preferred - window, datetime.combine(date_val, FIRST_START_TIME))
+        last = min(preferred + window, datetime.combine(date_val, LAST_START_TIME))
+        if date_val == timezone.localdate():
+            now = timezone.localtime().replace(tzinfo=None)
+            first = max(first, now)
+
+        # Сетка выравнивается по желаемому времени, чтобы оно само было кандидатом
+        candidates = []
+        offset = -((preferred - first) // step)
+        while preferred + offset * step <= last:
+            start = preferred + offset * step
+            if start >= first:
+                candidates.append(start)
+            offset += 1
+        candidates.sort(key=lambda start: abs(start - preferred))
+        return preferred, candidates
+
+    @staticmethod
+    def _suitable_tables(tables, guests):
+        return [table for table in tables if table.is_active and table.capacity >= guests]
+
+    @classmethod
+    def _hall_options(cls, hall, tables, busy, preferred, candidates, duration):
+        """Свободные варианты (удалённость, вместимость, начало, зал, столик) одного зала"""
+        options = []
+        for table in tables:
+            intervals = busy.get(table.pk, ())
+            for start in candidates:
+                if cls.is_free(intervals, start, start + duration):
+                    options.append((abs(start - preferred), table.capacity, start, hall, table))
+        return options
+
+    @staticmethod
+    def _best_options(options, limit):
+        return [
+            {
+                'hall_id': hall.pk,
+                'hall': hall.name,
+                'table_id': table.pk,
+                'number': table.number,
+                'capacity': table.capacity,
+                'start_time': start.strftime('%H:%M'),
+            }
+            for _, _, start, hall, table in heapq.nsmallest(
+                limit, options, key=lambda option: option[:3]
+            )
+        ]
+
+    @classmethod
+    def nearest_slots(cls, date_val, preferred_time, guests=1, limit=5,
+                      window=timedelta(hours=2), step=timedelta(minutes=15), duration=DEFAULT_DURATION):
+        """
+        Ближайшие к желаемому времени свободные варианты (зал, столик, время начала) по всем залам.
+        Занятость каждого зала читается один раз, каждый кандидат
+        проверяется по уже загруженным интервалам.
+        """
+        preferred, candidates = cls._candidate_starts(date_val, preferred_time, window, step)
+
+        options = []
+        for hall in ReferenceCache.halls():
+            tables = cls._suitable_tables(ReferenceCache.tables(hall.pk), guests)
+            if not tables:
+                continue
+            busy = cls.busy_intervals(hall.pk, date_val)
+            options.extend(cls._hall_options(hall, tables, busy, preferred, candidates, duration))
+
+        return cls._best_options(options, limit)
+
+    @classmethod
+    async def anearest_slots(cls, date_val, preferred_time, guests=1, limit=5,
+                             window=timedelta(hours=2), step=timedelta(minutes=15), duration=DEFAULT_DURATION):
+        """Асинхронный nearest_slots: столики и занятость всех залов читаются параллельно"""
+        preferred, candidates = cls._candidate_starts(date_val, preferred_time, window, step)
+
+        async def hall_options(hall):
+            tables = cls._suitable_tables(await ReferenceCache.atables(hall.pk), guests)
+            if not tables:
+                return []
+            busy = await OccupancyIndex.abusy_intervals(hall.pk, date_val)
+            return cls._hall_options(hall, tables, busy, preferred, candidates, duration)
+
+        halls = await ReferenceCache.ahalls()
+        options = []
+        for hall_result in await asyncio.gather(*(hall_options(hall) for hall in halls)):
+            options.extend(hall_result)
+        return cls._best_options(options, limit)
+
+    @staticmethod
+    def _matrix(hall_id, date_val, tables, busy, exclude_pk):
+        day_start = datetime.combine(date_val, datetime.min.time())
+        matrix = []
+        for table in tables:
+            ranges = []
+            for start, end, pk in busy.get(table.pk, ()):
+                if pk == exclude_pk:
+                    continue
+                start_minute = int((start - day_start).total_seconds()) // 60
+                end_minute = -(-int((end - day_start).total_seconds()) // 60)
+                if ranges and start_minute <= ranges[-1][1]:
+                    ranges[-1][1] = max(ranges[-1][1], end_minute)
+                else:
+                    ranges.append([start_minute, end_minute])
+            matrix.append({
+                'id': table.pk,
+                'number': table.number,
+                'capacity': table.capacity,
+                'busy': ranges,
+            })
+
+        return {
+            'hall_id': hall_id,
+            'date': date_val.isoformat(),
+            'duration': int(DEFAULT_DURATION.total_seconds()) // 60,
+            'tables': matrix,
+        }
+
+    @classmethod
+    def day_matrix(cls, hall_id, date_val, exclude_pk=None):
+        """
+        Занятость всех столиков зала на день в компактном виде для клиента.
+        Занятые интервалы каждого столика слиты и записаны как [начало, конец)
+        в минутах от полуночи дня брони; конец может быть больше 1440.
+        """
+        busy = cls.busy_intervals(hall_id, date_val)
+        return cls._matrix(hall_id, date_val, ReferenceCache.tables(hall_id), busy, exclude_pk)
+
+    @classmethod
+    async def aday_matrix(cls, hall_id, date_val, exclude_pk=None):
+        """Асинхронный day_matrix"""
+        tables = await ReferenceCache.atables(hall_id)
+        busy = await OccupancyIndex.abusy_intervals(hall_id, date_val)
+        return cls._matrix(hall_id, date_val, tables, busy, exclude_pk)
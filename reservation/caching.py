@@ -0,0 +1,224 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+
+class ReferenceCache:
+    """
+    Кэш справочных данных: залы, столики, схемы залов.
+
+    Ключи данных включают версию зала, поэтому для сброса достаточно
+    заменить версию — старые записи просто истекут по таймауту. Версия
+    — метка времени, а не счётчик: если ключ версии вытеснен из кэша,
+    новая версия не совпадёт ни с одной из уже записанных.
+
+    Версии имеют смысл, только если кэш общий для всех процессов: с
+    локальным кэшем (LocMemCache без REDIS_URL) сброс в одном воркере не
+    виден другим. Поэтому без общего кэша данные читаются из базы, а
+    версии равны None — представления не отвечают 304 по устаревшей метке.
+
+    Загрузка при промахе идёт по основной базе: отстающая реплика сразу
+    после bump() записала бы старые данные под новой версией на весь
+    REFERENCE_CACHE_TIMEOUT.
+    """
+
+    HALLS_VERSION_KEY = "halls:version"
+
+    @staticmethod
+    def shared():
+        """Кэш по умолчанию общий для процессов (не locmem и не dummy)"""
+        return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+    @staticmethod
+    def hall_version_key(hall_id):
+        return f"hall:{hall_id}:version"
+
+    @classmethod
+    def _version(cls, key):
+        if not cls.shared():
+            return None
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+
+    @staticmethod
+    def day_version_key(hall_id, date_val):
+        return f"hall:{hall_id}:day:{date_val.isoformat()}:version"
+
+    @classmethod
+    def hall_version(cls, hall_id):
+        """Метка изменения зала и его столиков (время последнего сброса в нс)"""
+        return cls._version(cls.hall_version_key(hall_id))
+
+    @classmethod
+    def day_version(cls, hall_id, date_val):
+        """Метка изменения броней зала на дату"""
+        return cls._version(cls.day_version_key(hall_id, date_val))
+
+    @classmethod
+    def bump_days(cls, pairs):
+        """Отмечает изменение броней для пар (hall_id, date)"""
+        if not cls.shared():
+            return
+        version = time.time_ns()
+        cache.set_many(
+            {cls.day_version_key(hall_id, date_val): version for hall_id, date_val in set(pairs)},
+            None,
+        )
+
+    @classmethod
+    def bump(cls, *hall_ids):
+        """Сбрасывает кэш указанных залов и списка залов"""
+        if not cls.shared():
+            return
+        version = time.time_ns()
+        cache.set_many(
+            {cls.hall_version_key(hall_id): version for hall_id in hall_ids if hall_id},
+            None,
+        )
+        cache.set(cls.HALLS_VERSION_KEY, version, None)
+
+    @classmethod
+    def _get_or_load(cls, key, loader):
+        if not cls.shared():
+            return loader()
+        return cache.get_or_set(key, loader, settings.REFERENCE_CACHE_TIMEOUT)
+
+    @classmethod
+    def get_hall_data(cls, hall_id, name, loader):
+        """Значение name зала из кэша; loader() вызывается только при промахе"""
+        version = cls._version(cls.hall_version_key(hall_id))
+        return cls._get_or_load(f"hall:{hall_id}:v{version}:{name}", loader)
+
+    @classmethod
+    def halls(cls):
+        """Все залы со статистикой столиков (HallQuerySet.with_table_stats)"""
+        from .models import Hall
+
+        def load():
+            return list(Hall.objects.using(DEFAULT_DB_ALIAS).with_table_stats().order_by('id'))
+
+        version = cls._version(cls.HALLS_VERSION_KEY)
+        return cls._get_or_load(f"halls:v{version}:list", load)
+
+    @classmethod
+    def halls_with_stats(cls, date_val=None):
+        """
+        Залы со статистикой столиков и занятых мест на дату (HallQuerySet.with_stats).
+        Места кэшируются по меткам изменения дня всех залов: любая бронь зала
+        на эту дату меняет ключ, и следующий запрос пересчитает статистику.
+        Пересчёт идёт по основной базе — общий кэш не должен запомнить
+        отстающую реплику под новыми метками.
+        """
+        from .models import Hall
+
+        date_val = date_val or timezone.localdate()
+        halls = cls.halls()
+
+        def load():
+            return {
+                pk: (today, tonight)
+                for pk, today, tonight in Hall.objects.using(DEFAULT_DB_ALIAS)
+                .with_booking_stats(date_val)
+                .values_list('pk', 'seats_booked_today', 'seats_booked_tonight')
+            }
+
+        if cls.shared():
+            keys = [cls.day_version_key(hall.pk, date_val) for hall in halls]
+            versions = cache.get_many(keys)
+            tokens = '-'.join(str(versions.get(key) or cls._version(key)) for key in keys)
+            digest = hashlib.md5(tokens.encode()).hexdigest()
+            seats = cls._get_or_load(f"halls:seats:{date_val.isoformat()}:{digest}", load)
+        else:
+            seats = load()
+        for hall in halls:
+            hall.seats_booked_today, hall.seats_booked_tonight = seats.get(hall.pk, (0, 0))
+        return halls
+
+    @classmethod
+    def hall(cls, hall_id):
+        """Зал по id или None"""
+        from .models import Hall
+        return cls.get_hall_data(
+            hall_id, 'hall', lambda: Hall.objects.using(DEFAULT_DB_ALIAS).filter(pk=hall_id).first(),
+        )
+
+    @classmethod
+    def tables(cls, hall_id):
+        """Все столики зала (включая неактивные) в порядке Table.Meta.ordering"""
+        from .models import Table
+        return cls.get_hall_data(
+            hall_id, 'tables', lambda: list(Table.objects.using(DEFAULT_DB_ALIAS).filter(hall_id=hall_id)),
+        )
+
+    # Асинхронные варианты чтения для async-представлений: те же ключи и версии,
+    # данные загружаются через асинхронный ORM
+
+    @classmethod
+    async def _aversion(cls, key):
+        if not cls.shared():
+            return None
+        version = await cache.aget(key)
+        if version is None:
+            await cache.aadd(key, time.time_ns(), None)
+            version = await cache.aget(key)
+        return version
+
+    @classmethod
+    async def ahall_version(cls, hall_id):
+        return await cls._aversion(cls.hall_version_key(hall_id))
+
+    @classmethod
+    async def aday_version(cls, hall_id, date_val):
+        return await cls._aversion(cls.day_version_key(hall_id, date_val))
+
+    @classmethod
+    async def _aget_or_load(cls, key, loader):
+        if not cls.shared():
+            return await loader()
+        missing = object()
+        value = await cache.aget(key, missing)
+        if value is missing:
+            value = await loader()
+            await cache.aadd(key, value, settings.REFERENCE_CACHE_TIMEOUT)
+        return value
+
+    @classmethod
+    async def aget_hall_data(cls, hall_id, name, loader):
+        """Асинхронный get_hall_data; loader — корутинная функция"""
+        version = await cls.ahall_version(hall_id)
+        return await cls._aget_or_load(f"hall:{hall_id}:v{version}:{name}", loader)
+
+    @classmethod
+    async def ahalls(cls):
+        from .models import Hall
+
+        async def load():
+            return [hall async for hall in Hall.objects.using(DEFAULT_DB_ALIAS).with_table_stats().order_by('id')]
+
+        version = await cls._aversion(cls.HALLS_VERSION_KEY)
+        return await cls._aget_or_load(f"halls:v{version}:list", load)
+
+    @classmethod
+    async def ahall(cls, hall_id):
+        from .models import Hall
+        return await cls.aget_hall_data(
+            hall_id, 'hall', lambda: Hall.objects.using(DEFAULT_DB_ALIAS).filter(pk=hall_id).afirst(),
+        )
+
+    @classmethod
+    async def atables(cls, hall_id):
+        from .models import Table
+
+        async def load():
+            return [table async for table in Table.objects.using(DEFAULT_DB_ALIAS).filter(hall_id=hall_id)]
+
+        return await cls.aget_hall_data(hall_id, 'tables', load)
@@ -1,8 +1,11 @@
+from datetime import timedelta
+
 from django import forms
 from django.core.exceptions import ValidationError
 from django.forms import BooleanField
-from reservation.models import Reservation, Hall
-from reservation.validators import FormValidator
+from reservation.models import Reservation, Hall, ReservationSeries, Table, WaitlistEntry
+from reservation.series import SeriesBooking
+from reservation.validators import FormValidator, ReservationValidator
 
 
 class StyleFormMixin:
@@ -83,6 +86,138 @@ class ReservationForm(StyleFormMixin, forms.ModelForm):
 
         return cleaned_data
 
+class ReservationSeriesForm(forms.ModelForm):
+    """
+    Форма серии броней для админки и API.
+    Проверяет все повторения сразу; план сохраняется в self.plan,
+    занятые даты — в self.plan.conflicts.
+    """
+
+    skip_conflicts = forms.BooleanField(
+        required=False,
+        label="Пропустить занятые даты",
+        help_text="Иначе серия не создаётся, если хотя бы одна дата занята",
+    )
+
+    class Meta:
+        model = ReservationSeries
+        fields = [
+            "user", "tables", "first_date", "frequency", "interval", "count", "until",
+            "start_time", "duration", "guests_count", "event",
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plan = None
+        if "tables" in self.fields:
+            self.fields["tables"].queryset = Table.objects.filter(is_active=True).select_related("hall")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance.pk or self.errors:
+            return cleaned_data
+
+        tables = list(cleaned_data["tables"])
+        guests_count = cleaned_data["guests_count"]
+        duration = cleaned_data["duration"]
+        series = ReservationSeries(**{
+            name: cleaned_data[name]
+            for name in ("first_date", "frequency", "interval", "count", "until")
+        })
+
+        if cleaned_data["count"] is None and cleaned_data["until"] is None:
+            raise ValidationError("Укажите количество повторений или дату окончания серии")
+        if cleaned_data["until"] and cleaned_data["until"] < cleaned_data["first_date"]:
+            self.add_error("until", "Дата окончания раньше первой даты")
+        elif cleaned_data["count"] is None and (
+            (cleaned_data["until"] - cleaned_data["first_date"]) // series.step >= ReservationSeries.MAX_OCCURRENCES
+        ):
+            self.add_error(
+                "until",
+                f"В серии больше {ReservationSeries.MAX_OCCURRENCES} повторений: "
+                f"укажите более раннюю дату окончания или количество повторений",
+            )
+        try:
+            ReservationValidator.validate_date_not_in_past(cleaned_data["first_date"])
+        except ValidationError as e:
+            self.add_error("first_date", e)
+        try:
+            ReservationValidator.validate_working_hours(cleaned_data["start_time"])
+        except ValidationError as e:
+            self.add_error("start_time", e)
+
+        if duration <= timedelta(0):
+            self.add_error("duration", "Длительность должна быть больше нуля")
+        elif duration > series.step:
+            self.add_error("duration", "Брони серии пересекаются: длительность больше шага повторения")
+        if guests_count < len(tables):
+            self.add_error("guests_count", f"На каждый из {len(tables)} столиков нужен хотя бы один гость")
+        capacity = sum(table.capacity for table in tables)
+        if guests_count > capacity:
+            self.add_error("guests_count", f"Гостей ({guests_count}) больше общей вместимости столиков ({capacity})")
+        if self.errors:
+            return cleaned_data
+
+        self.plan = SeriesBooking.plan(
+            tables, series.occurrences(), cleaned_data["start_time"], duration, guests_count
+        )
+        if not self.plan.slots:
+            raise ValidationError("Все даты серии заняты")
+        if self.plan.conflicts and not cleaned_data.get("skip_conflicts"):
+            raise ValidationError([
+                f"{date_val:%d.%m.%Y}: {'; '.join(reasons)}"
+                for date_val, reasons in sorted(self.plan.conflicts.items())
+            ])
+        return cleaned_data
+
+
+class WaitlistForm(StyleFormMixin, forms.ModelForm):
+    """
+    Запись в лист ожидания: зал, дата, окно времени начала и число гостей.
+    """
+
+    class Meta:
+        model = WaitlistEntry
+        fields = ["hall", "date", "earliest_time", "latest_time", "guests_count"]
+        widgets = {
+            'date': forms.DateInput(attrs={'type': 'date'}),
+            'earliest_time': forms.TimeInput(attrs={'type': 'time'}),
+            'latest_time': forms.TimeInput(attrs={'type': 'time'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors:
+            return cleaned_data
+
+        hall = cleaned_data['hall']
+        date_val = cleaned_data['date']
+        earliest_time = cleaned_data['earliest_time']
+        latest_time = cleaned_data['latest_time']
+        for field_name, validate, value in (
+            ('date', ReservationValidator.validate_date_not_in_past, date_val),
+            ('earliest_time', ReservationValidator.validate_working_hours, earliest_time),
+            ('latest_time', ReservationValidator.validate_working_hours, latest_time),
+        ):
+            try:
+                validate(value)
+            except ValidationError as e:
+                self.add_error(field_name, e)
+        if earliest_time > latest_time:
+            self.add_error('latest_time', "Окно заканчивается раньше, чем начинается")
+        if not hall.tables.filter(is_active=True, capacity__gte=cleaned_data['guests_count']).exists():
+            self.add_error('guests_count', "В этом зале нет столика на столько гостей")
+        if self.user and WaitlistEntry.objects.filter(
+            user=self.user, hall=hall, date=date_val, status='waiting'
+        ).exists():
+            raise ValidationError("Вы уже в листе ожидания этого зала на эту дату")
+        return cleaned_data
+
+
 class FeedbackForm(forms.Form):
     name = forms.CharField(max_length=100, label="Ваше имя")
     email = forms.EmailField(label="Email")
@@ -0,0 +1,133 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+# Расширение файла → формат Pillow и параметры сохранения
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Значения EXIF Orientation с поворотом на 90°: ширина и высота меняются местами
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class HallImage:
+    """
+    Уменьшенные копии изображения зала для srcset.
+
+    Копии лежат рядом с оригиналом: halls/main_hall.jpg →
+    halls/main_hall_w640.webp, halls/main_hall_w640.jpg и т.д. Ширины —
+    settings.HALL_IMAGE_WIDTHS, не больше ширины оригинала. Для JPEG
+    декодер сразу уменьшает картинку (Image.draft), поэтому полный
+    битмап большого снимка в память не загружается.
+    """
+
+    @staticmethod
+    def validate(file):
+        """
+        Отклоняет слишком тяжёлые и слишком большие по пикселям файлы.
+        Читается только заголовок изображения, без декодирования.
+        """
+        if file.size > settings.HALL_IMAGE_MAX_UPLOAD_SIZE:
+            raise ValidationError(
+                f"Файл больше {settings.HALL_IMAGE_MAX_UPLOAD_SIZE // (1024 * 1024)} МБ",
+                code='image',
+            )
+        position = file.tell()
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            raise ValidationError("Не удалось прочитать изображение", code='image')
+        finally:
+            file.seek(position)
+        if width * height > settings.HALL_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                f"Изображение {width}×{height} слишком большое, "
+                f"допустимо не более {settings.HALL_IMAGE_MAX_PIXELS // 1_000_000} Мп",
+                code='image',
+            )
+
+    @staticmethod
+    def derivative_name(name, width, extension):
+        base, _ = os.path.splitext(name)
+        return f"{base}_w{width}.{extension}"
+
+    @staticmethod
+    def widths_for(original_width):
+        """Ширины копий для оригинала: стандартные меньше него и сама ширина оригинала, если он не крупнее их"""
+        widths = [width for width in settings.HALL_IMAGE_WIDTHS if width < original_width]
+        if original_width <= max(settings.HALL_IMAGE_WIDTHS):
+            widths.append(original_width)
+        return widths
+
+    @staticmethod
+    def display_size(image):
+        """Размер изображения после поворота по EXIF (exif_transpose)"""
+        if image.getexif().get(ExifTags.Base.Orientation) in TRANSPOSED_ORIENTATIONS:
+            return image.height, image.width
+        return image.size
+
+    @classmethod
+    def generate(cls, name):
+        """Создаёт копии всех ширин и форматов; возвращает список созданных ширин"""
+        with default_storage.open(name, 'rb') as file:
+            with Image.open(file) as image:
+                width, height = cls.display_size(image)
+                widths = cls.widths_for(width)
+                largest = max(widths)
+                # Масштабирование при декодировании JPEG до ближайшего размера не меньше нужного;
+                # draft работает с размером до поворота
+                size = (largest, largest * height // width)
+                if (width, height) != image.size:
+                    size = size[::-1]
+                image.draft('RGB', size)
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+                for width in sorted(widths, reverse=True):
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image.resize((width, height), Image.LANCZOS)
+                    for extension, (fmt, options) in FORMATS.items():
+                        target = resized.convert('RGB') if fmt == 'JPEG' else resized
+                        buffer = io.BytesIO()
+                        target.save(buffer, fmt, **options)
+                        derivative = cls.derivative_name(name, width, extension)
+                        if default_storage.exists(derivative):
+                            default_storage.delete(derivative)
+                        default_storage.save(derivative, ContentFile(buffer.getvalue()))
+                    # Следующая ширина меньше — уменьшаем уже уменьшенную копию
+                    image = resized
+        return sorted(widths)
+
+    @classmethod
+    def delete(cls, name):
+        """Удаляет копии изображения (при замене или удалении оригинала)"""
+        directory, filename = os.path.split(name)
+        prefix = f"{os.path.splitext(filename)[0]}_w"
+        try:
+            _, files = default_storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for file in files:
+            base, extension = os.path.splitext(file)
+            if base.startswith(prefix) and base[len(prefix):].isdigit() and extension[1:] in FORMATS:
+                default_storage.delete(os.path.join(directory, file))
+
+    @classmethod
+    def srcset(cls, name, widths):
+        """{'webp': 'url 320w, ...', 'jpg': '...'} по уже созданным ширинам"""
+        return {
+            extension: ', '.join(
+                f"{default_storage.url(cls.derivative_name(name, width, extension))} {width}w"
+                for width in widths
+            )
+            for extension in FORMATS
+        }
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import re
+import weakref
+from datetime import date
+from urllib.parse import parse_qs
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+
+from reservation.availability import TableAvailability
+from reservation.caching import ReferenceCache
+from reservation.occupancy import OccupancyIndex
+from reservation.validators import ReservationValidator
+
+logger = logging.getLogger(__name__)
+
+# Хаб привязан к циклу событий, в котором открыл соединение подписки
+_hubs = weakref.WeakKeyDictionary()
+
+
+async def outside_request(query):
+    """
+    Запрос к базе вне цикла запроса Django: сигналы request_started и
+    request_finished здесь не приходят, поэтому устаревшие соединения
+    потока базы закрываются до и после запроса.
+    """
+    await sync_to_async(close_old_connections)()
+    try:
+        return await query
+    finally:
+        await sync_to_async(close_old_connections)()
+
+
+class HallDayFeed:
+    """Подписчики одной пары (зал, дата) и последняя отправленная им занятость"""
+
+    def __init__(self, hall_id, date_val):
+        self.hall_id = hall_id
+        self.date_val = date_val
+        self.queues = set()
+        self.matrix = None
+        self.lock = asyncio.Lock()
+
+    async def refresh(self):
+        """Пересчитывает занятость дня; возвращает столики, у которых она изменилась"""
+        async with self.lock:
+            matrix = await outside_request(TableAvailability.aday_matrix(self.hall_id, self.date_val))
+            previous = {table['id']: table for table in self.matrix['tables']} if self.matrix else {}
+            self.matrix = matrix
+            return [table for table in matrix['tables'] if previous.get(table['id']) != table]
+
+    def broadcast(self, event):
+        for queue in list(self.queues):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: закрываем его поток, браузер
+                # переподключится и получит свежий снимок
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.queues.discard(queue)
+
+
+class AvailabilityHub:
+    """
+    Общая подписка процесса на изменения занятости.
+
+    Одно соединение Redis pub/sub на цикл событий; канал пары (зал, дата)
+    подписан, пока её смотрит хотя бы один клиент. На сообщение из канала
+    (OccupancyIndex.apply и invalidate) занятость дня пересчитывается один
+    раз для всех клиентов, им рассылаются только изменившиеся столики.
+    """
+
+    def __init__(self, url):
+        # Без socket_timeout: соединение подписки подолгу ждёт сообщений
+        self.client = redis.asyncio.Redis.from_url(
+            url, socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.feeds = {}
+        self.reader = None
+
+    @classmethod
+    def get(cls):
+        """Хаб текущего цикла событий или None, если Redis не настроен"""
+        url = settings.REDIS_URL
+        if not url:
+            return None
+        hubs = _hubs.setdefault(asyncio.get_running_loop(), {})
+        if url not in hubs:
+            hubs[url] = cls(url)
+        return hubs[url]
+
+    async def join(self, hall_id, date_val):
+        """Подключает клиента; возвращает (feed, очередь событий)"""
+        channel = OccupancyIndex.channel(hall_id, date_val)
+        feed = self.feeds.get(channel)
+        if feed is None:
+            feed = self.feeds[channel] = HallDayFeed(hall_id, date_val)
+        queue = asyncio.Queue(maxsize=settings.AVAILABILITY_STREAM_QUEUE)
+        feed.queues.add(queue)
+        try:
+            async with feed.lock:
+                if feed.matrix is None:
+                    # Сначала подписка, потом снимок: изменение между ними не потеряется
+                    await self.pubsub.subscribe(channel)
+                    if self.reader is None or self.reader.done():
+                        self.reader = asyncio.create_task(self.read())
+                    feed.matrix = await outside_request(TableAvailability.aday_matrix(hall_id, date_val))
+        except BaseException:
+            await self.leave(feed, queue)
+            raise
+        return feed, queue
+
+    async def leave(self, feed, queue):
+        feed.queues.discard(queue)
+        channel = OccupancyIndex.channel(feed.hall_id, feed.date_val)
+        if feed.queues or self.feeds.get(channel) is not feed:
+            return
+        del self.feeds[channel]
+        try:
+            await self.pubsub.unsubscribe(channel)
+            if channel in self.feeds:
+                # Пока отписывались, пару открыл новый клиент
+                await self.pubsub.subscribe(channel)
+        except redis.RedisError:
+            logger.warning("Не удалось отписаться от %s", channel, exc_info=True)
+
+    async def read(self):
+        """Читает сообщения подписки, пока есть хотя бы одна пара"""
+        while self.feeds:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                # Пачка изменений (массовое действие) — один пересчёт на пару
+                channels = {message['channel'].decode()}
+                while message := await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=0):
+                    channels.add(message['channel'].decode())
+            except redis.RedisError:
+                logger.warning("Подписка на изменения занятости прервана", exc_info=True)
+                await self.close_all()
+                return
+
+            for channel in channels:
+                feed = self.feeds.get(channel)
+                if feed is None:
+                    continue
+                try:
+                    tables = await feed.refresh()
+                except Exception:
+                    logger.warning("Не удалось пересчитать занятость %s", channel, exc_info=True)
+                    continue
+                if tables:
+                    feed.broadcast({'tables': tables})
+
+    async def close_all(self):
+        """Закрывает потоки всех клиентов; при переподключении подписка откроется заново"""
+        feeds = list(self.feeds.values())
+        self.feeds.clear()
+        for feed in feeds:
+            for queue in list(feed.queues):
+                feed.queues.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+        pubsub, self.pubsub = self.pubsub, self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.aclose()
+        except redis.RedisError:
+            pass
+
+
+class AvailabilityStream:
+    """
+    ASGI-приложение потока занятости зала на день (Server-Sent Events):
+
+        GET /api/hall-day/<hall_id>/stream/?date=YYYY-MM-DD
+
+    Первое событие snapshot — занятость в формате HallDayAvailabilityView,
+    дальше события delta со списком изменившихся столиков. Обрабатывается
+    до Django, чтобы отключение клиента (http.disconnect) сразу освобождало
+    подписку. Без Redis отвечает 204: браузер не будет переподключаться.
+
+    Middleware Django здесь не работает, поэтому ALLOWED_HOSTS и заголовки
+    SecurityMiddleware, применимые к потоку, проверяются и ставятся здесь же.
+    """
+
+    PATH = re.compile(r'^/api/hall-day/(?P<hall_id>\d+)/stream/$')
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = scope['type'] == 'http' and self.PATH.match(scope['path'])
+        if not match:
+            return await self.application(scope, receive, send)
+
+        if not self.allowed_host(scope):
+            return await self.respond(send, 400, 'Недопустимый заголовок Host')
+        if scope['method'] != 'GET':
+            return await self.respond(send, 405, 'Метод не поддерживается', [(b'allow', b'GET')])
+        try:
+            query = parse_qs(scope['query_string'].decode())
+            date_val = date.fromisoformat(query['date'][0])
+            ReservationValidator.validate_date_not_in_past(date_val)
+        except (KeyError, ValueError) as e:
+            return await self.respond(send, 400, f'Неверный формат данных: {e}')
+        except ValidationError as e:
+            return await self.respond(send, 400, e.message)
+
+        hall_id = int(match['hall_id'])
+        if await outside_request(ReferenceCache.ahall(hall_id)) is None:
+            return await self.respond(send, 404, 'Зал не найден')
+
+        hub = AvailabilityHub.get()
+        if hub is None:
+            return await self.respond(send, 204, '')
+
+        try:
+            feed, queue = await hub.join(hall_id, date_val)
+        except redis.RedisError:
+            logger.warning("Поток занятости недоступен", exc_info=True)
+            return await self.respond(send, 503, 'Поток занятости временно недоступен')
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                    *self.security_headers(scope),
+                ],
+            })
+            await self.send_event(send, 'snapshot', feed.matrix)
+
+            stream = asyncio.create_task(self.stream(send, queue))
+            disconnect = asyncio.create_task(self.wait_disconnect(receive))
+            done, pending = await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            if stream in done:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            await hub.leave(feed, queue)
+
+    async def stream(self, send, queue):
+        heartbeat = settings.AVAILABILITY_STREAM_HEARTBEAT
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            if event is None:
+                return
+            await self.send_event(send, 'delta', event)
+
+    @staticmethod
+    def allowed_host(scope):
+        """Проверка Host по ALLOWED_HOSTS, как в HttpRequest.get_host"""
+        headers = dict(scope['headers'])
+        host = headers.get(b'host', b'').decode('latin-1')
+        if settings.USE_X_FORWARDED_HOST and b'x-forwarded-host' in headers:
+            host = headers[b'x-forwarded-host'].decode('latin-1')
+        allowed_hosts = settings.ALLOWED_HOSTS
+        if settings.DEBUG and not allowed_hosts:
+            allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+        domain, _ = split_domain_port(host)
+        return bool(domain) and validate_host(domain, allowed_hosts)
+
+    @staticmethod
+    def security_headers(scope):
+        """Заголовки SecurityMiddleware, которые имеют смысл для потока событий"""
+        headers = []
+        if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+            headers.append((b'x-content-type-options', b'nosniff'))
+        if settings.SECURE_REFERRER_POLICY:
+            policy = settings.SECURE_REFERRER_POLICY
+            if not isinstance(policy, str):
+                policy = ','.join(policy)
+            headers.append((b'referrer-policy', policy.encode()))
+        if settings.SECURE_HSTS_SECONDS and scope.get('scheme') == 'https':
+            value = f'max-age={settings.SECURE_HSTS_SECONDS}'
+            if settings.SECURE_HSTS_INCLUDE_SUBDOMAINS:
+                value += '; includeSubDomains'
+            if settings.SECURE_HSTS_PRELOAD:
+                value += '; preload'
+            headers.append((b'strict-transport-security', value.encode()))
+        return headers
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def send_event(send, name, data):
+        body = f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+        await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+
+    @staticmethod
+    async def respond(send, status, text, headers=()):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8'), *headers],
+        })
+        await send({'type': 'http.response.body', 'body': text.encode()})
@@ -0,0 +1,231 @@
+import json
+import random
+import statistics
+import subprocess
+import time as timer
+from contextlib import ExitStack
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from reservation.models import Hall, Reservation, Table
+from reservation.occupancy import get_redis
+from users.models import User
+
+START_TIMES = [time(10, 0), time(13, 0), time(16, 0), time(19, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет задержку основных страниц и API на отдельной тестовой базе "
+        "с заданным объёмом данных и выводит p50/p95/p99 и число SQL-запросов в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--halls', type=int, default=4, help="Количество залов")
+        parser.add_argument('--tables', type=int, default=30, help="Столиков в каждом зале")
+        parser.add_argument('--months', type=int, default=3, help="Глубина истории броней в месяцах")
+        parser.add_argument('--bookings-per-day', type=int, default=2,
+                            help="Броней на столик в день (не больше 4)")
+        parser.add_argument('--users', type=int, default=200, help="Количество гостей")
+        parser.add_argument('--iterations', type=int, default=100, help="Замеров на сценарий (не меньше 2)")
+        parser.add_argument('--warmup', type=int, default=10, help="Прогревочных запросов на сценарий")
+        parser.add_argument('--seed', type=int, default=42, help="Seed генератора данных")
+        parser.add_argument('--redis-url', default='',
+                            help="Отдельная база Redis для индекса и кэша; очищается перед запуском")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Не удалять тестовую базу и не пересоздавать данные")
+        parser.add_argument('--output', help="Файл для JSON-отчёта (по умолчанию stdout)")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError("Для перцентилей нужно не меньше 2 замеров (--iterations)")
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        if options['redis_url']:
+            caches = {'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': options['redis_url'],
+            }}
+
+        try:
+            # Тестовая база создаётся только для default: реплики из настроек
+            # указывают на рабочие базы, поэтому чтения с них отключены
+            with override_settings(
+                REDIS_URL=options['redis_url'], CACHES=caches, ALLOWED_HOSTS=['*'], DATABASE_REPLICAS=[],
+            ):
+                if options['redis_url']:
+                    get_redis().flushdb()
+                if not (options['keepdb'] and Reservation.objects.exists()):
+                    self.seed(options)
+                report = self.run_scenarios(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def seed(options):
+        """Залы, столики, гости и брони за options['months'] месяцев назад и месяц вперёд"""
+        rnd = random.Random(options['seed'])
+
+        halls = Hall.objects.bulk_create([
+            Hall(name=f"Зал {number}", width=20, height=20) for number in range(1, options['halls'] + 1)
+        ])
+        tables = Table.objects.bulk_create([
+            Table(
+                hall=hall,
+                number=str(number + 1),
+                capacity=rnd.choice([2, 2, 4, 4, 6, 8]),
+                x_position=number % 20,
+                y_position=number // 20,
+            )
+            for hall in halls
+            for number in range(min(options['tables'], 400))
+        ])
+        users = User.objects.bulk_create([
+            User(email=f"guest{number}@example.com", is_active=True) for number in range(options['users'])
+        ])
+
+        today = timezone.localdate()
+        first_day = today - timedelta(days=30 * options['months'])
+        bookings_per_day = min(options['bookings_per_day'], len(START_TIMES))
+        batch = []
+        day = first_day
+        while day <= today + timedelta(days=30):
+            for table in tables:
+                for start_time in rnd.sample(START_TIMES, bookings_per_day):
+                    reservation = Reservation(
+                        user=rnd.choice(users),
+                        table=table,
+                        date=day,
+                        start_time=start_time,
+                        guests_count=rnd.randint(1, table.capacity),
+                        status='completed' if day < today else rnd.choice(['confirmed', 'confirmed', 'canceled']),
+                    )
+                    batch.append(reservation)
+                if len(batch) >= 5000:
+                    Reservation.objects.bulk_create(batch)
+                    batch = []
+            day += timedelta(days=1)
+        Reservation.objects.bulk_create(batch)
+
+    @staticmethod
+    def measure(client, request, options):
+        """Прогоняет сценарий и возвращает перцентили задержки и число запросов"""
+        for iteration in range(options['warmup']):
+            request(client, iteration)
+
+        durations, queries, statuses = [], [], set()
+        for iteration in range(options['warmup'], options['warmup'] + options['iterations']):
+            # Запросы считаются по всем открытым соединениям, а не только по default
+            with ExitStack() as stack:
+                captured = [
+                    stack.enter_context(CaptureQueriesContext(db))
+                    for db in connections.all(initialized_only=True)
+                ]
+                started = timer.perf_counter()
+                response = request(client, iteration)
+                durations.append((timer.perf_counter() - started) * 1000)
+            queries.append(sum(len(context) for context in captured))
+            statuses.add(response.status_code)
+
+        percentiles = statistics.quantiles(durations, n=100, method='inclusive')
+        return {
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'mean_ms': round(statistics.fmean(durations), 3),
+            'queries': {'min': min(queries), 'median': statistics.median(queries), 'max': max(queries)},
+            'status_codes': sorted(statuses),
+        }
+
+    def run_scenarios(self, options):
+        hall = Hall.objects.order_by('id').first()
+        tables = list(Table.objects.filter(hall=hall).order_by('id'))
+        guest = User.objects.order_by('id').first()
+        staff, _ = User.objects.get_or_create(
+            email="benchmark-staff@example.com", defaults={'is_staff': True, 'is_active': True}
+        )
+        busy_day = (timezone.localdate() + timedelta(days=7)).isoformat()
+        # Новые брони создаются за пределами засеянных дат, чтобы не упираться в занятость
+        free_day = timezone.localdate() + timedelta(days=60)
+        Reservation.objects.filter(date__gte=free_day).delete()
+        started_at = timezone.now()
+
+        guest_client = Client()
+        guest_client.force_login(guest)
+        staff_client = Client()
+        staff_client.force_login(staff)
+        anonymous_client = Client()
+
+        def create_reservation(client, iteration):
+            table = tables[iteration % len(tables)]
+            start_time = START_TIMES[(iteration // len(tables)) % len(START_TIMES)]
+            day = free_day + timedelta(days=iteration // (len(tables) * len(START_TIMES)))
+            return client.post('/reservation/create/', {
+                'hall': hall.id,
+                'table': table.id,
+                'date': day.isoformat(),
+                'start_time': start_time.strftime('%H:%M'),
+                'guests_count': 1,
+                'duration': '03:00:00',
+            })
+
+        scenarios = {
+            'tables_by_hall': (anonymous_client, lambda client, iteration: client.get(
+                f'/api/tables-by-hall/{hall.id}/',
+                {'date': busy_day, 'time': START_TIMES[iteration % len(START_TIMES)].strftime('%H:%M'), 'guests': 2},
+            )),
+            'reservation_list': (staff_client, lambda client, iteration: client.get('/reservation/list/')),
+            'profile': (guest_client, lambda client, iteration: client.get('/profile/')),
+            'hall_schema': (anonymous_client, lambda client, iteration: client.get(f'/hall/{hall.id}/schema/')),
+            'reservation_create': (guest_client, create_reservation),
+        }
+
+        results = {
+            name: self.measure(client, request, options)
+            for name, (client, request) in scenarios.items()
+        }
+
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'meta': {
+                'commit': commit,
+                'started_at': started_at.isoformat(),
+                'database': connection.settings_dict['NAME'],
+                'redis': bool(options['redis_url']),
+                'scale': {
+                    'halls': options['halls'],
+                    'tables_per_hall': options['tables'],
+                    'months': options['months'],
+                    'bookings_per_day': options['bookings_per_day'],
+                    'users': options['users'],
+                    'reservations': Reservation.objects.count(),
+                },
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
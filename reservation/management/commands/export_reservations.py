@@ -0,0 +1,33 @@
+import sys
+from datetime import date
+
+from django.core.management import BaseCommand
+
+from reservation.models import Reservation
+from reservation.transfer import ReservationTransfer, detect_format
+
+
+class Command(BaseCommand):
+    help = "Выгружает брони в CSV или JSONL через COPY, не загружая их в память."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Файл выгрузки (по умолчанию stdout)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Формат; по умолчанию определяется по расширению файла")
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help="С даты (ГГГГ-ММ-ДД)")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help="По дату (ГГГГ-ММ-ДД)")
+        parser.add_argument('--status', action='append', dest='statuses',
+                            choices=[choice for choice, _ in Reservation.STATUS_CHOICES],
+                            help="Статус брони; можно указать несколько раз")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path or '', options['format'])
+        filters = {name: options[name] for name in ('date_from', 'date_to', 'statuses')}
+
+        if path:
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                count = ReservationTransfer.export(file, fmt, **filters)
+            self.stderr.write(f"Выгружено броней: {count}")
+        else:
+            ReservationTransfer.export(sys.stdout, fmt, **filters)
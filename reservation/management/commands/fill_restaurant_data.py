@@ -1,48 +1,203 @@
 import json
-from django.core.management import BaseCommand
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+
+from reservation.caching import ReferenceCache
 from reservation.models import Hall, Table
+from reservation.tasks import generate_hall_image_derivatives
 
+DEFAULT_FIXTURE = os.path.join(settings.BASE_DIR, 'reservation', 'fixtures', 'restaurant_data.json')
 
-class Command(BaseCommand):
+HALL_FIELDS = ['name', 'description', 'image', 'width', 'height']
+TABLE_FIELDS = ['hall', 'number', 'capacity', 'x_position', 'y_position', 'is_active']
+# Столик узнаётся по залу и номеру: первичный ключ из фикстуры не используется
+TABLE_UPDATE_FIELDS = ['capacity', 'x_position', 'y_position', 'is_active']
 
-    @staticmethod
-    def json_read_halls():
-        with open('reservation/fixture/restaurant_data.json', 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            halls = []
-            for item in data:
-                if item['model'] == 'reservation.hall':
-                    halls.append(item)
-            return halls
 
+def iter_fixture(path, chunk_size=64 * 1024):
+    """
+    Объекты фикстуры (JSON-массив в формате dumpdata) по одному.
+    Файл читается кусками, в памяти держится только текущий объект
+    и непрочитанный хвост буфера.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # Пропускаем пробелы и разделители между объектами
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    raise CommandError(f"{path}: файл оборвался до конца массива")
+                buffer = file.read(chunk_size)
+                position = 0
+                eof = not buffer
+                continue
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError(f"{path}: ожидается JSON-массив объектов")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Объект не поместился в буфер целиком — дочитываем
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    raise CommandError(f"{path}: некорректный JSON около позиции {position}")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            position = end
 
-    @staticmethod
-    def json_read_tables():
-        with open('reservation/fixture/restaurant_data.json', 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            tables = []
-            for item in data:
-                if item['model'] == 'reservation.tables':
-                    tables.append(item)
-            return tables
+
+class Command(BaseCommand):
+    help = (
+        "Загружает залы и столики из фикстуры. Файл читается потоково, записи "
+        "обновляются или добавляются пачками в одной транзакции: залы по первичному "
+        "ключу, столики по залу и номеру; существующие брони не затрагиваются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_FIXTURE, help="Путь к фикстуре")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки записей")
 
     def handle(self, *args, **options):
-        Hall.objects.all().delete()
-        Table.objects.all().delete()
-
-        halls_for_create = []
-        for hall in Command.json_read_halls():
-            halls_data = hall["fields"]
-            halls_for_create.append(Hall(id=hall["pk"], **halls_data))
-        Hall.objects.bulk_create(halls_for_create)
-
-        tables_for_create = []
-        for table in Command.json_read_tables():
-            table_data = table["fields"]
-            hall = Hall.objects.get(pk=table_data.pop("hall"))
-            tables_for_create.append(
-                Table(id=table["pk"], category=hall, **table_data)
+        self.batch_size = options['batch_size']
+        self.hall_ids = set()
+        self.touched_hall_ids = set()
+        self.halls = {}
+        self.tables = {}
+        self.counts = {'halls': 0, 'tables': 0}
+        self.image_changes = []
+
+        with transaction.atomic():
+            self.hall_ids = set(Hall.objects.values_list('pk', flat=True))
+            for item in iter_fixture(options['path']):
+                model = item.get('model')
+                if model == 'reservation.hall':
+                    self.add_hall(item)
+                elif model == 'reservation.table':
+                    self.add_table(item)
+            self.flush_tables()
+            self.flush_halls()
+            self.reset_sequences()
+            touched = set(self.touched_hall_ids)
+            transaction.on_commit(lambda: ReferenceCache.bump(*touched))
+            image_changes = list(self.image_changes)
+            transaction.on_commit(lambda: [
+                generate_hall_image_derivatives.delay(hall_id, previous) for hall_id, previous in image_changes
+            ])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено залов: {self.counts['halls']}, столиков: {self.counts['tables']}"
+        ))
+
+    def add_hall(self, item):
+        fields = {name: value for name, value in item['fields'].items() if name in HALL_FIELDS}
+        self.halls[item['pk']] = Hall(pk=item['pk'], **fields)
+        self.hall_ids.add(item['pk'])
+        if len(self.halls) >= self.batch_size:
+            self.flush_halls()
+
+    def add_table(self, item):
+        fields = {name: value for name, value in item['fields'].items() if name in TABLE_FIELDS}
+        hall_id = fields.pop('hall')
+        if hall_id not in self.hall_ids:
+            raise CommandError(f"Столик {item.get('pk')}: зал {hall_id} не найден ни в базе, ни в фикстуре")
+        table = Table(hall_id=hall_id, **fields)
+        # Повтор столика в пачке — побеждает последний, как при повторной загрузке
+        self.tables[(hall_id, table.number)] = table
+        if len(self.tables) >= self.batch_size:
+            self.flush_tables()
+
+    def flush_halls(self):
+        if not self.halls:
+            return
+        # bulk_create обходит сигналы модели, поэтому замену изображения, как
+        # process_hall_image, обрабатываем здесь: копии прежнего файла больше
+        # не подходят, новые создаст фоновая задача после фиксации транзакции
+        existing = {
+            pk: (image or '', widths)
+            for pk, image, widths in Hall.objects.filter(pk__in=self.halls.keys())
+            .values_list('pk', 'image', 'image_widths')
+        }
+        for pk, hall in self.halls.items():
+            previous, widths = existing.get(pk, ('', []))
+            current = hall.image.name or ''
+            if current == previous:
+                hall.image_widths = widths
+            else:
+                hall.image_widths = []
+                self.image_changes.append((pk, previous))
+        Hall.objects.bulk_create(
+            self.halls.values(),
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=[*HALL_FIELDS, 'image_widths'],
+        )
+        self.touched_hall_ids.update(self.halls)
+        self.counts['halls'] += len(self.halls)
+        self.halls = {}
+
+    def flush_tables(self):
+        if not self.tables:
+            return
+        # Залы столиков могут ещё ждать своей пачки
+        self.flush_halls()
+        tables = list(self.tables.values())
+        try:
+            with transaction.atomic():
+                self.upsert_tables(tables)
+        except IntegrityError:
+            # Пачка упёрлась в другое ограничение (например, место в зале
+            # занято другим столиком) — находим и перечисляем такие строки
+            raise CommandError(
+                "Столики не загружены, конфликтующие записи:\n" + "\n".join(self.collisions(tables))
             )
-        Table.objects.bulk_create(tables_for_create)
+        self.touched_hall_ids.update(table.hall_id for table in tables)
+        self.counts['tables'] += len(self.tables)
+        self.tables = {}
+
+    @staticmethod
+    def upsert_tables(tables):
+        Table.objects.bulk_create(
+            tables,
+            update_conflicts=True,
+            unique_fields=['hall', 'number'],
+            update_fields=TABLE_UPDATE_FIELDS,
+        )
 
+    @classmethod
+    def collisions(cls, tables):
+        """Построчная вставка пачки в точках сохранения; сообщения о строках с ошибкой"""
+        errors = []
+        for table in tables:
+            try:
+                with transaction.atomic():
+                    cls.upsert_tables([table])
+            except IntegrityError as e:
+                errors.append(
+                    f"  зал {table.hall_id}, столик №{table.number} "
+                    f"({table.x_position}, {table.y_position}): {str(e).strip().splitlines()[0]}"
+                )
+        return errors or ["  конфликт между строками пачки"]
 
+    @staticmethod
+    def reset_sequences():
+        """Первичные ключи залов заданы явно — двигаем последовательность за максимум"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Hall]):
+                cursor.execute(sql)
@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from reservation.models import Hall
+from reservation.tasks import generate_hall_image_derivatives
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные копии изображений залов, у которых их ещё нет (или у всех с --all)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Пересоздать копии для всех залов")
+
+    def handle(self, *args, **options):
+        halls = Hall.objects.exclude(image='')
+        if not options['all']:
+            halls = halls.filter(image_widths=[])
+        for hall_id in halls.values_list('pk', flat=True):
+            generate_hall_image_derivatives.delay(hall_id)
+            self.stdout.write(f"Зал {hall_id}: поставлен в очередь")
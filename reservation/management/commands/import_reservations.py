@@ -0,0 +1,35 @@
+import os
+
+from django.core.management import BaseCommand
+
+from reservation.transfer import ReservationTransfer, detect_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает брони из CSV или JSONL через COPY. Конфликты с существующими "
+        "бронями и внутри файла проверяются одним проходом по всей пачке, "
+        "отклонённые строки с причиной пишутся в файл отказов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл с бронями")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Формат; по умолчанию определяется по расширению файла")
+        parser.add_argument('--rejects', help="Файл отказов (по умолчанию <path>.rejects.csv)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Только проверить строки и записать отказы, ничего не сохраняя")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        rejects_path = options['rejects'] or f"{os.path.splitext(path)[0]}.rejects.csv"
+
+        with open(path, 'r', encoding='utf-8-sig', newline='') as file, \
+                open(rejects_path, 'w', encoding='utf-8', newline='') as rejects:
+            result = ReservationTransfer.import_file(file, fmt, rejects=rejects, dry_run=options['dry_run'])
+
+        verb = "Прошли проверку" if options['dry_run'] else "Загружено"
+        self.stdout.write(self.style.SUCCESS(f"{verb}: {result['imported']}, отклонено: {result['rejected']}"))
+        if result['rejected']:
+            self.stdout.write(f"Отклонённые строки: {rejects_path}")
@@ -0,0 +1,195 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .routers import ReplicaRouter
+
+logger = logging.getLogger('reservation.instrumentation')
+
+_current_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: считает запросы и их время"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicated(self):
+        """Сколько запросов повторяют уже выполненный SQL (признак N+1)"""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+def current_stats():
+    """Замеры текущего запроса или None вне замеряемого запроса"""
+    return _current_stats.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def _install_query_wrapper(sender=None, connection=None, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _install_on_open_connections():
+    """Соединения текущего потока могли открыться до подключения сигнала"""
+    for connection in connections.all(initialized_only=True):
+        _install_query_wrapper(connection=connection)
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Замеры запроса: число SQL-запросов, их суммарное время, повторяющиеся
+    запросы, время рендеринга шаблонов и общее время.
+
+    Результат отдаётся в заголовке Server-Timing и пишется JSON-строкой в лог
+    'reservation.instrumentation' с именем URL. Включается настройкой
+    REQUEST_INSTRUMENTATION; когда она выключена, Django исключает
+    middleware из цепочки и накладных расходов нет.
+
+    Замеры запроса лежат в ContextVar, который asgiref переносит в потоки
+    sync_to_async. Обёртка запросов ставится на каждое соединение любой базы
+    при его открытии (connection_created), поэтому SQL асинхронных
+    представлений и реплик тоже учитывается. Шаблоны замеряет бэкенд
+    reservation.templating.InstrumentedDjangoTemplates.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_wrapper, dispatch_uid='reservation.instrumentation')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        _install_on_open_connections()
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        # ORM асинхронных представлений работает в потоке sync_to_async этого запроса
+        await sync_to_async(_install_on_open_connections)()
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    @staticmethod
+    def finish(request, response, stats, total):
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.sql_time * 1000:.2f};desc="SQL: {stats.queries} queries, {stats.duplicated} duplicated"',
+            f'tpl;dur={stats.template_time * 1000:.2f};desc="Templates"',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'url_name': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'duplicated_queries': stats.duplicated,
+            'sql_ms': round(stats.sql_time * 1000, 3),
+            'template_ms': round(stats.template_time * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+        }))
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes при чтении с реплик.
+
+    Небезопасные запросы целиком идут в основную базу. Если запрос что-то
+    записал, клиент получает cookie REPLICA_PIN_COOKIE на REPLICA_PIN_SECONDS,
+    и его следующие запросы тоже читают основную базу — новая бронь видна
+    сразу, даже если реплика ещё не догнала. Без DATABASE_REPLICAS
+    middleware исключается из цепочки.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def pinned(request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or settings.REPLICA_PIN_COOKIE in request.COOKIES
+
+    @staticmethod
+    def finish(response, state):
+        if state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = ReplicaRouter.begin(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            state = ReplicaRouter.end(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        token = ReplicaRouter.begin(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = ReplicaRouter.end(token)
+        return self.finish(response, state)
@@ -0,0 +1,108 @@
+# Generated by Django 4.2.2 on 2026-10-18 03:36
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.conf import settings
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+from django.utils import timezone
+
+
+BACKFILL_PERIOD_SQL = """
+    UPDATE reservation_reservation
+    SET period = tstzrange(
+        (date + start_time) AT TIME ZONE %s,
+        (date + start_time + duration) AT TIME ZONE %s,
+        '[)'
+    )
+"""
+
+# Активные брони, пересекающиеся с более ранней активной бронью того же
+# столика: одна сортировка вместо попарного сравнения
+OVERLAPS_SQL = """
+    SELECT id, table_id, lower(period)
+    FROM (
+        SELECT id, table_id, period,
+               max(upper(period)) OVER (
+                   PARTITION BY table_id ORDER BY lower(period), id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) AS previous_end
+        FROM reservation_reservation
+        WHERE status IN ('confirmed', 'completed')
+    ) ordered
+    WHERE previous_end > lower(period)
+    ORDER BY table_id, lower(period)
+"""
+
+SHOWN_OVERLAPS = 20
+
+
+def check_overlaps(apps, schema_editor):
+    """
+    Ограничение не создастся, если в базе уже есть пересечения.
+    Вместо ошибки PostgreSQL показываем сами брони: их нужно отменить
+    или перенести вручную, потом повторить миграцию.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(OVERLAPS_SQL)
+        rows = cursor.fetchall()
+    if rows:
+        lines = [
+            f"  бронь #{pk}: столик #{table_id}, начало {timezone.localtime(starts_at):%d.%m.%Y %H:%M}"
+            for pk, table_id, starts_at in rows[:SHOWN_OVERLAPS]
+        ]
+        if len(rows) > SHOWN_OVERLAPS:
+            lines.append(f"  ... и ещё {len(rows) - SHOWN_OVERLAPS}")
+        raise RuntimeError(
+            "Активные брони пересекаются с более ранними бронями тех же столиков "
+            "(отмените или перенесите их и повторите миграцию):\n" + "\n".join(lines)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0004_alter_hall_image"),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name="reservation",
+            name="period",
+            field=django.contrib.postgres.fields.ranges.DateTimeRangeField(
+                editable=False,
+                help_text="Заполняется автоматически из даты, времени начала и длительности",
+                null=True,
+                verbose_name="Период брони",
+            ),
+        ),
+        migrations.RunSQL(
+            [(BACKFILL_PERIOD_SQL, [settings.TIME_ZONE, settings.TIME_ZONE])],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ожидает подтверждения"),
+                    ("confirmed", "Подтверждено"),
+                    ("canceled", "Отменено"),
+                    ("completed", "Завершено"),
+                ],
+                default="confirmed",
+                max_length=20,
+                verbose_name="Статус",
+            ),
+        ),
+        migrations.RunPython(check_overlaps, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="reservation",
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                condition=models.Q(("status__in", ["confirmed", "completed"])),
+                expressions=[("table", "="), ("period", "&&")],
+                name="exclude_overlapping_reservations",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.2 on 2026-10-18 03:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0005_reservation_period_exclusion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                condition=models.Q(("status", "confirmed")),
+                fields=["date"],
+                name="reservation_confirmed_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.2 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0006_reservation_confirmed_date_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                fields=["date", "start_time", "id"],
+                name="reservation_date_start_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0008_outgoingemail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hall",
+            name="image_widths",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                editable=False,
+                help_text="Заполняется фоновой задачей после загрузки изображения",
+                verbose_name="Ширины уменьшенных копий",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("reservation", "0009_hall_image_widths"),
+    ]
+
+    # Сначала составные индексы, потом удаление одиночных индексов внешних ключей,
+    # чтобы запросы по столику и гостю не оставались без индекса
+    operations = [
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                condition=models.Q(("status__in", ["confirmed", "completed"])),
+                fields=["table", "date"],
+                include=("start_time", "duration", "guests_count"),
+                name="reservation_active_table_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                fields=["user", "date", "start_time", "id"],
+                name="reservation_user_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                fields=["status", "date"], name="reservation_status_date_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="table",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="reservation.table",
+                verbose_name="Столик",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="guest_reservations",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Пользователь",
+            ),
+        ),
+    ]
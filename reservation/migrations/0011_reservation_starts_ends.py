@@ -0,0 +1,102 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:40
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.conf import settings
+from django.db import migrations, models
+
+import reservation.models
+
+
+BACKFILL_SPAN_SQL = """
+    UPDATE reservation_reservation
+    SET starts_at = (date + start_time) AT TIME ZONE %s,
+        ends_at = (date + start_time + duration) AT TIME ZONE %s
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0010_reservation_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reservation",
+            name="starts_at",
+            field=models.DateTimeField(
+                editable=False,
+                help_text="Заполняется автоматически из даты и времени начала",
+                null=True,
+                verbose_name="Начало",
+            ),
+        ),
+        migrations.AddField(
+            model_name="reservation",
+            name="ends_at",
+            field=models.DateTimeField(
+                editable=False,
+                help_text="Заполняется автоматически из начала и длительности",
+                null=True,
+                verbose_name="Окончание",
+            ),
+        ),
+        migrations.RunSQL(
+            [(BACKFILL_SPAN_SQL, [settings.TIME_ZONE, settings.TIME_ZONE])],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="starts_at",
+            field=models.DateTimeField(
+                editable=False,
+                help_text="Заполняется автоматически из даты и времени начала",
+                verbose_name="Начало",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="ends_at",
+            field=models.DateTimeField(
+                editable=False,
+                help_text="Заполняется автоматически из начала и длительности",
+                verbose_name="Окончание",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="reservation",
+            name="exclude_overlapping_reservations",
+        ),
+        migrations.AddConstraint(
+            model_name="reservation",
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                condition=models.Q(("status__in", ["confirmed", "completed"])),
+                expressions=[
+                    ("table", "="),
+                    (
+                        reservation.models.TsTzRange(
+                            "starts_at",
+                            "ends_at",
+                            django.contrib.postgres.fields.ranges.RangeBoundary(),
+                        ),
+                        "&&",
+                    ),
+                ],
+                name="exclude_overlapping_reservations",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="reservation",
+            name="period",
+        ),
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                condition=models.Q(("status__in", ["confirmed", "completed"])),
+                fields=["ends_at"],
+                include=("starts_at",),
+                name="reservation_active_ends_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:21
+
+import datetime
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("reservation", "0011_reservation_starts_ends"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReservationSeries",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_date", models.DateField(verbose_name="Первая дата")),
+                (
+                    "frequency",
+                    models.CharField(
+                        choices=[("daily", "Ежедневно"), ("weekly", "Еженедельно")],
+                        default="weekly",
+                        max_length=10,
+                        verbose_name="Повторение",
+                    ),
+                ),
+                (
+                    "interval",
+                    models.PositiveSmallIntegerField(
+                        default=1,
+                        help_text="Каждые N дней или недель",
+                        validators=[django.core.validators.MinValueValidator(1)],
+                        verbose_name="Интервал",
+                    ),
+                ),
+                (
+                    "count",
+                    models.PositiveSmallIntegerField(
+                        blank=True,
+                        null=True,
+                        validators=[
+                            django.core.validators.MinValueValidator(1),
+                            django.core.validators.MaxValueValidator(100),
+                        ],
+                        verbose_name="Количество повторений",
+                    ),
+                ),
+                (
+                    "until",
+                    models.DateField(
+                        blank=True, null=True, verbose_name="До даты (включительно)"
+                    ),
+                ),
+                ("start_time", models.TimeField(verbose_name="Время начала")),
+                (
+                    "duration",
+                    models.DurationField(
+                        default=datetime.timedelta(seconds=10800),
+                        verbose_name="Длительность брони",
+                    ),
+                ),
+                (
+                    "guests_count",
+                    models.PositiveSmallIntegerField(
+                        help_text="Распределяются по выбранным столикам",
+                        verbose_name="Гостей всего",
+                    ),
+                ),
+                (
+                    "event",
+                    models.TextField(blank=True, null=True, verbose_name="Событие"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+                (
+                    "staff_user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="created_reservation_series",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Менеджер/админ",
+                    ),
+                ),
+                (
+                    "tables",
+                    models.ManyToManyField(
+                        related_name="+", to="reservation.table", verbose_name="Столики"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reservation_series",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Гость",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Серия броней",
+                "verbose_name_plural": "Серии броней",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="reservation",
+            name="series",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Если бронь создана как часть повторяющейся серии",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="reservations",
+                to="reservation.reservationseries",
+                verbose_name="Серия",
+            ),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:25
+
+import datetime
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("reservation", "0012_reservation_series"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WaitlistEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Дата")),
+                ("earliest_time", models.TimeField(verbose_name="Начало не раньше")),
+                ("latest_time", models.TimeField(verbose_name="Начало не позже")),
+                (
+                    "guests_count",
+                    models.PositiveSmallIntegerField(
+                        validators=[
+                            django.core.validators.MinValueValidator(1),
+                            django.core.validators.MaxValueValidator(12),
+                        ],
+                        verbose_name="Количество гостей",
+                    ),
+                ),
+                (
+                    "duration",
+                    models.DurationField(
+                        default=datetime.timedelta(seconds=10800),
+                        verbose_name="Длительность брони",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("waiting", "Ожидает"),
+                            ("promoted", "Забронировано"),
+                            ("expired", "Истекло"),
+                            ("canceled", "Отменено"),
+                        ],
+                        default="waiting",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+                (
+                    "promoted_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Забронировано"
+                    ),
+                ),
+                (
+                    "hall",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="reservation.hall",
+                        verbose_name="Зал",
+                    ),
+                ),
+                (
+                    "reservation",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="waitlist_entry",
+                        to="reservation.reservation",
+                        verbose_name="Бронь",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="waitlist_entries",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Запись в листе ожидания",
+                "verbose_name_plural": "Лист ожидания",
+                "ordering": ["date", "created_at"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "waiting")),
+                        fields=["hall", "date", "created_at"],
+                        name="waitlist_waiting_idx",
+                    ),
+                    models.Index(
+                        fields=["user", "date"], name="waitlist_user_date_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
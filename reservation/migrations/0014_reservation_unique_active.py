@@ -0,0 +1,35 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0013_waitlist"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="reservation",
+            name="unique_reservation",
+        ),
+        migrations.AlterField(
+            model_name="reservation",
+            name="table",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to="reservation.table",
+                verbose_name="Столик",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="reservation",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["confirmed", "completed"])),
+                fields=("table", "date", "start_time"),
+                name="unique_reservation",
+            ),
+        ),
+    ]
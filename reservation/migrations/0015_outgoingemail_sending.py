@@ -0,0 +1,40 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reservation", "0014_reservation_unique_active"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="outgoingemail",
+            name="outgoingemail_pending_idx",
+        ),
+        migrations.AlterField(
+            model_name="outgoingemail",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "В очереди"),
+                    ("sending", "Отправляется"),
+                    ("sent", "Отправлено"),
+                    ("failed", "Не доставлено"),
+                ],
+                default="pending",
+                max_length=20,
+                verbose_name="Статус",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="outgoingemail",
+            index=models.Index(
+                condition=models.Q(("status__in", ["pending", "sending"])),
+                fields=["next_attempt_at"],
+                name="outgoingemail_pending_idx",
+            ),
+        ),
+    ]
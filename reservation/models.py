@@ -1,11 +1,108 @@
-from datetime import timedelta
-from django.db import models
+from datetime import time, timedelta
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Count, Func, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.utils import timezone
 from datetime import datetime
 
+from reservation.caching import ReferenceCache
+from reservation.images import HallImage
 from reservation.validators import ReservationValidator
 
+ACTIVE_STATUSES = ("confirmed", "completed")
+EVENING_START = time(18, 0)
+
+
+class HallQuerySet(models.QuerySet):
+    def with_table_stats(self):
+        """Число столиков (всех и активных) и общая вместимость зала"""
+        return self.annotate(
+            tables_total=Count('tables'),
+            active_tables_total=Count('tables', filter=Q(tables__is_active=True)),
+            capacity_total=Coalesce(Sum('tables__capacity'), 0),
+        )
+
+    def with_booking_stats(self, date_val=None):
+        """
+        Занятые места на дату (по умолчанию сегодня): за весь день
+        и вечером, начиная с EVENING_START. Подзапросы, а не JOIN,
+        чтобы брони не размножали строки столиков в агрегатах.
+        """
+        date_val = date_val or timezone.localdate()
+
+        def booked_seats(**filters):
+            seats = (
+                Reservation.objects.filter(
+                    table__hall=OuterRef('pk'), date=date_val, status__in=ACTIVE_STATUSES, **filters
+                )
+                .order_by()
+                .values('table__hall')
+                .annotate(seats=Sum('guests_count'))
+                .values('seats')
+            )
+            return Coalesce(Subquery(seats, output_field=IntegerField()), Value(0))
+
+        return self.annotate(
+            seats_booked_today=booked_seats(),
+            seats_booked_tonight=booked_seats(start_time__gte=EVENING_START),
+        )
+
+    def with_stats(self, date_val=None):
+        """Статистика столиков и броней одним сгруппированным запросом"""
+        return self.with_table_stats().with_booking_stats(date_val)
+
+
+class TsTzRange(Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
+def reservation_span():
+    """Интервал брони [starts_at, ends_at) — то же выражение, что в ограничении на пересечения"""
+    return TsTzRange("starts_at", "ends_at", RangeBoundary())
+
+
+class ReservationQuerySet(models.QuerySet):
+    # Поля, из которых вычисляются starts_at и ends_at
+    SPAN_FIELDS = {"date", "start_time", "duration"}
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_span()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if self.SPAN_FIELDS & set(fields):
+            for obj in objs:
+                obj.set_span()
+            fields = [*fields, "starts_at", "ends_at"]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def active(self):
+        return self.filter(status__in=ACTIVE_STATUSES)
+
+    def overlapping(self, start, end):
+        """Брони, пересекающиеся с [start, end); вместе с фильтром по столику идёт по индексу ограничения"""
+        return self.alias(span=reservation_span()).filter(span__overlap=DateTimeTZRange(start, end, bounds="[)"))
+
+    def seated(self, moment=None):
+        """Активные брони, гости которых сейчас (или в moment) за столиком"""
+        moment = moment or timezone.now()
+        return self.active().filter(starts_at__lte=moment, ends_at__gt=moment)
+
+    def ending_within(self, delta, moment=None):
+        """Активные брони, которые ещё идут и закончатся в ближайшие delta"""
+        moment = moment or timezone.now()
+        return self.active().filter(ends_at__gt=moment, ends_at__lte=moment + delta)
+
 
 class Hall(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название зала")
@@ -25,6 +122,15 @@ class Hall(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(20)],
         default=8,
     )
+    image_widths = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+        verbose_name="Ширины уменьшенных копий",
+        help_text="Заполняется фоновой задачей после загрузки изображения",
+    )
+
+    objects = HallQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Зал ресторана"
@@ -33,18 +139,49 @@ class Hall(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает загруженные значения, чтобы сигналы знали прежнее изображение"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def clean(self):
+        """Проверка размера нового изображения до сохранения"""
+        if self.image and not self.image._committed:
+            try:
+                HallImage.validate(self.image)
+            except ValidationError as error:
+                raise ValidationError({'image': error.messages})
+
+    @property
+    def image_srcset(self):
+        """srcset уменьшенных копий по форматам: {'webp': ..., 'jpg': ...}; пусто, пока копий нет"""
+        if not self.image or not self.image_widths:
+            return {}
+        return HallImage.srcset(self.image.name, self.image_widths)
+
     @property
     def total_capacity(self):
         """Общая вместимость всех столиков в зале"""
-        from django.db.models import Sum
-        return self.tables.aggregate(
-            total=Sum('capacity')
-        )['total'] or 0
+        if hasattr(self, 'capacity_total'):
+            return self.capacity_total
+        return ReferenceCache.get_hall_data(
+            self.pk,
+            'total_capacity',
+            lambda: self.tables.using(DEFAULT_DB_ALIAS).aggregate(total=Sum('capacity'))['total'] or 0,
+        )
 
     @property
     def active_tables_count(self):
         """Количество активных столиков"""
-        return self.tables.filter(is_active=True).count()
+        if hasattr(self, 'active_tables_total'):
+            return self.active_tables_total
+        return ReferenceCache.get_hall_data(
+            self.pk,
+            'active_tables_count',
+            lambda: self.tables.using(DEFAULT_DB_ALIAS).filter(is_active=True).count(),
+        )
 
 
 class Table(models.Model):
@@ -75,14 +212,21 @@ class Table(models.Model):
     def __str__(self):
         return f"Столик #{self.number} ({self.hall.name})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает загруженные значения, чтобы сигналы знали прежний зал"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     @classmethod
     def get_tables_by_hall(cls, hall_id):
         """Возвращает столики для зала в формате для JSON"""
-        tables = cls.objects.filter(
-            hall_id=hall_id,
-            is_active=True
-        ).values('id', 'number', 'capacity')
-        return list(tables)
+        return [
+            {'id': table.id, 'number': table.number, 'capacity': table.capacity}
+            for table in ReferenceCache.tables(hall_id)
+            if table.is_active
+        ]
 
 
 
@@ -103,7 +247,8 @@ class Reservation(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         verbose_name="Пользователь",
-        related_name='guest_reservations'
+        related_name='guest_reservations',
+        db_index=False,  # покрыт reservation_user_date_idx
     )
     table = models.ForeignKey(Table, on_delete=models.CASCADE, verbose_name="Столик")
     date = models.DateField(verbose_name="Дата бронирования")
@@ -146,26 +291,116 @@ class Reservation(models.Model):
         related_name='staff_reservations',
         help_text="Если бронь оформлялась персоналом",
     )
+    series = models.ForeignKey(
+        "ReservationSeries",
+        verbose_name="Серия",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="reservations",
+        help_text="Если бронь создана как часть повторяющейся серии",
+    )
+    # Начало и окончание брони как моменты времени: по ним фильтруют
+    # пересечения и текущую загрузку, бронь может заканчиваться на следующий день
+    starts_at = models.DateTimeField(
+        verbose_name="Начало", editable=False,
+        help_text="Заполняется автоматически из даты и времени начала",
+    )
+    ends_at = models.DateTimeField(
+        verbose_name="Окончание", editable=False,
+        help_text="Заполняется автоматически из начала и длительности",
+    )
+
+    objects = ReservationQuerySet.as_manager()
+
+    OVERLAP_CONSTRAINT = "exclude_overlapping_reservations"
 
     class Meta:
         verbose_name = "Бронь"
         verbose_name_plural = "Брони"
         ordering = ["-date", "-start_time"]
         constraints = [
+            # Отменённая бронь не держит столик: на её время можно забронировать снова
             models.UniqueConstraint(
-                fields=["table", "date", "start_time"], name="unique_reservation"
-            )
+                fields=["table", "date", "start_time"],
+                condition=models.Q(status__in=list(ACTIVE_STATUSES)),
+                name="unique_reservation",
+            ),
+            ExclusionConstraint(
+                name="exclude_overlapping_reservations",
+                expressions=[
+                    ("table", RangeOperators.EQUAL),
+                    (reservation_span(), RangeOperators.OVERLAPS),
+                ],
+                condition=models.Q(status__in=list(ACTIVE_STATUSES)),
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["date"],
+                condition=models.Q(status="confirmed"),
+                name="reservation_confirmed_date_idx",
+            ),
+            models.Index(
+                fields=["date", "start_time", "id"],
+                name="reservation_date_start_id_idx",
+            ),
+            # Занятость столиков зала на дату (OccupancyIndex.load, проверка
+            # доступности, статистика залов): только активные брони, нужные
+            # поля в самом индексе — без обращения к таблице
+            models.Index(
+                fields=["table", "date"],
+                include=["start_time", "duration", "guests_count"],
+                condition=models.Q(status__in=list(ACTIVE_STATUSES)),
+                name="reservation_active_table_idx",
+            ),
+            # Брони гостя по дате: список броней, профиль, keyset-пагинация
+            models.Index(
+                fields=["user", "date", "start_time", "id"],
+                name="reservation_user_date_idx",
+            ),
+            # Фильтр по статусу и периоду в админке и выгрузках
+            models.Index(
+                fields=["status", "date"],
+                name="reservation_status_date_idx",
+            ),
+            # Кто сейчас за столиком и чьи брони скоро заканчиваются
+            models.Index(
+                fields=["ends_at"],
+                include=["starts_at"],
+                condition=models.Q(status__in=list(ACTIVE_STATUSES)),
+                name="reservation_active_ends_idx",
+            ),
         ]
 
     def __str__(self):
         return f"Бронь #{self.id} - {self.user.username} - {self.date} {self.start_time}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает загруженные значения, чтобы сигналы знали прежние столик и дату"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     @property
     def end_time(self):
         start_datetime = datetime.combine(self.date, self.start_time)
         end_datetime = start_datetime + self.duration
         return end_datetime.time()
 
+    def set_span(self):
+        """Заполняет starts_at и ends_at из даты, времени начала и длительности в текущем часовом поясе"""
+        self.starts_at = timezone.make_aware(datetime.combine(self.date, self.start_time))
+        self.ends_at = self.starts_at + self.duration
+
+    def save(self, *args, **kwargs):
+        self.set_span()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "starts_at", "ends_at"}
+        super().save(*args, **kwargs)
+
     def clean(self):
         """
         Валидация при сохранении через админку.
@@ -175,3 +410,182 @@ class Reservation(models.Model):
         ReservationValidator.validate_guests_count(self)
         ReservationValidator.validate_availability(self)
 
+
+
+class ReservationSeries(models.Model):
+    """
+    Повторяющаяся бронь набора столиков: например, банкетный зал каждую
+    пятницу в течение квартала. Брони серии создаются одной вставкой
+    (SeriesBooking) и ссылаются на неё через Reservation.series.
+    """
+
+    FREQUENCY_CHOICES = (
+        ("daily", "Ежедневно"),
+        ("weekly", "Еженедельно"),
+    )
+    MAX_OCCURRENCES = 100
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="Гость",
+        related_name="reservation_series",
+    )
+    tables = models.ManyToManyField(Table, verbose_name="Столики", related_name="+")
+    first_date = models.DateField(verbose_name="Первая дата")
+    frequency = models.CharField(
+        max_length=10, choices=FREQUENCY_CHOICES, default="weekly", verbose_name="Повторение"
+    )
+    interval = models.PositiveSmallIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name="Интервал",
+        help_text="Каждые N дней или недель",
+    )
+    count = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1), MaxValueValidator(MAX_OCCURRENCES)],
+        verbose_name="Количество повторений",
+    )
+    until = models.DateField(null=True, blank=True, verbose_name="До даты (включительно)")
+    start_time = models.TimeField(verbose_name="Время начала")
+    duration = models.DurationField(verbose_name="Длительность брони", default=timedelta(hours=3))
+    guests_count = models.PositiveSmallIntegerField(
+        verbose_name="Гостей всего", help_text="Распределяются по выбранным столикам"
+    )
+    event = models.TextField(blank=True, null=True, verbose_name="Событие")
+    staff_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name="Менеджер/админ",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="created_reservation_series",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+
+    class Meta:
+        verbose_name = "Серия броней"
+        verbose_name_plural = "Серии броней"
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Серия #{self.pk} — {self.get_frequency_display().lower()} с {self.first_date}"
+
+    @property
+    def step(self):
+        return timedelta(days=self.interval * (7 if self.frequency == "weekly" else 1))
+
+    def occurrences(self):
+        """Даты серии: от first_date с шагом interval до count повторений или даты until"""
+        step = self.step
+        limit = min(self.count or self.MAX_OCCURRENCES, self.MAX_OCCURRENCES)
+        dates = []
+        day = self.first_date
+        while len(dates) < limit and (self.until is None or day <= self.until):
+            dates.append(day)
+            day += step
+        return dates
+
+
+
+class WaitlistEntry(models.Model):
+    """
+    Гость в листе ожидания: зал, дата и окно времени начала.
+    Когда бронь в зале на эту дату отменяется, ожидающие по порядку
+    записи получают свободный столик (задача promote_waitlist).
+    """
+
+    STATUS_CHOICES = (
+        ("waiting", "Ожидает"),
+        ("promoted", "Забронировано"),
+        ("expired", "Истекло"),
+        ("canceled", "Отменено"),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+        related_name="waitlist_entries",
+    )
+    hall = models.ForeignKey(Hall, on_delete=models.CASCADE, verbose_name="Зал", related_name="+")
+    date = models.DateField(verbose_name="Дата")
+    earliest_time = models.TimeField(verbose_name="Начало не раньше")
+    latest_time = models.TimeField(verbose_name="Начало не позже")
+    guests_count = models.PositiveSmallIntegerField(
+        verbose_name="Количество гостей",
+        validators=[MinValueValidator(1), MaxValueValidator(12)],
+    )
+    duration = models.DurationField(verbose_name="Длительность брони", default=timedelta(hours=3))
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="waiting", verbose_name="Статус"
+    )
+    reservation = models.OneToOneField(
+        Reservation,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Бронь",
+        related_name="waitlist_entry",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    promoted_at = models.DateTimeField(null=True, blank=True, verbose_name="Забронировано")
+
+    class Meta:
+        verbose_name = "Запись в листе ожидания"
+        verbose_name_plural = "Лист ожидания"
+        ordering = ["date", "created_at"]
+        indexes = [
+            # Отмена брони ищет ожидающих своего зала и дня в порядке очереди
+            models.Index(
+                fields=["hall", "date", "created_at"],
+                condition=models.Q(status="waiting"),
+                name="waitlist_waiting_idx",
+            ),
+            models.Index(fields=["user", "date"], name="waitlist_user_date_idx"),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.user} — {self.hall}, {self.date} "
+            f"{self.earliest_time:%H:%M}–{self.latest_time:%H:%M} ({self.guests_count} гостей)"
+        )
+
+
+class OutgoingEmail(models.Model):
+    STATUS_CHOICES = (
+        ("pending", "В очереди"),
+        ("sending", "Отправляется"),
+        ("sent", "Отправлено"),
+        ("failed", "Не доставлено"),
+    )
+
+    subject = models.CharField(max_length=255, verbose_name="Тема")
+    body = models.TextField(blank=True, verbose_name="Текст письма")
+    from_email = models.CharField(max_length=255, blank=True, verbose_name="Отправитель")
+    recipients = models.JSONField(default=list, verbose_name="Получатели")
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="pending", verbose_name="Статус"
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток отправки")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status__in=["pending", "sending"]),
+                name="outgoingemail_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.recipients)}"
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import weakref
+from datetime import datetime, time, timedelta
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from reservation.caching import ReferenceCache
+from reservation.models import ACTIVE_STATUSES, Reservation
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+# Асинхронный клиент привязан к циклу событий, в котором открыл соединения
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Клиент Redis из settings.REDIS_URL или None, если Redis не настроен"""
+    url = settings.REDIS_URL
+    if not url:
+        return None
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(
+            url,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _clients[url]
+
+
+def get_async_redis():
+    """Асинхронный клиент Redis для текущего цикла событий или None"""
+    url = settings.REDIS_URL
+    if not url:
+        return None
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if url not in clients:
+        clients[url] = redis.asyncio.Redis.from_url(
+            url,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return clients[url]
+
+
+class OccupancyIndex:
+    """
+    Индекс занятости столиков в Redis по паре (зал, дата).
+
+    Для каждой пары хранится хэш: поле — id брони, значение —
+    "table_id:start:end" в секундах от начала дня индекса. Бронь,
+    переходящая через полночь, записана и в индекс следующего дня
+    (с отрицательным началом). Поле BUILT
+    отмечает, что индекс полностью собран из базы. Индекс собирается
+    лениво при промахе и дальше обновляется точечно из сигналов модели
+    и массовых действий админки.
+    """
+
+    BUILT = b"built"
+
+    @staticmethod
+    def key(hall_id, date_val):
+        return f"occupancy:{hall_id}:{date_val.isoformat()}"
+
+    @staticmethod
+    def generation_key(hall_id, date_val):
+        """Счётчик изменений пары: растёт при каждом apply и invalidate"""
+        return f"occupancy-gen:{hall_id}:{date_val.isoformat()}"
+
+    @staticmethod
+    def channel(hall_id, date_val):
+        """Канал pub/sub, в который сообщается об изменении индекса пары (зал, дата)"""
+        return f"availability:{hall_id}:{date_val.isoformat()}"
+
+    @staticmethod
+    def pack(table_id, start_time, duration, day_offset=0):
+        """Значение хэша; day_offset — на сколько дней дата брони отстоит от дня индекса"""
+        start = day_offset * 86400 + start_time.hour * 3600 + start_time.minute * 60 + start_time.second
+        end = start + int(duration.total_seconds())
+        return f"{table_id}:{start}:{end}"
+
+    @staticmethod
+    def days(date_val, start_time, duration):
+        """Дни, которые занимает бронь: день начала и следующие, если она переходит через полночь"""
+        end = datetime.combine(date_val, start_time) + duration
+        last = (end - timedelta(microseconds=1)).date()
+        return [date_val + timedelta(days=number) for number in range((last - date_val).days + 1)]
+
+    @classmethod
+    def entries(cls, hall_id, pk, table_id, date_val, start_time, duration, active):
+        """Изменения индекса для одной брони — по одному на каждый занятый ею день"""
+        return [
+            (hall_id, day, pk, cls.pack(table_id, start_time, duration, (date_val - day).days) if active else None)
+            for day in cls.days(date_val, start_time, duration)
+        ]
+
+    @staticmethod
+    def day_queryset(hall_id, date_val, using=None):
+        """
+        Активные брони зала, занимающие дату: начавшиеся в этот день и
+        перешедшие в него через полночь из предыдущего (брони длиннее суток
+        не предполагаются). using=None — база выбирает маршрутизатор.
+        """
+        day_start = timezone.make_aware(datetime.combine(date_val, time.min))
+        return (
+            Reservation.objects.using(using).active()
+            .filter(table__hall_id=hall_id)
+            .filter(date__in=[date_val - timedelta(days=1), date_val], ends_at__gt=day_start)
+            .values_list('id', 'table_id', 'date', 'start_time', 'duration')
+        )
+
+    @classmethod
+    def load(cls, hall_id, date_val, using=None):
+        """Брони зала на дату из базы: [(id, table_id, date, start_time, duration), ...]"""
+        return list(cls.day_queryset(hall_id, date_val, using))
+
+    @staticmethod
+    def intervals_from_rows(rows):
+        """
+        Группирует брони по столикам.
+        Возвращает {table_id: [(start, end, reservation_id), ...]}, отсортировано по началу.
+        """
+        intervals = {}
+        for pk, table_id, date_val, start_time, duration in rows:
+            start = datetime.combine(date_val, start_time)
+            intervals.setdefault(table_id, []).append((start, start + duration, pk))
+        for table_intervals in intervals.values():
+            table_intervals.sort()
+        return intervals
+
+    @classmethod
+    def intervals_from_hash(cls, date_val, raw):
+        day_start = datetime.combine(date_val, time.min)
+        intervals = {}
+        for field, value in raw.items():
+            if field == cls.BUILT:
+                continue
+            table_id, start, end = (int(part) for part in value.split(b":"))
+            intervals.setdefault(table_id, []).append((
+                day_start + timedelta(seconds=start),
+                day_start + timedelta(seconds=end),
+                int(field),
+            ))
+        for table_intervals in intervals.values():
+            table_intervals.sort()
+        return intervals
+
+    @classmethod
+    def busy_intervals(cls, hall_id, date_val):
+        """
+        Занятые интервалы столиков зала на дату.
+        Читаются из индекса; база читается только при промахе или недоступном Redis.
+        """
+        client = get_redis()
+        if client is None:
+            return cls.intervals_from_rows(cls.load(hall_id, date_val))
+
+        key = cls.key(hall_id, date_val)
+        try:
+            raw = client.hgetall(key)
+        except redis.RedisError:
+            logger.warning("Индекс занятости недоступен, читаем брони из базы", exc_info=True)
+            return cls.intervals_from_rows(cls.load(hall_id, date_val))
+
+        if cls.BUILT in raw:
+            return cls.intervals_from_hash(date_val, raw)
+        return cls.rebuild(hall_id, date_val)
+
+    @classmethod
+    async def aload(cls, hall_id, date_val):
+        return [row async for row in cls.day_queryset(hall_id, date_val)]
+
+    @classmethod
+    async def abusy_intervals(cls, hall_id, date_val):
+        """
+        Асинхронный busy_intervals: индекс читается через redis.asyncio,
+        при промахе индекс пересобирается так же, как в синхронном варианте.
+        """
+        client = get_async_redis()
+        if client is None:
+            return cls.intervals_from_rows(await cls.aload(hall_id, date_val))
+
+        key = cls.key(hall_id, date_val)
+        try:
+            raw = await client.hgetall(key)
+        except redis.RedisError:
+            logger.warning("Индекс занятости недоступен, читаем брони из базы", exc_info=True)
+            return cls.intervals_from_rows(await cls.aload(hall_id, date_val))
+
+        if cls.BUILT in raw:
+            return cls.intervals_from_hash(date_val, raw)
+        return await sync_to_async(cls.rebuild)(hall_id, date_val)
+
+    @classmethod
+    def rebuild(cls, hall_id, date_val):
+        """
+        Пересобирает индекс пары (зал, дата) одним запросом к основной базе.
+        Индекс общий и живёт OCCUPANCY_INDEX_TTL, поэтому снимок с отстающей
+        реплики в нём недопустим, даже если представление читает с реплики.
+
+        Счётчик generation_key читается до запроса к базе, а снимок пишется
+        под WATCH этого счётчика: если за время чтения бронь изменилась
+        (apply или invalidate), снимок мог её не увидеть и не сохраняется —
+        индекс соберёт следующее чтение.
+        """
+        client = get_redis()
+        generation_key = cls.generation_key(hall_id, date_val)
+        generation = None
+        if client is not None:
+            try:
+                generation = client.get(generation_key)
+            except redis.RedisError:
+                logger.warning("Индекс занятости недоступен, читаем брони из базы", exc_info=True)
+                client = None
+
+        rows = cls.load(hall_id, date_val, using=DEFAULT_DB_ALIAS)
+        if client is not None:
+            key = cls.key(hall_id, date_val)
+            mapping = {
+                pk: cls.pack(table_id, start_time, duration, (row_date - date_val).days)
+                for pk, table_id, row_date, start_time, duration in rows
+            }
+            mapping[cls.BUILT] = 1
+            try:
+                with client.pipeline() as pipe:
+                    pipe.watch(generation_key)
+                    if pipe.get(generation_key) == generation:
+                        pipe.multi()
+                        pipe.delete(key)
+                        pipe.hset(key, mapping=mapping)
+                        pipe.expire(key, settings.OCCUPANCY_INDEX_TTL)
+                        pipe.execute()
+            except redis.WatchError:
+                pass
+            except redis.RedisError:
+                logger.warning("Не удалось сохранить индекс занятости %s", key, exc_info=True)
+        return cls.intervals_from_rows(rows)
+
+    @classmethod
+    def apply(cls, changes):
+        """
+        Точечно обновляет индекс.
+        changes — итерируемое из (hall_id, date, reservation_id, значение из pack() или None для удаления).
+        Поле без отметки BUILT не считается собранным индексом, поэтому запись в
+        отсутствующий ключ безопасна: при следующем чтении он будет пересобран.
+        После записи в каналы изменённых пар публикуется сообщение для
+        потоков занятости (reservation.live).
+
+        Метки изменения дней (ReferenceCache.day_version) сбрасываются после
+        записи в индекс (и без Redis): запрос между ними получил бы новую
+        метку с телом по старому индексу и дальше — 304 с устаревшей занятостью.
+        """
+        changes = list(changes)
+        pairs = {(hall_id, date_val) for hall_id, date_val, _, _ in changes}
+        client = get_redis()
+        if client is None:
+            ReferenceCache.bump_days(pairs)
+            return
+        try:
+            pipe = client.pipeline()
+            for hall_id, date_val, pk, value in changes:
+                key = cls.key(hall_id, date_val)
+                if value is None:
+                    pipe.hdel(key, pk)
+                else:
+                    pipe.hset(key, pk, value)
+                pipe.expire(key, settings.OCCUPANCY_INDEX_TTL)
+            for hall_id, date_val in pairs:
+                generation_key = cls.generation_key(hall_id, date_val)
+                pipe.incr(generation_key)
+                pipe.expire(generation_key, settings.OCCUPANCY_INDEX_TTL)
+                pipe.publish(cls.channel(hall_id, date_val), b"")
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Не удалось обновить индекс занятости", exc_info=True)
+        ReferenceCache.bump_days(pairs)
+
+    @classmethod
+    def invalidate(cls, pairs, chunk_size=500):
+        """
+        Удаляет индексы пар (hall_id, date) — после массовой загрузки пересобрать
+        индекс при следующем чтении дешевле, чем переносить каждую бронь.
+        Метки дней, как и в apply, сбрасываются после удаления индексов.
+        """
+        pairs = set(pairs)
+        client = get_redis()
+        if client is None:
+            ReferenceCache.bump_days(pairs)
+            return
+        keys = [cls.key(hall_id, date_val) for hall_id, date_val in pairs]
+        try:
+            for offset in range(0, len(keys), chunk_size):
+                client.delete(*keys[offset:offset + chunk_size])
+            pipe = client.pipeline(transaction=False)
+            for hall_id, date_val in pairs:
+                generation_key = cls.generation_key(hall_id, date_val)
+                pipe.incr(generation_key)
+                pipe.expire(generation_key, settings.OCCUPANCY_INDEX_TTL)
+                pipe.publish(cls.channel(hall_id, date_val), b"")
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Не удалось сбросить индекс занятости", exc_info=True)
+        ReferenceCache.bump_days(pairs)
+
+    @classmethod
+    def sync_rows(cls, rows, status):
+        """
+        Обновляет индекс после массовой смены статуса.
+        rows — [(id, table_id, hall_id, date, start_time, duration), ...]
+        """
+        active = status in ACTIVE_STATUSES
+        cls.apply(
+            change
+            for pk, table_id, hall_id, date_val, start_time, duration in rows
+            for change in cls.entries(hall_id, pk, table_id, date_val, start_time, duration, active)
+        )
@@ -0,0 +1,117 @@
+from datetime import date, time
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class ReservationKeysetPaginator:
+    """
+    Постраничный вывод броней по курсору (date, start_time, id) от новых к старым.
+    Страница выбирается условием по ключу и LIMIT, без OFFSET и COUNT,
+    поэтому её стоимость не зависит от размера таблицы.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @staticmethod
+    def encode(reservation):
+        return f"{reservation.date.isoformat()}_{reservation.start_time.isoformat()}_{reservation.pk}"
+
+    @staticmethod
+    def decode(cursor):
+        """Разбирает курсор; ValueError при неверном формате"""
+        date_str, time_str, pk = cursor.split('_')
+        return date.fromisoformat(date_str), time.fromisoformat(time_str), int(pk)
+
+    @staticmethod
+    def before_key(key):
+        """Записи строго старше ключа (дальше по убыванию)"""
+        date_val, time_val, pk = key
+        return Q(date__lte=date_val) & (
+            Q(date__lt=date_val)
+            | Q(start_time__lt=time_val)
+            | Q(start_time=time_val, pk__lt=pk)
+        )
+
+    @staticmethod
+    def after_key(key):
+        """Записи строго новее ключа"""
+        date_val, time_val, pk = key
+        return Q(date__gte=date_val) & (
+            Q(date__gt=date_val)
+            | Q(start_time__gt=time_val)
+            | Q(start_time=time_val, pk__gt=pk)
+        )
+
+    def page(self, after=None, before=None):
+        """
+        Страница после курсора after (следующая) или перед курсором before (предыдущая).
+        Без курсоров — первая страница.
+        """
+        if before:
+            rows = list(
+                self.queryset.filter(self.after_key(self.decode(before)))
+                .order_by('date', 'start_time', 'id')[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset.order_by('-date', '-start_time', '-id')
+            if after:
+                queryset = queryset.filter(self.before_key(self.decode(after)))
+            rows = list(queryset[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = bool(after)
+
+        if not rows:
+            return KeysetPage(rows)
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode(rows[-1]) if has_next else None,
+            previous_cursor=self.encode(rows[0]) if has_previous else None,
+        )
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для админки: число строк неотфильтрованного списка берётся
+    из статистики Postgres (pg_class.reltuples), а не COUNT(*) по всей
+    таблице. Отфильтрованные списки и небольшие таблицы считаются точно.
+    """
+
+    EXACT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.EXACT_BELOW:
+                return row[0]
+        return super().count
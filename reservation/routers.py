@@ -0,0 +1,91 @@
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+class RoutingState:
+    """Маршрутизация текущего запроса; создаётся ReplicaPinningMiddleware"""
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.replica_reads = False
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """
+    Чтение с реплик для представлений, которые явно это разрешили
+    (ReplicaReadMixin, replica_reads), всё остальное — основная база.
+
+    Чтения остаются на основной базе, если запрос закреплён за ней
+    (небезопасный метод или недавняя запись этого клиента) и внутри
+    транзакции: повторная проверка свободного столика при сохранении
+    брони должна видеть то же, что и запись. Вне запроса (Celery,
+    команды) маршрутизации нет.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_reads or state.pinned or not settings.DATABASE_REPLICAS:
+            return None
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+    @staticmethod
+    def begin(pinned):
+        return _state.set(RoutingState(pinned))
+
+    @staticmethod
+    def end(token):
+        state = _state.get()
+        _state.reset(token)
+        return state
+
+    @staticmethod
+    def allow_replica_reads():
+        state = _state.get()
+        if state is not None:
+            state.replica_reads = True
+
+
+def replica_reads(view):
+    """Декоратор функции-представления: чтения запроса можно выполнять на реплике"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            ReplicaRouter.allow_replica_reads()
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            ReplicaRouter.allow_replica_reads()
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin:
+    """Чтения представления можно выполнять на реплике"""
+
+    def dispatch(self, request, *args, **kwargs):
+        ReplicaRouter.allow_replica_reads()
+        return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,121 @@
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from reservation.models import Reservation
+from reservation.occupancy import ACTIVE_STATUSES, OccupancyIndex
+
+
+class SeriesPlan:
+    """Результат проверки серии: свободные повторения и конфликты по датам"""
+
+    def __init__(self, slots, conflicts):
+        self.slots = slots  # [(date, table, guests_count), ...]
+        self.conflicts = conflicts  # {date: [причина, ...]}
+
+    @property
+    def free_dates(self):
+        return sorted({date_val for date_val, _, _ in self.slots})
+
+
+class SeriesBooking:
+    """
+    Бронирование серии: все повторения для всех столиков проверяются
+    одним запросом к базе, свободные вставляются одним bulk_create.
+
+    Конфликтом считается пересечение с активной бронью того же столика
+    (по индексу ограничения на пересечения).
+    """
+
+    CONFLICTS_SQL = f"""
+        WITH candidate (table_id, date, starts_at, ends_at) AS (
+            SELECT * FROM unnest(%(tables)s::bigint[], %(dates)s::date[],
+                                 %(starts)s::timestamptz[], %(ends)s::timestamptz[])
+        )
+        SELECT c.table_id, c.date, r.id, r.starts_at, r.ends_at
+        FROM candidate c
+        JOIN {Reservation._meta.db_table} r
+          ON r.table_id = c.table_id
+         AND r.status = ANY(%(active)s)
+         AND tstzrange(r.starts_at, r.ends_at, '[)') && tstzrange(c.starts_at, c.ends_at, '[)')
+    """
+
+    @staticmethod
+    def split_guests(total, tables):
+        """Гости по столикам: каждому по одному, остальные — по вместимости начиная с больших"""
+        guests = {table.pk: 1 for table in tables}
+        remaining = total - len(tables)
+        for table in sorted(tables, key=lambda table: -table.capacity):
+            extra = min(table.capacity - 1, remaining)
+            guests[table.pk] += extra
+            remaining -= extra
+        return guests
+
+    @classmethod
+    def plan(cls, tables, dates, start_time, duration, guests_count):
+        """Проверяет все повторения одним запросом; возвращает SeriesPlan"""
+        tables = sorted(tables, key=lambda table: table.pk)
+        numbers = {table.pk: table.number for table in tables}
+        candidates = []
+        for date_val in dates:
+            starts_at = timezone.make_aware(datetime.combine(date_val, start_time))
+            for table in tables:
+                candidates.append((table.pk, date_val, starts_at, starts_at + duration))
+
+        with connection.cursor() as cursor:
+            cursor.execute(cls.CONFLICTS_SQL, {
+                'tables': [table_id for table_id, _, _, _ in candidates],
+                'dates': [date_val for _, date_val, _, _ in candidates],
+                'starts': [starts_at for _, _, starts_at, _ in candidates],
+                'ends': [ends_at for _, _, _, ends_at in candidates],
+                'active': list(ACTIVE_STATUSES),
+            })
+            rows = cursor.fetchall()
+
+        conflicts = {}
+        for table_id, date_val, pk, starts_at, ends_at in sorted(rows, key=lambda row: (row[1], row[0])):
+            starts_at, ends_at = timezone.localtime(starts_at), timezone.localtime(ends_at)
+            conflicts.setdefault(date_val, []).append(
+                f"столик №{numbers[table_id]} занят бронью #{pk} ({starts_at:%H:%M}–{ends_at:%H:%M})"
+            )
+
+        guests = cls.split_guests(guests_count, tables)
+        slots = [
+            (date_val, table, guests[table.pk])
+            for date_val in dates if date_val not in conflicts
+            for table in tables
+        ]
+        return SeriesPlan(slots, conflicts)
+
+    @staticmethod
+    def create(series, plan, status='confirmed'):
+        """
+        Создаёт брони серии по свободным повторениям плана одной вставкой.
+        IntegrityError — если после проверки столик заняли: ничего не создаётся.
+        """
+        reservations = [
+            Reservation(
+                user_id=series.user_id,
+                table=table,
+                date=date_val,
+                start_time=series.start_time,
+                duration=series.duration,
+                guests_count=guests_count,
+                status=status,
+                event=series.event,
+                source='admin',
+                staff_user_id=series.staff_user_id,
+                series=series,
+            )
+            for date_val, table, guests_count in plan.slots
+        ]
+        with transaction.atomic():
+            Reservation.objects.bulk_create(reservations)
+            rows = [
+                (reservation.pk, reservation.table_id, reservation.table.hall_id,
+                 reservation.date, reservation.start_time, reservation.duration)
+                for reservation in reservations
+            ]
+            transaction.on_commit(lambda: OccupancyIndex.sync_rows(rows, status))
+        return reservations
@@ -0,0 +1,117 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from reservation.caching import ReferenceCache
+from reservation.images import HallImage
+from reservation.models import Hall, Reservation, Table
+from reservation.occupancy import ACTIVE_STATUSES, OccupancyIndex
+from reservation.waitlist import Waitlist
+
+
+@receiver(post_save, sender=Reservation)
+def update_occupancy_on_save(sender, instance, **kwargs):
+    """Переносит бронь в индексе занятости после сохранения"""
+    changes = OccupancyIndex.entries(
+        instance.table.hall_id, instance.pk, instance.table_id, instance.date,
+        instance.start_time, instance.duration, instance.status in ACTIVE_STATUSES,
+    )
+    loaded = getattr(instance, '_loaded_values', {})
+    old_table_id = loaded.get('table_id')
+
+    if old_table_id:
+        # Убираем бронь из дней, которые она больше не занимает
+        if old_table_id == instance.table_id:
+            old_hall_id = instance.table.hall_id
+        else:
+            old_hall_id = Table.objects.filter(pk=old_table_id).values_list('hall_id', flat=True).first()
+        current = {(hall_id, day) for hall_id, day, _, _ in changes}
+        old_days = OccupancyIndex.days(
+            loaded.get('date', instance.date),
+            loaded.get('start_time', instance.start_time),
+            loaded.get('duration', instance.duration),
+        )
+        changes += [
+            (old_hall_id, day, instance.pk, None)
+            for day in old_days
+            if old_hall_id and (old_hall_id, day) not in current
+        ]
+        # Отмена, перенос или сокращение активной брони освобождает столик
+        freed = loaded.get('status') in ACTIVE_STATUSES and (
+            instance.status not in ACTIVE_STATUSES
+            or any(loaded.get(name, value) != value for name, value in (
+                ('table_id', instance.table_id),
+                ('date', instance.date),
+                ('start_time', instance.start_time),
+                ('duration', instance.duration),
+            ))
+        )
+        if freed:
+            Waitlist.schedule((old_hall_id, day) for day in old_days)
+
+    instance._loaded_values = {
+        **loaded,
+        'table_id': instance.table_id,
+        'date': instance.date,
+        'start_time': instance.start_time,
+        'duration': instance.duration,
+        'status': instance.status,
+    }
+    transaction.on_commit(lambda: OccupancyIndex.apply(changes))
+
+
+@receiver(post_delete, sender=Reservation)
+def update_occupancy_on_delete(sender, instance, **kwargs):
+    """Убирает удалённую бронь из индекса занятости"""
+    try:
+        hall_id = instance.table.hall_id
+    except Table.DoesNotExist:
+        return
+    changes = OccupancyIndex.entries(
+        hall_id, instance.pk, instance.table_id, instance.date, instance.start_time, instance.duration, False,
+    )
+    transaction.on_commit(lambda: OccupancyIndex.apply(changes))
+    if instance.status in ACTIVE_STATUSES:
+        Waitlist.schedule((hall_id, day) for hall_id, day, _, _ in changes)
+
+
+@receiver(post_save, sender=Hall)
+@receiver(post_delete, sender=Hall)
+def reset_hall_cache(sender, instance, **kwargs):
+    """Сбрасывает кэш зала после изменения или удаления"""
+    hall_id = instance.pk
+    transaction.on_commit(lambda: ReferenceCache.bump(hall_id))
+
+
+@receiver(post_save, sender=Hall)
+def process_hall_image(sender, instance, **kwargs):
+    """После замены изображения зала ставит в очередь создание уменьшенных копий"""
+    from reservation.tasks import generate_hall_image_derivatives
+
+    loaded = getattr(instance, '_loaded_values', {})
+    previous = loaded.get('image') or ''
+    current = instance.image.name or ''
+    if current == previous and (instance.image_widths or not current):
+        return
+    instance._loaded_values = {**loaded, 'image': current}
+    hall_id = instance.pk
+    transaction.on_commit(lambda: generate_hall_image_derivatives.delay(
+        hall_id, previous if previous != current else ''
+    ))
+
+
+@receiver(post_delete, sender=Hall)
+def delete_hall_image_derivatives(sender, instance, **kwargs):
+    """Удаляет уменьшенные копии вместе с залом"""
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: HallImage.delete(name))
+
+
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+def reset_table_hall_cache(sender, instance, **kwargs):
+    """Сбрасывает кэш зала столика, а при переносе столика — и прежнего зала"""
+    hall_ids = {instance.hall_id, getattr(instance, '_loaded_values', {}).get('hall_id')}
+    instance._loaded_values = {**getattr(instance, '_loaded_values', {}), 'hall_id': instance.hall_id}
+    transaction.on_commit(lambda: ReferenceCache.bump(*hall_ids))
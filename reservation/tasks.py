@@ -0,0 +1,183 @@
+import logging
+from datetime import date, timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from reservation.caching import ReferenceCache
+from reservation.images import HallImage
+from reservation.models import Hall, OutgoingEmail, Reservation
+from reservation.waitlist import Waitlist
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def complete_past_reservations(batch_size=1000):
+    """
+    Переводит подтверждённые брони за прошедшие дни в статус 'completed'.
+    Работает пачками по первичному ключу и пропускает заблокированные строки,
+    повторный запуск безопасен. Возвращает количество обновлённых броней.
+    """
+    today = timezone.localdate()
+    completed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Reservation.objects.filter(status='confirmed', date__lt=today)
+                .select_for_update(skip_locked=True)
+                .order_by()
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            completed += Reservation.objects.filter(pk__in=ids).update(status='completed')
+    return completed
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """
+    Ставит письмо в очередь отправки вместо send_mail внутри запроса.
+    Отправка запускается после фиксации транзакции.
+    """
+    email = OutgoingEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        recipients=list(recipient_list),
+    )
+    transaction.on_commit(send_queued_emails.delay)
+    return email
+
+
+def email_retry_delay(attempt):
+    """Экспоненциальная задержка перед повторной попыткой, в секундах"""
+    return min(settings.EMAIL_RETRY_BASE_DELAY * 2 ** attempt, settings.EMAIL_RETRY_MAX_DELAY)
+
+
+def claim_emails(batch_size):
+    """
+    Забирает пачку писем, которым пора уходить, в статус 'sending'.
+    Короткая транзакция с SKIP LOCKED: параллельные воркеры получают разные
+    письма. next_attempt_at становится сроком аренды — письмо воркера,
+    упавшего во время отправки, после EMAIL_SEND_LEASE заберёт следующий обход.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=('pending', 'sending'), next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        lease = now + timedelta(seconds=settings.EMAIL_SEND_LEASE)
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status='sending', next_attempt_at=lease,
+        )
+    return emails
+
+
+def record_failure(email, error):
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = 'failed'
+        email.body = ''
+    else:
+        email.status = 'pending'
+        email.next_attempt_at = timezone.now() + timedelta(seconds=email_retry_delay(email.attempts))
+
+
+@shared_task
+def send_queued_emails(batch_size=50):
+    """
+    Отправляет письма из очереди пачками, по одному SMTP-соединению на пачку.
+    Письма забираются claim_emails, отправка идёт вне транзакции. Неудачные
+    письма возвращаются в очередь с растущей задержкой и после
+    EMAIL_MAX_ATTEMPTS помечаются как 'failed'; повторные попытки делает
+    периодический обход (CELERY_BEAT_SCHEDULE). Текст письма стирается, как
+    только оно отправлено или отброшено: в письмах бывают пароли.
+    Возвращает количество отправленных писем.
+    """
+    sent = 0
+    while emails := claim_emails(batch_size):
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as exc:
+            logger.warning("SMTP-сервер недоступен", exc_info=True)
+            for email in emails:
+                record_failure(email, str(exc))
+        else:
+            try:
+                for email in emails:
+                    message = EmailMessage(
+                        email.subject, email.body, email.from_email, email.recipients, connection=connection
+                    )
+                    try:
+                        message.send()
+                    except Exception as exc:
+                        record_failure(email, str(exc))
+                        logger.warning("Не удалось отправить письмо #%s", email.pk, exc_info=True)
+                    else:
+                        email.attempts += 1
+                        email.status = 'sent'
+                        email.sent_at = timezone.now()
+                        email.body = ''
+                        email.last_error = ''
+                        sent += 1
+            finally:
+                connection.close()
+
+        OutgoingEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at', 'body']
+        )
+        if len(emails) < batch_size:
+            break
+    return sent
+
+
+@shared_task
+def generate_hall_image_derivatives(hall_id, previous_image=''):
+    """
+    Создаёт уменьшенные копии изображения зала и записывает их ширины в Hall.image_widths.
+    previous_image — прежний файл, копии которого больше не нужны.
+    """
+    if previous_image:
+        HallImage.delete(previous_image)
+    name = Hall.objects.filter(pk=hall_id).values_list('image', flat=True).first()
+    widths = HallImage.generate(name) if name else []
+    # Изображение могли заменить, пока задача работала — тогда копии сделает следующая задача
+    if Hall.objects.filter(pk=hall_id, image=name or '').update(image_widths=widths):
+        ReferenceCache.bump(hall_id)
+    return widths
+
+
+@shared_task
+def promote_waitlist(hall_id, date_iso):
+    """
+    Переводит ожидающих зала на дату в брони после отмены и сообщает гостям.
+    Возвращает количество созданных броней.
+    """
+    promoted = Waitlist.promote(hall_id, date.fromisoformat(date_iso))
+    for entry in promoted:
+        reservation = entry.reservation
+        queue_email(
+            subject='Столик из листа ожидания забронирован',
+            message=(
+                f'Освободился столик, и мы забронировали его для вас: '
+                f'{reservation.date:%d.%m.%Y} в {reservation.start_time:%H:%M}, '
+                f'столик №{reservation.table.number}, гостей: {reservation.guests_count}.\n'
+                f'Если планы изменились, отмените бронь в личном кабинете.'
+            ),
+            recipient_list=[entry.user.email],
+        )
+    return len(promoted)
+
+
+@shared_task
+def expire_waitlist():
+    """Закрывает записи листа ожидания на прошедшие даты"""
+    return Waitlist.expire()
@@ -0,0 +1,35 @@
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import current_stats
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        if stats is None:
+            return super().render(context, request)
+        # Шаблон, отрисованный внутри другого (render_to_string в теге), уже входит во время внешнего
+        stats.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    Шаблоны Django с замером времени рендеринга для RequestInstrumentationMiddleware.
+    Подключается в TEMPLATES вместо DjangoTemplates при REQUEST_INSTRUMENTATION.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -1,3 +1,1215 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import zipfile
+from datetime import datetime, time, timedelta
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import ExifTags, Image
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import (
+    AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import DateHierarchyQuerySet
+from .caching import ReferenceCache
+from .exports import COLUMNS as EXPORT_COLUMNS, ReservationExport
+from .forms import ReservationSeriesForm
+from .images import FORMATS, HallImage
+from .live import AvailabilityStream
+from .middleware import RequestInstrumentationMiddleware
+from .models import Hall, OutgoingEmail, Reservation, ReservationSeries, Table, WaitlistEntry
+from .occupancy import OccupancyIndex
+from .pagination import ReservationKeysetPaginator
+from .routers import ReplicaRouter
+from .tasks import complete_past_reservations, queue_email, send_queued_emails
+from .transfer import COLUMNS, ReservationTransfer
+from .transitions import ReservationTransitions
+from .validators import ReservationValidator
+from .views import ReservationListView
+
+RESERVATION_TABLE = 'reservation_reservation'
+LAGGING_REPLICA = 'lagging_replica'
+
+
+def add_lagging_replica():
+    """
+    Реплика для тестов маршрутизации: отдельное соединение с той же тестовой
+    базой (TEST MIRROR). Отставание изображается снимком REPEATABLE READ,
+    открытым на этом соединении до записи в основную базу.
+    """
+    if LAGGING_REPLICA not in connections.settings:
+        default = connections['default'].settings_dict
+        connections.settings[LAGGING_REPLICA] = {**default, 'TEST': {**default['TEST'], 'MIRROR': 'default'}}
+
+
+add_lagging_replica()
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationQueryPlanTests(TestCase):
+    """
+    Планы горячих запросов к броням на заполненной базе.
+
+    SQL не пишется в тесте вручную: выполняется настоящий код (валидатор,
+    представления, админка, задача), его запросы к броням перехватываются
+    и прогоняются через EXPLAIN. Тест падает, если таблица броней читается
+    последовательно или план не использует ожидаемый индекс.
+    """
+
+    HALLS = 3
+    TABLES_PER_HALL = 15
+    USERS = 300
+    DAYS_BEFORE = 300
+    DAYS_AFTER = 100
+    SLOTS = (time(10, 0), time(14, 0), time(18, 0))
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.today = timezone.localdate()
+        cls.users = User.objects.bulk_create(
+            User(email=f'guest{number}@example.com')
+            for number in range(cls.USERS)
+        )
+        cls.admin = User.objects.create(email='admin@example.com', is_staff=True, is_superuser=True)
+
+        halls = Hall.objects.bulk_create(
+            Hall(name=f'Зал {number}', width=20, height=20) for number in range(cls.HALLS)
+        )
+        cls.hall = halls[0]
+        tables = Table.objects.bulk_create(
+            Table(hall=hall, number=str(number), capacity=2 + number % 6, x_position=number, y_position=0)
+            for hall in halls
+            for number in range(cls.TABLES_PER_HALL)
+        )
+        cls.table = tables[0]
+
+        reservations = []
+        counter = 0
+        for offset in range(-cls.DAYS_BEFORE, cls.DAYS_AFTER):
+            day = cls.today + timedelta(days=offset)
+            for table in tables:
+                for start_time in cls.SLOTS:
+                    counter += 1
+                    if counter % 10 == 0:
+                        status = 'canceled'
+                    elif offset < -3:
+                        status = 'completed'
+                    elif offset < 0 or counter % 7:
+                        status = 'confirmed'
+                    else:
+                        status = 'pending'
+                    reservations.append(Reservation(
+                        user=cls.users[counter % cls.USERS],
+                        table=table,
+                        date=day,
+                        start_time=start_time,
+                        duration=timedelta(hours=3),
+                        guests_count=2,
+                        status=status,
+                    ))
+        Reservation.objects.bulk_create(reservations, batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {RESERVATION_TABLE}')
+
+    def capture(self, action):
+        """SQL к броням, выполненный action()"""
+        with CaptureQueriesContext(connection) as context:
+            action()
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if f'"{RESERVATION_TABLE}"' in query['sql'] and query['sql'].lstrip().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE'))
+        ]
+        self.assertTrue(statements, 'Код не выполнил ни одного запроса к броням')
+        return statements
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            return cursor.fetchone()[0][0]['Plan']
+
+    def assertPlans(self, statements, indexes):
+        """Ни одного Seq Scan по броням; хотя бы один запрос использует индекс из indexes"""
+        used = set()
+        for sql in statements:
+            nodes = list(plan_nodes(self.explain(sql)))
+            for node in nodes:
+                if node.get('Relation Name') == RESERVATION_TABLE:
+                    self.assertNotEqual(node['Node Type'], 'Seq Scan', f'Последовательное чтение броней:\n{sql}')
+                used.add(node.get('Index Name'))
+        self.assertTrue(
+            used & set(indexes),
+            f'Ожидался один из индексов {sorted(indexes)}, использованы {sorted(filter(None, used))}',
+        )
+
+    def test_availability_check(self):
+        reservation = Reservation(
+            table=self.table,
+            date=self.today + timedelta(days=5),
+            start_time=time(13, 0),
+            duration=timedelta(hours=1),
+            guests_count=2,
+        )
+        statements = self.capture(lambda: ReservationValidator.validate_availability(reservation))
+        self.assertPlans(statements, {'exclude_overlapping_reservations'})
+
+    def test_guest_reservation_list(self):
+        self.client.force_login(self.users[1])
+        statements = self.capture(lambda: self.client.get(reverse('reservation:reservations_list')))
+        self.assertPlans(statements, {'reservation_user_date_idx'})
+
+    def test_profile(self):
+        self.client.force_login(self.users[1])
+        statements = self.capture(lambda: self.client.get(reverse('reservation:profile')))
+        self.assertPlans(statements, {'reservation_user_date_idx'})
+
+    def test_staff_reservation_list_by_status_and_date(self):
+        self.client.force_login(self.admin)
+        url = reverse('reservation:reservations_list')
+        day = (self.today + timedelta(days=2)).isoformat()
+        statements = self.capture(lambda: self.client.get(url, {'status': 'pending', 'date': day}))
+        self.assertPlans(statements, {'reservation_status_date_idx', 'reservation_date_start_id_idx'})
+
+    def test_hall_list_booking_stats(self):
+        statements = self.capture(lambda: self.client.get(reverse('reservation:hall_list')))
+        # Оба индекса частичные по активным броням и начинаются со столика и даты
+        self.assertPlans(statements, {'reservation_active_table_idx', 'unique_reservation'})
+
+    def test_admin_changelist(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:reservation_reservation_changelist')
+        statements = self.capture(lambda: self.client.get(url))
+        self.assertPlans(statements, {'reservation_date_start_id_idx'})
+
+    def test_admin_date_hierarchy(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:reservation_reservation_changelist')
+        statements = self.capture(lambda: self.client.get(url, {'status__exact': 'canceled'}))
+        self.assertPlans(statements, {'reservation_status_date_idx'})
+
+        canceled = DateHierarchyQuerySet(Reservation).filter(status='canceled')
+        for kind in ('year', 'month', 'day'):
+            with self.assertNumQueries(1):
+                periods = canceled.dates('date', kind)
+            self.assertEqual(periods, list(Reservation.objects.filter(status='canceled').dates('date', kind)))
+        statements = self.capture(lambda: canceled.dates('date', 'day'))
+        self.assertPlans(statements, {'reservation_status_date_idx'})
+
+    def test_admin_changelist_status_and_month(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:reservation_reservation_changelist')
+        first_day = (self.today - timedelta(days=60)).replace(day=1)
+        last_day = (first_day + timedelta(days=31)).replace(day=1)
+        statements = self.capture(lambda: self.client.get(
+            url, {'status__exact': 'canceled', 'date__gte': first_day.isoformat(), 'date__lt': last_day.isoformat()}
+        ))
+        self.assertPlans(statements, {'reservation_status_date_idx'})
+
+    def test_past_reservations_sweep(self):
+        statements = self.capture(complete_past_reservations)
+        self.assertPlans(statements, {'reservation_confirmed_date_idx'})
+        self.assertFalse(Reservation.objects.filter(status='confirmed', date__lt=self.today).exists())
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[LAGGING_REPLICA],
+)
+class OccupancyReplicaTests(TransactionTestCase):
+    """
+    Индекс занятости общий для всех запросов, поэтому пересобирается
+    с основной базы, даже когда чтения запроса разрешены с реплики.
+    """
+
+    databases = {'default', LAGGING_REPLICA}
+
+    def test_rebuild_ignores_lagging_replica(self):
+        user = get_user_model().objects.create(email='guest@example.com')
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+        table = Table.objects.create(hall=hall, number='1', capacity=4, x_position=0, y_position=0)
+        day = timezone.localdate() + timedelta(days=1)
+
+        with transaction.atomic(using=LAGGING_REPLICA):
+            with connections[LAGGING_REPLICA].cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute(f'SELECT count(*) FROM {RESERVATION_TABLE}')
+            reservation = Reservation.objects.create(
+                user=user, table=table, date=day, start_time=time(18, 0), guests_count=2,
+            )
+
+            token = ReplicaRouter.begin(pinned=False)
+            ReplicaRouter.allow_replica_reads()
+            try:
+                # Маршрутизатор действительно читает с реплики, и она отстаёт
+                self.assertEqual(OccupancyIndex.load(hall.pk, day), [])
+                snapshot = OccupancyIndex.rebuild(hall.pk, day)
+            finally:
+                ReplicaRouter.end(token)
+
+        self.assertEqual([pk for _, _, pk in snapshot.get(table.pk, ())], [reservation.pk])
+
+
+@override_settings(REDIS_URL='', DATABASE_REPLICAS=[LAGGING_REPLICA])
+class ReferenceCacheReplicaTests(TransactionTestCase):
+    """Промах справочного кэша загружается с основной базы, а не с реплики"""
+
+    databases = {'default', LAGGING_REPLICA}
+
+    def test_load_after_bump_ignores_lagging_replica(self):
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}), transaction.atomic(using=LAGGING_REPLICA):
+            with connections[LAGGING_REPLICA].cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('SELECT count(*) FROM reservation_table')
+            table = Table.objects.create(hall=hall, number='1', capacity=4, x_position=0, y_position=0)
+            ReferenceCache.bump(hall.pk)
+
+            token = ReplicaRouter.begin(pinned=False)
+            ReplicaRouter.allow_replica_reads()
+            try:
+                # Маршрутизатор действительно читает с реплики, и она отстаёт
+                self.assertFalse(Table.objects.filter(hall=hall).exists())
+                tables = ReferenceCache.tables(hall.pk)
+                halls = ReferenceCache.halls()
+                tables_async = async_to_sync(ReferenceCache.atables)(hall.pk)
+            finally:
+                ReplicaRouter.end(token)
+
+        self.assertEqual([t.pk for t in tables], [table.pk])
+        self.assertEqual([t.pk for t in tables_async], [table.pk])
+        self.assertEqual([(h.pk, h.tables_total) for h in halls], [(hall.pk, 1)])
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class WaitlistPromotionTests(TestCase):
+    """Отмена брони сразу отдаёт освободившийся столик первому в листе ожидания"""
+
+    def test_cancel_promotes_waiting_guest(self):
+        User = get_user_model()
+        owner = User.objects.create(email='owner@example.com')
+        waiting = User.objects.create(email='waiting@example.com')
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+        table = Table.objects.create(hall=hall, number='1', capacity=4, x_position=0, y_position=0)
+        day = timezone.localdate() + timedelta(days=1)
+        reservation = Reservation.objects.create(
+            user=owner, table=table, date=day, start_time=time(18, 0), guests_count=2,
+        )
+        entry = WaitlistEntry.objects.create(
+            user=waiting, hall=hall, date=day,
+            earliest_time=time(18, 0), latest_time=time(18, 0), guests_count=3,
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ReservationTransitions.apply(Reservation.objects.filter(pk=reservation.pk), 'canceled')
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'promoted')
+        # Тот же столик и то же время, что у отменённой брони
+        self.assertEqual(
+            (entry.reservation.table_id, entry.reservation.date, entry.reservation.start_time),
+            (table.pk, day, time(18, 0)),
+        )
+        self.assertEqual(entry.reservation.status, 'confirmed')
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationSeriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create(email='admin@example.com', is_staff=True, is_superuser=True)
+        cls.guest = User.objects.create(email='guest@example.com')
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+        cls.table = Table.objects.create(hall=hall, number='1', capacity=6, x_position=0, y_position=0)
+        cls.first_date = timezone.localdate() + timedelta(days=1)
+
+    def series_data(self, **fields):
+        return {
+            'user': self.guest.pk,
+            'tables': [self.table.pk],
+            'first_date': self.first_date.isoformat(),
+            'frequency': 'weekly',
+            'interval': 1,
+            'count': 4,
+            'until': '',
+            'start_time': '18:00',
+            'duration': '03:00:00',
+            'guests_count': 4,
+            'event': '',
+            **fields,
+        }
+
+    def test_until_beyond_cap_is_rejected(self):
+        until = self.first_date + timedelta(days=ReservationSeries.MAX_OCCURRENCES)
+        form = ReservationSeriesForm(self.series_data(frequency='daily', count='', until=until.isoformat()))
+        self.assertFalse(form.is_valid())
+        self.assertIn('until', form.errors)
+
+        until -= timedelta(days=1)
+        form = ReservationSeriesForm(self.series_data(frequency='daily', count='', until=until.isoformat()))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(len(form.plan.free_dates), ReservationSeries.MAX_OCCURRENCES)
+
+    def test_admin_add_rolls_back_series_on_race(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:reservation_reservationseries_add')
+        race = IntegrityError('exclude_overlapping_reservations')
+        with mock.patch('reservation.admin.SeriesBooking.create', side_effect=race):
+            response = self.client.post(url, self.series_data(), follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.redirect_chain, [(url, 302)])
+        self.assertFalse(ReservationSeries.objects.exists())
+        self.assertIn('Серия не создана', [str(message) for message in response.context['messages']][0])
+
+
+class OutgoingEmailTests(TestCase):
+    """Очередь писем: неудачное письмо повторяется следующим обходом, текст стирается после отправки"""
+
+    def test_failed_email_is_retried_by_sweep(self):
+        with mock.patch('reservation.tasks.EmailMessage.send', side_effect=OSError('connection reset')), \
+                self.assertLogs('reservation.tasks', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                email = queue_email('Новый пароль', 'Ваш новый пароль: secret', ['guest@example.com'])
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('pending', 1, 'connection reset'))
+        self.assertEqual(mail.outbox, [])
+
+        # Обход до срока повторной попытки письмо не трогает
+        self.assertEqual(send_queued_emails(), 0)
+        OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_queued_emails(), 1)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.body), ('sent', 2, ''))
+        self.assertEqual(mail.outbox[0].body, 'Ваш новый пароль: secret')
+
+
+@override_settings(REDIS_URL='', DATABASE_REPLICAS=[])
+class ReferenceCacheTests(TestCase):
+    """Версионный кэш работает только с общим для процессов кэшем"""
+
+    def setUp(self):
+        self.hall = Hall.objects.create(name='Зал', width=10, height=10)
+        Table.objects.create(hall=self.hall, number='1', capacity=4, x_position=0, y_position=0)
+
+    def add_table(self):
+        Table.objects.bulk_create([Table(hall=self.hall, number='2', capacity=2, x_position=1, y_position=0)])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_cache_reads_database(self):
+        self.assertIsNone(ReferenceCache.hall_version(self.hall.pk))
+        self.assertEqual(len(ReferenceCache.tables(self.hall.pk)), 1)
+        # Сброс в другом процессе был бы не виден — поэтому кэша нет вовсе
+        self.add_table()
+        self.assertEqual(len(ReferenceCache.tables(self.hall.pk)), 2)
+
+    def test_shared_cache_is_versioned(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}):
+            version = ReferenceCache.hall_version(self.hall.pk)
+            self.assertIsNotNone(version)
+            self.assertEqual(len(ReferenceCache.tables(self.hall.pk)), 1)
+            self.add_table()
+            self.assertEqual(len(ReferenceCache.tables(self.hall.pk)), 1)
+            ReferenceCache.bump(self.hall.pk)
+            self.assertNotEqual(ReferenceCache.hall_version(self.hall.pk), version)
+            self.assertEqual(len(ReferenceCache.tables(self.hall.pk)), 2)
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class FillRestaurantDataTests(TestCase):
+    """Загрузка фикстуры узнаёт столики по залу и номеру"""
+
+    def setUp(self):
+        self.hall = Hall.objects.create(name='Зал', width=10, height=10)
+        self.table = Table.objects.create(hall=self.hall, number='1', capacity=2, x_position=0, y_position=0)
+
+    def load(self, *tables, halls=()):
+        objects = [
+            *({'model': 'reservation.hall', 'pk': pk, 'fields': fields} for pk, fields in halls),
+            *({'model': 'reservation.table', 'pk': pk, 'fields': {'hall': self.hall.pk, **fields}}
+              for pk, fields in tables),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fixture.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(objects, file)
+            call_command('fill_restaurant_data', path, stdout=io.StringIO())
+
+    def test_hall_image_change_regenerates_derivatives(self):
+        terrace = Hall.objects.create(name='Веранда', width=5, height=5)
+        Hall.objects.filter(pk=self.hall.pk).update(image='halls/old.jpg', image_widths=[320])
+        Hall.objects.filter(pk=terrace.pk).update(image='halls/terrace.jpg', image_widths=[320, 640])
+        fields = {'description': '', 'width': 10, 'height': 10}
+
+        with mock.patch('reservation.tasks.generate_hall_image_derivatives.delay') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.load(halls=[
+                    (self.hall.pk, {**fields, 'name': 'Зал', 'image': 'halls/new.jpg'}),
+                    (terrace.pk, {**fields, 'name': 'Веранда', 'image': 'halls/terrace.jpg'}),
+                ])
+
+        # Копии старого файла сброшены и пересоздаются; у неизменного изображения — остаются
+        self.assertEqual(
+            dict(Hall.objects.values_list('pk', 'image_widths')), {self.hall.pk: [], terrace.pk: [320, 640]},
+        )
+        generate.assert_called_once_with(self.hall.pk, 'halls/old.jpg')
+
+    def test_new_pk_updates_table_with_same_number(self):
+        self.load((self.table.pk + 100, {'number': '1', 'capacity': 6, 'x_position': 2, 'y_position': 3}))
+        table = Table.objects.get(hall=self.hall, number='1')
+        self.assertEqual(table.pk, self.table.pk)
+        self.assertEqual((table.capacity, table.x_position, table.y_position), (6, 2, 3))
+
+    def test_position_collision_is_reported_per_row(self):
+        with self.assertRaisesMessage(CommandError, 'столик №2 (0, 0)'):
+            self.load(
+                (None, {'number': '3', 'capacity': 2, 'x_position': 5, 'y_position': 5}),
+                (None, {'number': '2', 'capacity': 2, 'x_position': 0, 'y_position': 0}),
+            )
+        self.assertEqual(list(Table.objects.values_list('number', flat=True)), ['1'])
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationTransferTests(TestCase):
+    """Импорт броней: проверки над пачкой, пересечения внутри файла и с базой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email='guest@example.com')
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+        cls.table = Table.objects.create(hall=hall, number='1', capacity=4, x_position=0, y_position=0)
+        cls.day = timezone.localdate() + timedelta(days=1)
+        for start, status in [(time(12, 0), 'canceled'), (time(14, 0), 'pending'), (time(18, 0), 'confirmed')]:
+            Reservation.objects.create(
+                user=cls.user, table=cls.table, date=cls.day, start_time=start,
+                duration=timedelta(hours=1), guests_count=2, status=status,
+            )
+
+    def import_rows(self, *rows):
+        file = io.StringIO()
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            row = {
+                'user_email': 'guest@example.com', 'table_id': self.table.pk, 'date': self.day.isoformat(),
+                'duration_minutes': 60, 'guests_count': 2, 'status': 'confirmed', **row,
+            }
+            writer.writerow([row.get(name, '') for name in COLUMNS])
+        file.seek(0)
+        rejects = io.StringIO()
+        result = ReservationTransfer.import_file(file, 'csv', rejects=rejects)
+        rejects.seek(0)
+        reasons = {int(row['line']): row['reason'] for row in csv.DictReader(rejects)}
+        return result, reasons
+
+    def test_invalid_rows_are_rejected_with_reason(self):
+        result, reasons = self.import_rows(
+            {'start_time': '11:00', 'user_email': 'nobody@example.com'},
+            {'start_time': '11:00', 'table_id': self.table.pk + 1000},
+            {'start_time': '11:00', 'guests_count': 9},
+            {'start_time': '23:00'},
+            {'start_time': '11:00', 'date': 'завтра'},
+            {'start_time': '18:00'},
+            {'start_time': '18:30'},
+        )
+        self.assertEqual(result, {'imported': 0, 'rejected': 7})
+        self.assertEqual(reasons, {
+            2: 'гость с такой почтой не найден',
+            3: 'столик не найден',
+            4: 'количество гостей превышает вместимость столика',
+            5: 'время вне часов работы ресторана',
+            6: 'дата не в формате ГГГГ-ММ-ДД',
+            7: 'бронь на этот столик и время уже существует',
+            8: 'столик уже забронирован на это время',
+        })
+
+    def test_overlap_inside_file_keeps_earlier_row(self):
+        result, reasons = self.import_rows({'start_time': '10:00'}, {'start_time': '10:30'})
+        self.assertEqual(result, {'imported': 1, 'rejected': 1})
+        self.assertEqual(reasons, {3: 'пересекается с более ранней строкой файла'})
+        self.assertTrue(Reservation.objects.filter(date=self.day, start_time=time(10, 0)).exists())
+
+    def test_slots_of_inactive_bookings_are_accepted(self):
+        result, reasons = self.import_rows(
+            {'start_time': '12:00'},
+            {'start_time': '14:00'},
+            {'start_time': '16:00', 'status': 'canceled'},
+            {'start_time': '16:00'},
+        )
+        self.assertEqual((result, reasons), ({'imported': 4, 'rejected': 0}, {}))
+        self.assertEqual(
+            Reservation.objects.filter(date=self.day, status='confirmed').count(), 4,
+        )
+
+
+class SharedCacheMixin:
+    """Общий для процессов кэш (FileBasedCache во временном каталоге) на время теста"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name,
+        }})
+        shared.enable()
+        self.addCleanup(shared.disable)
+
+
+@override_settings(REDIS_URL='', DATABASE_REPLICAS=[])
+class HallConditionalRequestTests(SharedCacheMixin, TestCase):
+    """Повторный запрос без изменений в зале и дне получает 304"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create(email='guest@example.com')
+        self.hall = Hall.objects.create(name='Зал', width=4, height=4)
+        self.table = Table.objects.create(hall=self.hall, number='1', capacity=4, x_position=0, y_position=0)
+        self.day = timezone.localdate() + timedelta(days=1)
+
+    def urls(self):
+        day = self.day.isoformat()
+        return [
+            f"{reverse('reservation:tables_by_hall', args=[self.hall.pk])}?date={day}&time=18:00&guests=2",
+            f"{reverse('reservation:hall_day_availability', args=[self.hall.pk])}?date={day}",
+            reverse('reservation:hall_schema', args=[self.hall.pk]),
+        ]
+
+    def test_unchanged_response_is_not_modified(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.has_header('ETag'))
+                repeated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(repeated.status_code, 304)
+                self.assertEqual(repeated['ETag'], response['ETag'])
+
+    def test_booking_changes_day_etag(self):
+        url = self.urls()[1]
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(
+                user=self.user, table=self.table, date=self.day, start_time=time(18, 0), guests_count=2,
+            )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['tables'][0]['busy'], [[18 * 60, 21 * 60]])
+
+    def test_table_change_invalidates_schema(self):
+        url = self.urls()[2]
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.table.capacity = 6
+            self.table.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_day_version_changes_after_index_write(self):
+        # Метка дня не должна опережать индекс: иначе новый ETag отдаётся с телом по старому индексу
+        client = mock.MagicMock()
+        pipe = client.pipeline.return_value
+        pair = (self.hall.pk, self.day)
+
+        def bump_days(pairs):
+            self.assertIn(pair, set(pairs))
+            pipe.execute.assert_called()
+
+        with mock.patch('reservation.occupancy.get_redis', return_value=client), \
+                mock.patch.object(ReferenceCache, 'bump_days', side_effect=bump_days) as bump:
+            OccupancyIndex.apply([(*pair, 1, '1:0:60')])
+            OccupancyIndex.invalidate([pair])
+        self.assertEqual(bump.call_count, 2)
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationTransitionsTests(TestCase):
+    """Массовая смена статуса: допустимые переходы, пересечения и побочные действия после фиксации"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email='guest@example.com')
+        cls.hall = Hall.objects.create(name='Зал', width=10, height=10)
+        cls.table = Table.objects.create(hall=cls.hall, number='1', capacity=4, x_position=0, y_position=0)
+        cls.day = timezone.localdate() + timedelta(days=1)
+
+    def book(self, start_time, status, date_val=None, duration=timedelta(hours=1)):
+        return Reservation.objects.create(
+            user=self.user, table=self.table, date=date_val or self.day, start_time=start_time,
+            duration=duration, guests_count=2, status=status,
+        )
+
+    def apply(self, reservations, status):
+        return ReservationTransitions.apply(
+            Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]), status,
+        )
+
+    def statuses(self, *reservations):
+        return [Reservation.objects.get(pk=reservation.pk).status for reservation in reservations]
+
+    def test_disallowed_transitions_are_rejected(self):
+        completed = self.book(time(12, 0), 'completed')
+        confirmed = self.book(time(14, 0), 'confirmed')
+        canceled = self.book(time(16, 0), 'canceled')
+
+        result = self.apply([completed, confirmed, canceled], 'confirmed')
+        self.assertEqual((result.updated, result.unchanged), (1, 1))
+        self.assertEqual(result.rejected, [(completed.pk, "переход «Завершено» → «Подтверждено» недопустим")])
+
+        # Завершить можно только наступившую бронь
+        result = self.apply([confirmed], 'completed')
+        self.assertEqual(result.rejected, [(confirmed.pk, "бронь ещё не наступила")])
+        self.assertEqual(self.statuses(completed, confirmed, canceled), ['completed', 'confirmed', 'confirmed'])
+
+    def test_overlap_inside_batch_keeps_earlier_booking(self):
+        first = self.book(time(18, 0), 'pending')
+        second = self.book(time(18, 30), 'pending')
+
+        result = self.apply([second, first], 'confirmed')
+        self.assertEqual(result.updated, 1)
+        self.assertEqual([pk for pk, _ in result.rejected], [second.pk])
+        self.assertIn(f"(бронь #{first.pk})", result.rejected[0][1])
+        self.assertEqual(self.statuses(first, second), ['confirmed', 'pending'])
+
+    def test_booking_from_previous_day_blocks_after_midnight(self):
+        late = self.book(time(22, 0), 'confirmed', duration=timedelta(hours=4))
+        early = self.book(time(1, 0), 'pending', date_val=self.day + timedelta(days=1))
+
+        result = self.apply([early], 'confirmed')
+        self.assertEqual(result.updated, 0)
+        self.assertEqual(result.rejected[0][0], early.pk)
+        self.assertIn(f"(бронь #{late.pk})", result.rejected[0][1])
+
+    def test_row_changed_after_check_is_skipped(self):
+        reservation = self.book(time(18, 0), 'pending')
+        busy = ReservationTransitions._busy
+
+        def busy_then_completed(rows):
+            # Другой запрос успел сменить статус между чтением и UPDATE
+            Reservation.objects.filter(pk=reservation.pk).update(status='completed')
+            return busy(rows)
+
+        with mock.patch.object(ReservationTransitions, '_busy', side_effect=busy_then_completed):
+            result = self.apply([reservation], 'confirmed')
+        self.assertEqual((result.updated, result.rejected), (0, []))
+        self.assertEqual(self.statuses(reservation), ['completed'])
+
+    def test_index_and_waitlist_run_on_commit(self):
+        reservation = self.book(time(18, 0), 'confirmed')
+        with mock.patch.object(OccupancyIndex, 'sync_rows') as sync_rows, \
+                mock.patch('reservation.tasks.promote_waitlist.delay') as promote:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = self.apply([reservation], 'canceled')
+                sync_rows.assert_not_called()
+                promote.assert_not_called()
+
+        self.assertEqual(result.updated, 1)
+        sync_rows.assert_called_once_with(
+            [(reservation.pk, self.table.pk, self.hall.pk, self.day, time(18, 0), timedelta(hours=1))],
+            'canceled',
+        )
+        promote.assert_called_once_with(self.hall.pk, self.day.isoformat())
+
+
+class HallImageTests(TestCase):
+    """Копии изображения зала строятся по размеру после поворота по EXIF"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name, HALL_IMAGE_WIDTHS=(320, 640, 1024))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def test_exif_rotated_portrait(self):
+        # Снимок хранится лёжа (1200×600), Orientation=6 ставит его портретом 600×1200
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 600), 'white').save(buffer, 'JPEG', exif=exif)
+        name = default_storage.save('halls/portrait.jpg', ContentFile(buffer.getvalue()))
+
+        self.assertEqual(HallImage.generate(name), [320, 600])
+        for width, size in [(320, (320, 640)), (600, (600, 1200))]:
+            for extension in FORMATS:
+                with default_storage.open(HallImage.derivative_name(name, width, extension)) as file, \
+                        Image.open(file) as derivative:
+                    self.assertEqual(derivative.size, size)
+        self.assertFalse(default_storage.exists(HallImage.derivative_name(name, 640, 'jpg')))
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class AvailabilityEndpointTests(TestCase):
+    """JSON-представления подбора столиков"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email='guest@example.com')
+        cls.hall = Hall.objects.create(name='Зал', width=10, height=10)
+        cls.small = Table.objects.create(hall=cls.hall, number='1', capacity=2, x_position=0, y_position=0)
+        cls.large = Table.objects.create(hall=cls.hall, number='2', capacity=6, x_position=1, y_position=0)
+        cls.day = timezone.localdate() + timedelta(days=1)
+
+    def test_tables_by_hall_rejects_malformed_params(self):
+        url = reverse('reservation:tables_by_hall', args=[self.hall.pk])
+        for params in ({'date': '01.01.2030'}, {'time': '25:00'}, {'guests': 'два'}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Неверный формат данных', response.json()['error'])
+
+    def add_tables(self, count):
+        Table.objects.bulk_create([
+            Table(hall=self.hall, number=str(number), capacity=4, x_position=number % 10, y_position=1 + number // 10)
+            for number in range(10, 10 + count)
+        ])
+
+    def book(self, table, start_time, date_val=None, duration=timedelta(hours=3)):
+        return Reservation.objects.create(
+            user=self.user, table=table, date=date_val or self.day, start_time=start_time,
+            duration=duration, guests_count=2,
+        )
+
+    def test_query_count_does_not_depend_on_tables(self):
+        day = self.day.isoformat()
+        urls = [
+            f"{reverse('reservation:tables_by_hall', args=[self.hall.pk])}?date={day}&time=18:00&guests=2",
+            f"{reverse('reservation:hall_day_availability', args=[self.hall.pk])}?date={day}",
+        ]
+        self.book(self.small, time(18, 0))
+        for url in urls:
+            with self.subTest(url=url), self.assertNumQueries(2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # Столик №1 занят с 18:00 — свободен только большой
+        self.assertEqual([table['id'] for table in self.client.get(urls[0]).json()['tables']], [self.large.pk])
+
+        self.add_tables(20)
+        for table in Table.objects.filter(hall=self.hall, number__in=['10', '11', '12']):
+            self.book(table, time(12, 0))
+        for url in urls:
+            with self.subTest(url=url, tables=22), self.assertNumQueries(2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def nearest(self, **params):
+        response = self.client.get(reverse('reservation:nearest_slots'), {
+            'date': self.day.isoformat(), 'time': '18:00', 'window': 60, 'limit': 10, **params,
+        })
+        self.assertEqual(response.status_code, 200)
+        return [(slot['table_id'], slot['start_time']) for slot in response.json()['slots']]
+
+    def test_nearest_slots_order(self):
+        # Маленький столик занят с 20:00: трёхчасовая бронь на нём возможна не позже 17:00
+        self.book(self.small, time(20, 0))
+        small, large = self.small.pk, self.large.pk
+        # По удалённости от 18:00, при равной — меньший столик, затем более раннее время
+        self.assertEqual(self.nearest(guests=2), [
+            (large, '18:00'), (large, '17:45'), (large, '18:15'), (large, '17:30'), (large, '18:30'),
+            (large, '17:15'), (large, '18:45'), (small, '17:00'), (large, '17:00'), (large, '19:00'),
+        ])
+        self.assertEqual(self.nearest(guests=3, limit=2), [(large, '18:00'), (large, '17:45')])
+
+    def test_nearest_slots_query_count(self):
+        # Запрос залов и по два запроса на зал (столики, брони) — сколько бы ни было столиков и броней
+        self.book(self.small, time(20, 0))
+        with self.assertNumQueries(3):
+            self.nearest(guests=2)
+        self.add_tables(20)
+        for table in Table.objects.filter(hall=self.hall, number__in=['10', '11', '12']):
+            self.book(table, time(17, 0))
+        with self.assertNumQueries(3):
+            self.nearest(guests=2)
+
+    def test_booking_past_midnight_blocks_next_day(self):
+        late = self.book(self.small, time(22, 0), duration=timedelta(hours=4))
+        next_day = self.day + timedelta(days=1)
+        ends_at = timezone.make_aware(datetime.combine(next_day, time(2, 0)))
+        late.refresh_from_db()
+        self.assertEqual(late.ends_at, ends_at)
+
+        # Интервал брони — обычный диапазонный запрос по starts_at/ends_at
+        night = timezone.make_aware(datetime.combine(next_day, time(1, 0)))
+        self.assertEqual(list(Reservation.objects.filter(starts_at__lte=night, ends_at__gt=night)), [late])
+
+        matrix = self.client.get(
+            reverse('reservation:hall_day_availability', args=[self.hall.pk]), {'date': next_day.isoformat()},
+        ).json()
+        self.assertEqual({table['id']: table['busy'] for table in matrix['tables']}, {
+            self.small.pk: [[-120, 120]], self.large.pk: [],
+        })
+
+        url = reverse('reservation:tables_by_hall', args=[self.hall.pk])
+        for start, free in [('00:30', [self.large.pk]), ('02:00', [self.small.pk, self.large.pk])]:
+            response = self.client.get(url, {'date': next_day.isoformat(), 'time': start})
+            self.assertEqual([table['id'] for table in response.json()['tables']], free)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.book(self.small, time(1, 0), date_val=next_day)
+
+    def test_nearest_slots_rejects_past_date(self):
+        response = self.client.get(reverse('reservation:nearest_slots'), {
+            'date': (timezone.localdate() - timedelta(days=1)).isoformat(), 'time': '18:00',
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationKeysetPaginatorTests(TestCase):
+    """Курсоры списка броней: порядок (date, start_time, id), ничьи, фильтры между страницами"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email='staff@example.com', is_staff=True)
+        cls.hall = Hall.objects.create(name='Зал', width=10, height=10)
+        cls.other_hall = Hall.objects.create(name='Веранда', width=10, height=10)
+        tables = [
+            Table.objects.create(hall=cls.hall, number=str(number), capacity=4, x_position=number, y_position=0)
+            for number in range(3)
+        ]
+        other = Table.objects.create(hall=cls.other_hall, number='1', capacity=4, x_position=0, y_position=0)
+        day = timezone.localdate() + timedelta(days=1)
+        bookings = [
+            # Три брони с одинаковыми датой и временем — порядок между ними задаёт id
+            *[(table, day, time(18, 0), 'confirmed') for table in tables],
+            (tables[0], day, time(12, 0), 'confirmed'),
+            *[(table, day + timedelta(days=1), time(18, 0), 'confirmed') for table in tables[:2]],
+            (tables[2], day, time(12, 0), 'canceled'),
+            (other, day, time(18, 0), 'confirmed'),
+        ]
+        for table, date_val, start_time, status in bookings:
+            Reservation.objects.create(
+                user=cls.user, table=table, date=date_val, start_time=start_time,
+                guests_count=2, status=status,
+            )
+
+    def ordered(self, queryset):
+        return list(queryset.order_by('-date', '-start_time', '-id').values_list('pk', flat=True))
+
+    def test_cursors_walk_all_rows_forward_and_back(self):
+        paginator = ReservationKeysetPaginator(Reservation.objects.all(), per_page=2)
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        self.assertFalse(pages[0].has_previous)
+        self.assertEqual(
+            [reservation.pk for page in pages for reservation in page.object_list],
+            self.ordered(Reservation.objects.all()),
+        )
+
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(paginator.page(before=back[-1].previous_cursor))
+        self.assertEqual(
+            [[reservation.pk for reservation in page.object_list] for page in back[::-1]],
+            [[reservation.pk for reservation in page.object_list] for page in pages],
+        )
+
+    def test_malformed_cursor(self):
+        paginator = ReservationKeysetPaginator(Reservation.objects.all(), per_page=2)
+        for cursor in ('garbage', '2030-01-01_18:00', '2030-13-01_18:00_1', '2030-01-01_18:00_x'):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                paginator.page(after=cursor)
+
+        # Представление отдаёт первую страницу вместо ошибки
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservation:reservations_list'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [reservation.pk for reservation in response.context['reservations']],
+            self.ordered(Reservation.objects.all())[:ReservationListView.page_size],
+        )
+
+    def test_filters_apply_on_every_page(self):
+        self.client.force_login(self.user)
+        url = reverse('reservation:reservations_list')
+        with mock.patch.object(ReservationListView, 'page_size', 2):
+            query = f'hall={self.hall.pk}&status=confirmed'
+            seen = []
+            while query:
+                response = self.client.get(f'{url}?{query}')
+                seen += [reservation.pk for reservation in response.context['reservations']]
+                query = response.context.get('next_query')
+                if query:
+                    self.assertIn(f'hall={self.hall.pk}', query)
+                    self.assertIn('status=confirmed', query)
+
+        self.assertEqual(seen, self.ordered(Reservation.objects.filter(table__hall=self.hall, status='confirmed')))
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+)
+class ReservationExportTests(TestCase):
+    """Потоковая выгрузка броней в CSV и XLSX"""
+
+    EVENT = '=HYPERLINK("http://example.com","день рождения")'
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create(
+            email='guest@example.com', first_name='@Анна', last_name='Иванова', phone='+79990000000',
+        )
+        hall = Hall.objects.create(name='Зал', width=10, height=10)
+        table = Table.objects.create(hall=hall, number='1', capacity=4, x_position=0, y_position=0)
+        day = timezone.localdate() + timedelta(days=1)
+        cls.reservations = [
+            Reservation.objects.create(
+                user=user, table=table, date=day, start_time=start_time,
+                duration=timedelta(hours=1), guests_count=2, event=event,
+            )
+            for start_time, event in [(time(12, 0), cls.EVENT), (time(14, 0), 'юбилей')]
+        ]
+
+    def queryset(self):
+        return Reservation.objects.order_by('date', 'start_time', 'id')
+
+    def test_csv_streams_rows_with_formulas_escaped(self):
+        response = ReservationExport.csv_response(RequestFactory().get('/'), self.queryset())
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        header, *rows = list(csv.reader(io.StringIO(content), delimiter=';'))
+
+        self.assertEqual(header, [title for title, _ in EXPORT_COLUMNS])
+        self.assertEqual([int(row[0]) for row in rows], [reservation.pk for reservation in self.reservations])
+        first = dict(zip(header, rows[0]))
+        self.assertEqual(first['Событие'], f"'{self.EVENT}")
+        self.assertEqual(first['Гость'], "'@Анна Иванова")
+        self.assertEqual(first['Телефон'], "'+79990000000")
+        self.assertEqual(dict(zip(header, rows[1]))['Событие'], 'юбилей')
+
+    def test_csv_streams_asynchronously_under_asgi(self):
+        response = ReservationExport.csv_response(AsyncRequestFactory().get('/'), self.queryset())
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        content = async_to_sync(read)().decode('utf-8-sig')
+        self.assertEqual(len(content.splitlines()), 1 + len(self.reservations))
+
+    def test_xlsx_streams_a_valid_workbook(self):
+        response = ReservationExport.xlsx_response(RequestFactory().get('/'), self.queryset())
+        self.assertTrue(response.streaming)
+        book = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(book.testzip())
+        namespace = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        sheet = ElementTree.fromstring(book.read('xl/worksheets/sheet1.xml'))
+        rows = [
+            [cell.findtext('x:v', namespaces=namespace) or cell.findtext('x:is/x:t', namespaces=namespace)
+             for cell in row.findall('x:c', namespace)]
+            for row in sheet.iterfind('x:sheetData/x:row', namespace)
+        ]
+
+        self.assertEqual(rows[0], [title for title, _ in EXPORT_COLUMNS])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [reservation.pk for reservation in self.reservations])
+        # В XLSX значение — inline-строка, а не формула, поэтому хранится как есть
+        self.assertEqual(dict(zip(rows[0], rows[1]))['Событие'], self.EVENT)
+        self.assertFalse(sheet.findall('.//x:f', namespace))
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+    REQUEST_INSTRUMENTATION=True,
+    TEMPLATES=[{**settings.TEMPLATES[0], 'BACKEND': 'reservation.templating.InstrumentedDjangoTemplates'}],
+)
+class RequestInstrumentationTests(TestCase):
+    """Server-Timing и лог замеров запроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hall = Hall.objects.create(name='Зал', width=4, height=4)
+        Table.objects.create(hall=cls.hall, number='1', capacity=4, x_position=0, y_position=0)
+
+    def timings(self, response):
+        """{метрика: (dur, desc)} из заголовка Server-Timing"""
+        return {
+            name: (float(duration), description)
+            for name, duration, description in re.findall(
+                r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response['Server-Timing'],
+            )
+        }
+
+    def test_sync_view_queries_and_templates(self):
+        url = reverse('reservation:hall_schema', args=[self.hall.pk])
+        with CaptureQueriesContext(connection) as queries, \
+                self.assertLogs('reservation.instrumentation', 'INFO') as logs:
+            response = self.client.get(url)
+
+        timings = self.timings(response)
+        self.assertEqual(timings['db'][1], f'SQL: {len(queries)} queries, 0 duplicated')
+        self.assertGreater(timings['tpl'][0], 0)
+        self.assertGreaterEqual(timings['total'][0], timings['tpl'][0])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(
+            (record['url_name'], record['status'], record['queries']),
+            ('reservation:hall_schema', 200, len(queries)),
+        )
+
+    def test_async_view_queries_are_counted(self):
+        url = reverse('reservation:hall_day_availability', args=[self.hall.pk])
+        with self.assertLogs('reservation.instrumentation', 'INFO') as logs:
+            response = async_to_sync(self.async_client.get)(url, {'date': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, 200)
+        # Столики зала и брони дня
+        self.assertEqual(self.timings(response)['db'][1], 'SQL: 2 queries, 0 duplicated')
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['queries'], 2)
+
+    @override_settings(REQUEST_INSTRUMENTATION=False)
+    def test_disabled_middleware_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestInstrumentationMiddleware(lambda request: None)
+        response = self.client.get(reverse('reservation:hall_schema', args=[self.hall.pk]))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(
+    REDIS_URL='',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    DATABASE_REPLICAS=[],
+    ALLOWED_HOSTS=['testserver'],
+)
+class AvailabilityStreamTests(TransactionTestCase):
+    """
+    ASGI-поток занятости: проверки запроса до подписки и формат событий.
+    TransactionTestCase — поток закрывает устаревшие соединения сам, как вне цикла запроса.
+    """
+
+    def setUp(self):
+        self.hall = Hall.objects.create(name='Зал', width=4, height=4)
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.inner = mock.AsyncMock()
+        self.app = AvailabilityStream(self.inner)
+
+    def call(self, path=None, query=None, method='GET', host=b'testserver'):
+        path = path or f'/api/hall-day/{self.hall.pk}/stream/'
+        query = f'date={self.day.isoformat()}' if query is None else query
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+            'headers': [(b'host', host)], 'scheme': 'http',
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(self.app.__call__)(scope, receive, send)
+        if not messages:
+            return None, {}, b''
+        start, *body = messages
+        return start['status'], dict(start['headers']), b''.join(message.get('body', b'') for message in body)
+
+    def test_other_paths_go_to_django(self):
+        self.assertEqual(self.call(path='/halls/')[0], None)
+        self.inner.assert_awaited_once()
+
+    def test_request_validation(self):
+        past = (timezone.localdate() - timedelta(days=1)).isoformat()
+        cases = [
+            ({'host': b'evil.example.com'}, 400, 'Host'),
+            ({'method': 'POST'}, 405, 'Метод'),
+            ({'query': ''}, 400, 'Неверный формат'),
+            ({'query': 'date=завтра'}, 400, 'Неверный формат'),
+            ({'query': f'date={past}'}, 400, ''),
+            ({'path': f'/api/hall-day/{self.hall.pk + 1000}/stream/'}, 404, 'Зал не найден'),
+        ]
+        for kwargs, status, text in cases:
+            with self.subTest(**{key: str(value) for key, value in kwargs.items()}):
+                code, headers, body = self.call(**kwargs)
+                self.assertEqual(code, status)
+                self.assertIn(text, body.decode())
+        self.assertEqual(self.call(method='POST')[1][b'allow'], b'GET')
+        self.inner.assert_not_awaited()
+
+    def test_no_redis_answers_no_content(self):
+        # 204: браузерный EventSource не переподключается
+        self.assertEqual(self.call()[:1], (204,))
+
+    def test_event_framing(self):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def stream():
+            queue = asyncio.Queue()
+            queue.put_nowait({'tables': [{'id': 1, 'busy': [[600, 780]]}]})
+            queue.put_nowait(None)
+            await AvailabilityStream.send_event(send, 'snapshot', {'hall_id': self.hall.pk})
+            await self.app.stream(send, queue)
+
+        async_to_sync(stream)()
+        self.assertEqual([message['body'] for message in sent], [
+            f'event: snapshot\ndata: {{"hall_id":{self.hall.pk}}}\n\n'.encode(),
+            b'event: delta\ndata: {"tables":[{"id":1,"busy":[[600,780]]}]}\n\n',
+        ])
+        self.assertTrue(all(message['more_body'] for message in sent))
@@ -0,0 +1,357 @@
+import csv
+import json
+import tempfile
+from datetime import date, time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from reservation.models import Reservation, Table
+from reservation.occupancy import ACTIVE_STATUSES, OccupancyIndex
+from reservation.validators import FIRST_START_TIME, LAST_START_TIME
+from users.models import User
+
+COLUMNS = [
+    'user_email', 'table_id', 'date', 'start_time', 'duration_minutes',
+    'guests_count', 'status', 'event', 'source',
+]
+REJECT_COLUMNS = ['line', 'reason', *COLUMNS]
+MAX_DURATION_MINUTES = 24 * 60
+
+STAGING_TABLE = 'reservation_import'
+ACCEPTED_TABLE = 'reservation_import_accepted'
+
+
+def detect_format(path, fmt=None):
+    """csv или jsonl: явно заданный формат или расширение файла"""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class _JsonlCopyWriter:
+    """
+    Приёмник COPY ... TO STDOUT для JSONL.
+    В текстовом формате COPY удваивает обратные слэши; управляющих
+    символов в выводе row_to_json нет, поэтому достаточно вернуть слэши обратно.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        self.file.write(data.replace('\\\\', '\\'))
+
+
+class ReservationTransfer:
+    """
+    Массовый импорт и экспорт броней через COPY.
+
+    Импорт: строки проверяются на формат в Python и копируются во временную
+    таблицу, затем все проверки (гость, столик, вместимость, часы работы,
+    пересечения с базой и внутри файла) выполняются несколькими UPDATE над
+    всей пачкой, а прошедшие строки вставляются одним INSERT ... SELECT.
+    Отклонённые строки с причиной пишутся в файл отказов.
+    """
+
+    @staticmethod
+    def export_sql(date_from=None, date_to=None, statuses=None):
+        conditions, params = [], []
+        if date_from:
+            conditions.append("r.date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("r.date <= %s")
+            params.append(date_to)
+        if statuses:
+            conditions.append("r.status = ANY(%s)")
+            params.append(list(statuses))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"""
+            SELECT u.email AS user_email, r.table_id, r.date, r.start_time,
+                   (EXTRACT(EPOCH FROM r.duration) / 60)::int AS duration_minutes,
+                   r.guests_count, r.status, r.event, r.source
+            FROM {Reservation._meta.db_table} r
+            JOIN {User._meta.db_table} u ON u.id = r.user_id
+            {where}
+            ORDER BY r.date, r.start_time, r.id
+        """
+        return sql, params
+
+    @classmethod
+    def export(cls, file, fmt='csv', **filters):
+        """Пишет брони в открытый текстовый файл; возвращает число строк"""
+        sql, params = cls.export_sql(**filters)
+        with connection.cursor() as cursor:
+            query = cursor.mogrify(sql, params).decode('utf-8')
+            if fmt == 'jsonl':
+                cursor.copy_expert(
+                    f"COPY (SELECT row_to_json(t) FROM ({query}) t) TO STDOUT", _JsonlCopyWriter(file)
+                )
+            else:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+            return cursor.rowcount
+
+    @staticmethod
+    def read_rows(file, fmt='csv'):
+        """Строки файла импорта как словари: (номер строки, dict)"""
+        if fmt == 'jsonl':
+            for line, text in enumerate(file, start=1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except json.JSONDecodeError as error:
+                        yield line, {'_error': f"некорректный JSON: {error.msg}"}
+        else:
+            # Заголовок — первая строка, данные нумеруются со второй
+            for line, row in enumerate(csv.DictReader(file), start=2):
+                yield line, row
+
+    @staticmethod
+    def parse_row(row):
+        """Приводит строку к типам колонок; ValueError с причиной, если это невозможно"""
+        if '_error' in row:
+            raise ValueError(row['_error'])
+
+        def value(name):
+            raw = row.get(name)
+            if raw is None:
+                return ''
+            return str(raw).strip()
+
+        missing = [name for name in ('user_email', 'table_id', 'date', 'start_time', 'guests_count')
+                   if not value(name)]
+        if missing:
+            raise ValueError(f"не заполнены поля: {', '.join(missing)}")
+
+        try:
+            table_id = int(value('table_id'))
+        except ValueError:
+            raise ValueError("table_id не число")
+        try:
+            date_val = date.fromisoformat(value('date'))
+        except ValueError:
+            raise ValueError("дата не в формате ГГГГ-ММ-ДД")
+        try:
+            start_time = time.fromisoformat(value('start_time'))
+        except ValueError:
+            raise ValueError("время не в формате ЧЧ:ММ")
+        try:
+            guests_count = int(value('guests_count'))
+            duration = int(value('duration_minutes') or 180)
+        except ValueError:
+            raise ValueError("guests_count и duration_minutes должны быть числами")
+        if not 0 < duration <= MAX_DURATION_MINUTES:
+            raise ValueError("длительность должна быть от 1 минуты до суток")
+
+        return [
+            value('user_email').lower(),
+            table_id,
+            date_val.isoformat(),
+            start_time.isoformat(),
+            duration,
+            guests_count,
+            value('status') or 'confirmed',
+            value('event'),
+            value('source') or 'admin',
+        ]
+
+    @classmethod
+    def import_file(cls, file, fmt='csv', rejects=None, dry_run=False):
+        """
+        Импортирует брони из открытого текстового файла.
+        rejects — открытый файл для отклонённых строк (CSV).
+        Возвращает {'imported': n, 'rejected': m}.
+        """
+        reject_writer = csv.writer(rejects) if rejects is not None else None
+        if reject_writer:
+            reject_writer.writerow(REJECT_COLUMNS)
+
+        parse_rejects = 0
+        with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024, mode='w+', newline='') as buffer:
+            writer = csv.writer(buffer)
+            for line, row in cls.read_rows(file, fmt):
+                try:
+                    writer.writerow([line, *cls.parse_row(row)])
+                except ValueError as error:
+                    parse_rejects += 1
+                    if reject_writer:
+                        reject_writer.writerow([line, str(error), *(row.get(name, '') for name in COLUMNS)])
+            buffer.seek(0)
+
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cls.create_staging(cursor)
+                    cursor.copy_expert(
+                        f"COPY {STAGING_TABLE} (line, {', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                        buffer,
+                    )
+                    cls.reject_invalid(cursor)
+                    imported = cls.insert_accepted(cursor) if not dry_run else cls.count_accepted(cursor)
+                    rejected = cls.write_rejects(cursor, rejects)
+                if dry_run:
+                    transaction.set_rollback(True)
+
+        return {'imported': imported, 'rejected': rejected + parse_rejects}
+
+    @staticmethod
+    def create_staging(cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}, {ACCEPTED_TABLE}")
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE {STAGING_TABLE} (
+                line integer PRIMARY KEY,
+                user_email text NOT NULL,
+                table_id bigint NOT NULL,
+                date date NOT NULL,
+                start_time time NOT NULL,
+                duration_minutes integer NOT NULL,
+                guests_count integer NOT NULL,
+                status text NOT NULL,
+                event text,
+                source text NOT NULL,
+                user_id bigint,
+                hall_id bigint,
+                period tstzrange,
+                reason text
+            ) ON COMMIT DROP
+        """)
+
+    @staticmethod
+    def reject_invalid(cursor):
+        """Проверки над всей пачкой; каждая отмечает только ещё не отклонённые строки"""
+        reservations = Reservation._meta.db_table
+        statuses = [choice for choice, _ in Reservation.STATUS_CHOICES]
+        sources = [choice for choice, _ in Reservation.SOURCE_CHOICES]
+
+        cursor.execute(f"""
+            UPDATE {STAGING_TABLE} s SET
+                user_id = u.id
+            FROM {User._meta.db_table} u
+            WHERE lower(u.email) = s.user_email
+        """)
+        cursor.execute(f"""
+            UPDATE {STAGING_TABLE} s SET
+                hall_id = t.hall_id,
+                period = tstzrange(
+                    (s.date + s.start_time) AT TIME ZONE %(tz)s,
+                    (s.date + s.start_time + make_interval(mins => s.duration_minutes)) AT TIME ZONE %(tz)s,
+                    '[)'
+                ),
+                reason = CASE
+                    WHEN NOT t.is_active THEN 'столик недоступен для брони'
+                    WHEN s.guests_count < 1 THEN 'количество гостей должно быть не менее 1'
+                    WHEN s.guests_count > t.capacity THEN 'количество гостей превышает вместимость столика'
+                END
+            FROM {Table._meta.db_table} t
+            WHERE t.id = s.table_id
+        """, {'tz': settings.TIME_ZONE})
+
+        checks = [
+            ("s.user_id IS NULL", 'гость с такой почтой не найден'),
+            ("s.hall_id IS NULL", 'столик не найден'),
+            ("s.status <> ALL(%(statuses)s)", 'неизвестный статус'),
+            ("s.source <> ALL(%(sources)s)", 'неизвестный источник'),
+            ("s.start_time NOT BETWEEN %(first)s AND %(last)s", 'время вне часов работы ресторана'),
+            # Как ограничение unique_reservation: только среди активных броней
+            (f"""s.status = ANY(%(active)s) AND EXISTS (
+                SELECT 1 FROM {reservations} r
+                WHERE r.table_id = s.table_id AND r.date = s.date AND r.start_time = s.start_time
+                  AND r.status = ANY(%(active)s)
+            )""", 'бронь на этот столик и время уже существует'),
+            (f"""s.status = ANY(%(active)s) AND EXISTS (
+                SELECT 1 FROM {reservations} r
+                WHERE r.table_id = s.table_id AND r.status = ANY(%(active)s)
+                  AND tstzrange(r.starts_at, r.ends_at, '[)') && s.period
+            )""", 'столик уже забронирован на это время'),
+        ]
+        params = {
+            'statuses': statuses,
+            'sources': sources,
+            'first': FIRST_START_TIME,
+            'last': LAST_START_TIME,
+            'active': list(ACTIVE_STATUSES),
+        }
+        for condition, reason in checks:
+            cursor.execute(
+                f"UPDATE {STAGING_TABLE} s SET reason = %(reason)s WHERE s.reason IS NULL AND {condition}",
+                {**params, 'reason': reason},
+            )
+
+        # Пересечения внутри файла: строки по порядку вставляются в таблицу с теми же
+        # ограничениями, что у броней; конфликтующая с уже принятой строка пропускается,
+        # поэтому из пересекающихся строк остаётся более ранняя
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE {ACCEPTED_TABLE} (
+                line integer PRIMARY KEY,
+                table_id bigint NOT NULL,
+                date date NOT NULL,
+                start_time time NOT NULL,
+                period tstzrange NOT NULL,
+                active boolean NOT NULL,
+                EXCLUDE USING gist (table_id WITH =, period WITH &&) WHERE (active)
+            ) ON COMMIT DROP
+        """)
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX ON {ACCEPTED_TABLE} (table_id, date, start_time) WHERE active
+        """)
+        cursor.execute(f"""
+            WITH accepted AS (
+                INSERT INTO {ACCEPTED_TABLE} (line, table_id, date, start_time, period, active)
+                SELECT line, table_id, date, start_time, period, status = ANY(%(active)s)
+                FROM {STAGING_TABLE}
+                WHERE reason IS NULL
+                ORDER BY line
+                ON CONFLICT DO NOTHING
+                RETURNING line
+            )
+            UPDATE {STAGING_TABLE} s SET reason = 'пересекается с более ранней строкой файла'
+            WHERE s.reason IS NULL AND s.line NOT IN (SELECT line FROM accepted)
+        """, params)
+
+    @staticmethod
+    def count_accepted(cursor):
+        cursor.execute(f"SELECT count(*) FROM {STAGING_TABLE} WHERE reason IS NULL")
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def insert_accepted(cursor):
+        """Вставляет прошедшие проверки строки и сбрасывает индекс занятости затронутых дней"""
+        cursor.execute(f"""
+            INSERT INTO {Reservation._meta.db_table} (
+                user_id, table_id, date, start_time, duration, guests_count, status,
+                event, source, starts_at, ends_at, created_at, updated_at, extended_by_admin
+            )
+            SELECT user_id, table_id, date, start_time, make_interval(mins => duration_minutes),
+                   guests_count, status, NULLIF(event, ''), source, lower(period), upper(period),
+                   now(), now(), false
+            FROM {STAGING_TABLE}
+            WHERE reason IS NULL
+            ORDER BY line
+        """)
+        imported = cursor.rowcount
+
+        cursor.execute(f"""
+            SELECT DISTINCT hall_id, day::date
+            FROM {STAGING_TABLE},
+                 generate_series(date, (upper(period) - interval '1 microsecond') AT TIME ZONE %s, interval '1 day') day
+            WHERE reason IS NULL AND status = ANY(%s)
+        """, [settings.TIME_ZONE, list(ACTIVE_STATUSES)])
+        pairs = cursor.fetchall()
+        transaction.on_commit(lambda: OccupancyIndex.invalidate(pairs))
+        return imported
+
+    @staticmethod
+    def write_rejects(cursor, rejects):
+        """Дописывает отклонённые при проверке строки в файл отказов; возвращает их число"""
+        if rejects is None:
+            cursor.execute(f"SELECT count(*) FROM {STAGING_TABLE} WHERE reason IS NOT NULL")
+            return cursor.fetchone()[0]
+        cursor.copy_expert(f"""
+            COPY (
+                SELECT line, reason, {', '.join(COLUMNS)}
+                FROM {STAGING_TABLE} WHERE reason IS NOT NULL ORDER BY line
+            ) TO STDOUT WITH (FORMAT csv)
+        """, rejects)
+        return cursor.rowcount
@@ -0,0 +1,146 @@
+from bisect import insort
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from reservation.availability import TableAvailability
+from reservation.models import Reservation
+from reservation.occupancy import ACTIVE_STATUSES, OccupancyIndex
+from reservation.waitlist import Waitlist
+
+# Новый статус → статусы, из которых в него можно перейти
+TRANSITIONS = {
+    'confirmed': {'pending', 'canceled'},
+    'completed': {'confirmed'},
+    'canceled': {'pending', 'confirmed'},
+}
+
+STATUS_LABELS = dict(Reservation.STATUS_CHOICES)
+
+
+class TransitionResult:
+    def __init__(self):
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = []  # [(reservation_id, причина), ...]
+
+    def reject(self, pk, reason):
+        self.rejected.append((pk, reason))
+
+
+class ReservationTransitions:
+    """
+    Массовая смена статуса броней с проверкой.
+
+    Выбранные брони читаются одним запросом, занятость их столиков —
+    вторым, пересечения проверяются в памяти: и с бронями в базе, и между
+    самими выбранными (порядок — по дате и времени начала). Допустимые
+    переходы применяются одним UPDATE, отклонённые возвращаются с причиной.
+    """
+
+    @staticmethod
+    def _interval(date_val, start_time, duration):
+        start = datetime.combine(date_val, start_time)
+        return start, start + duration
+
+    @classmethod
+    def _busy(cls, rows):
+        """
+        Активные брони столиков из rows, кроме самих rows:
+        {table_id: [(start, end, id), ...]}, отсортировано по началу.
+        Соседние даты нужны для броней, переходящих через полночь.
+        """
+        dates = {row['date'] + timedelta(days=shift) for row in rows for shift in (-1, 0, 1)}
+        busy = {}
+        queryset = (
+            Reservation.objects.filter(
+                table_id__in={row['table_id'] for row in rows},
+                date__in=dates,
+                status__in=ACTIVE_STATUSES,
+            )
+            .exclude(pk__in=[row['id'] for row in rows])
+            .order_by()
+            .values_list('id', 'table_id', 'date', 'start_time', 'duration')
+        )
+        for pk, table_id, date_val, start_time, duration in queryset:
+            busy.setdefault(table_id, []).append((*cls._interval(date_val, start_time, duration), pk))
+        for intervals in busy.values():
+            intervals.sort()
+        return busy
+
+    @classmethod
+    def apply(cls, queryset, status):
+        """Переводит брони queryset в status; возвращает TransitionResult"""
+        result = TransitionResult()
+        today = timezone.localdate()
+        allowed = TRANSITIONS[status]
+        rows = list(
+            queryset.order_by('date', 'start_time', 'id').values(
+                'id', 'table_id', 'table__hall_id', 'table__capacity',
+                'date', 'start_time', 'duration', 'guests_count', 'status',
+            )
+        )
+
+        accepted = []
+        activated = []
+        for row in rows:
+            if row['status'] == status:
+                result.unchanged += 1
+            elif row['status'] not in allowed:
+                result.reject(
+                    row['id'],
+                    f"переход «{STATUS_LABELS[row['status']]}» → «{STATUS_LABELS[status]}» недопустим",
+                )
+            elif status == 'confirmed' and row['date'] < today:
+                result.reject(row['id'], "бронь на прошедшую дату")
+            elif status == 'completed' and row['date'] > today:
+                result.reject(row['id'], "бронь ещё не наступила")
+            elif status in ACTIVE_STATUSES and row['status'] not in ACTIVE_STATUSES:
+                if row['guests_count'] > row['table__capacity']:
+                    result.reject(
+                        row['id'],
+                        f"гостей ({row['guests_count']}) больше вместимости столика ({row['table__capacity']})",
+                    )
+                else:
+                    activated.append(row)
+            else:
+                accepted.append(row)
+
+        if activated:
+            busy = cls._busy(activated)
+            for row in activated:
+                start, end = cls._interval(row['date'], row['start_time'], row['duration'])
+                intervals = busy.setdefault(row['table_id'], [])
+                conflict = TableAvailability.find_conflict(intervals, start, end)
+                if conflict:
+                    busy_start, busy_end, pk = conflict
+                    result.reject(
+                        row['id'],
+                        f"столик занят с {busy_start:%d.%m %H:%M} до {busy_end:%d.%m %H:%M} (бронь #{pk})",
+                    )
+                else:
+                    insort(intervals, (start, end, row['id']))
+                    accepted.append(row)
+
+        if not accepted:
+            return result
+
+        index_rows = [
+            (row['id'], row['table_id'], row['table__hall_id'], row['date'], row['start_time'], row['duration'])
+            for row in accepted
+        ]
+        with transaction.atomic():
+            # Строку могли изменить после проверки — такие не трогаем,
+            # пересечение с новой бронью остановит ограничение в базе
+            result.updated = Reservation.objects.filter(
+                pk__in=[row['id'] for row in accepted], status__in=allowed,
+            ).update(status=status, updated_at=timezone.now())
+            transaction.on_commit(lambda: OccupancyIndex.sync_rows(index_rows, status))
+            if status not in ACTIVE_STATUSES:
+                Waitlist.schedule(
+                    (row['table__hall_id'], day)
+                    for row in accepted if row['status'] in ACTIVE_STATUSES
+                    for day in OccupancyIndex.days(row['date'], row['start_time'], row['duration'])
+                )
+        return result
@@ -4,7 +4,8 @@ from reservation import views
 from reservation.apps import ReservationConfig
 from reservation.views import home, ReservationDeleteView, ReservationUpdateView, ReservationCreateView, \
     ReservationListView, AboutView, ContactView, reservation_welcome, ProfileView, ReservationDetailView, \
-    TablesByHallView, HallListView, FeedbackView, FeedbackThanksView
+    TablesByHallView, HallListView, FeedbackView, FeedbackThanksView, NearestSlotsView, \
+    HallDayAvailabilityView, SeriesBookingView, WaitlistCreateView, WaitlistCancelView
 
 app_name = ReservationConfig.name
 
@@ -16,7 +17,12 @@ urlpatterns = [
     path('reservation/detail/<int:pk>/', ReservationDetailView.as_view(), name='reservations_detail'),
     path('reservation/update/<int:pk>/', ReservationUpdateView.as_view(), name='reservations_update'),
     path('reservation/delete/<int:pk>/', ReservationDeleteView.as_view(), name='reservations_delete'),
+    path('waitlist/', WaitlistCreateView.as_view(), name='waitlist_create'),
+    path('waitlist/<int:pk>/cancel/', WaitlistCancelView.as_view(), name='waitlist_cancel'),
     path('api/tables-by-hall/<int:hall_id>/', TablesByHallView.as_view(), name='tables_by_hall'),
+    path('api/hall-day/<int:hall_id>/', HallDayAvailabilityView.as_view(), name='hall_day_availability'),
+    path('api/nearest-slots/', NearestSlotsView.as_view(), name='nearest_slots'),
+    path('api/series/', SeriesBookingView.as_view(), name='series_create'),
     path('hall/<int:hall_id>/schema/', views.hall_schema, name='hall_schema'),
     path('halls/', HallListView.as_view(), name='hall_list'),
     path('reservation_welcome/', reservation_welcome, name='reservation_welcome'),
@@ -1,10 +1,12 @@
 from datetime import timezone
 from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
 from django.utils import timezone
 from datetime import time, timedelta
 from datetime import timedelta
 
-
+FIRST_START_TIME = time(10, 0)
+LAST_START_TIME = time(22, 0)
 
 
 
@@ -80,7 +82,7 @@ class ReservationValidator:
                 "Время начала обязательно для заполнения",
                 code='start_time'
             )
-        if time_val < time(10, 0) or time_val > time(22, 0):
+        if time_val < FIRST_START_TIME or time_val > LAST_START_TIME:
             raise ValidationError(
                 "Ресторан работает с 10:00 до 23:00. Пожалуйста выберите другое время.",
                 code='start_time'
@@ -88,35 +90,39 @@ class ReservationValidator:
 
     @staticmethod
     def validate_availability(reservation):
-        """Проверка доступности столика"""
+        """
+        Проверка доступности столика одним запросом к основной базе.
+        Пересечение ищется в SQL по индексу ограничения на пересечения,
+        а не по индексу занятости в Redis и не на реплике: перед записью
+        нужны данные, которые увидит и сама запись.
+        """
         from .models import Reservation
-        from datetime import datetime
 
-        if not all([reservation.table, reservation.date, reservation.start_time]):
+        if not all([reservation.table, reservation.date, reservation.start_time, reservation.duration]):
             return True
 
         if reservation.status == "canceled":
             return True
 
-        new_start = datetime.combine(reservation.date, reservation.start_time)
-        new_end = new_start + reservation.duration
-
-        existing_reservations = Reservation.objects.filter(
-            table=reservation.table,
-            date=reservation.date,
-            status__in=["confirmed", "completed"],
-        ).exclude(pk=reservation.pk if reservation.pk else None)
-
-        for existing in existing_reservations:
-            existing_start = datetime.combine(existing.date, existing.start_time)
-            existing_end = existing_start + existing.duration
-
-            if new_start < existing_end and new_end > existing_start:
-                raise ValidationError(
-                    f"Столик уже забронирован с {existing.start_time} "
-                    f"до {existing_end.time()}",
-                    code='table'
-                )
+        reservation.set_span()
+        conflict = (
+            Reservation.objects.using(DEFAULT_DB_ALIAS)
+            .active()
+            .filter(table=reservation.table)
+            .overlapping(reservation.starts_at, reservation.ends_at)
+            .exclude(pk=reservation.pk)
+            .order_by('starts_at')
+            .values_list('starts_at', 'ends_at')
+            .first()
+        )
+
+        if conflict:
+            existing_start, existing_end = (timezone.localtime(moment) for moment in conflict)
+            raise ValidationError(
+                f"Столик уже забронирован с {existing_start.time()} "
+                f"до {existing_end.time()}",
+                code='table'
+            )
 
         return True
 
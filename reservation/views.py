@@ -1,104 +1,300 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
-from django.views.generic import ListView, UpdateView, DeleteView, TemplateView, DetailView, CreateView, FormView
+from django.views.generic.base import ContextMixin
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView, DetailView, FormView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db import IntegrityError
-from .models import Reservation, Table, Hall
-from .forms import ReservationForm, FeedbackForm
+from django.db import IntegrityError, transaction
+from .models import Reservation, Hall, WaitlistEntry
+from .forms import ReservationForm, ReservationSeriesForm, WaitlistForm, FeedbackForm
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from datetime import datetime, timedelta, date
+import json
 import logging
-from django.core.mail import send_mail
 from django.conf import settings
 
+from .availability import TableAvailability
+from .caching import ReferenceCache
+from .pagination import ReservationKeysetPaginator
+from .routers import ReplicaReadMixin, replica_reads
+from .series import SeriesBooking
+from .tasks import queue_email
 from .validators import ReservationValidator
+from .waitlist import Waitlist
 
 logger = logging.getLogger(__name__)
 
 
-class TablesByHallView(View):
-    def get(self, request, hall_id):
+def _request_date(request):
+    """Дата из параметра date: (True, дата или None) или (False, None) при неверном формате"""
+    date_str = request.GET.get('date')
+    if not date_str:
+        return True, None
+    try:
+        return True, datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return False, None
+
+
+def _change_tokens(request, hall_id):
+    """
+    Метки изменения, от которых зависит ответ по залу: сам зал и его столики,
+    а если в запросе есть дата — ещё и брони на эту дату. Метки лежат в кэше,
+    поэтому проверка If-None-Match не трогает базу. Last-Modified не
+    отдаётся: метки в наносекундах, а в заголовке только секунды — два
+    изменения в одну секунду дали бы клиенту устаревший 304.
+    """
+    valid, date_obj = _request_date(request)
+    if not valid:
+        return None
+    tokens = [ReferenceCache.hall_version(hall_id)]
+    if date_obj:
+        tokens.append(ReferenceCache.day_version(hall_id, date_obj))
+    # Без общего кэша меток нет — ответ строится каждый раз
+    return None if None in tokens else tokens
+
+
+async def _achange_tokens(request, hall_id):
+    valid, date_obj = _request_date(request)
+    if not valid:
+        return None
+    tokens = [await ReferenceCache.ahall_version(hall_id)]
+    if date_obj:
+        tokens.append(await ReferenceCache.aday_version(hall_id, date_obj))
+    return None if None in tokens else tokens
+
+
+def hall_etag(request, hall_id, **kwargs):
+    tokens = _change_tokens(request, hall_id)
+    if tokens is None:
+        return None
+    # Страницы отрисовываются по-разному для гостя, посетителя и персонала
+    user = request.user
+    viewer = f"s{user.pk}" if user.is_staff else f"u{user.pk}" if user.is_authenticated else "anon"
+    return '-'.join(str(token) for token in [*tokens, viewer])
+
+
+class HallConditionalMixin:
+    """
+    Conditional GET для асинхронных JSON-представлений зала.
+    ETag строится по меткам изменения зала и дня, при
+    совпадении возвращается 304 без расчёта ответа. Ответ не зависит от
+    пользователя, поэтому метки общие для всех.
+    """
+
+    async def conditional_response(self, request, hall_id, build):
+        tokens = await _achange_tokens(request, hall_id)
+        if tokens is None:
+            return await build()
+
+        etag = quote_etag('-'.join(str(token) for token in tokens))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await build()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class TablesByHallView(ReplicaReadMixin, HallConditionalMixin, View):
+    """
+    Свободные столики зала на дату и время (асинхронное представление).
+    Повторный запрос без изменений в зале и дне получает 304 без подбора столиков.
+    """
+
+    async def get(self, request, hall_id):
+        return await self.conditional_response(request, hall_id, lambda: self.tables(request, hall_id))
+
+    async def tables(self, request, hall_id):
+        date_str = request.GET.get('date')
+        time_str = request.GET.get('time')
+        guests_count = request.GET.get('guests')
         try:
-            date_str = request.GET.get('date')
-            time_str = request.GET.get('time')
-            guests_count = request.GET.get('guests')
-
             date_obj = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
             time_obj = datetime.strptime(time_str, '%H:%M').time() if time_str else None
             guests = int(guests_count) if guests_count else 1
+        except ValueError as e:
+            return JsonResponse({'error': f'Неверный формат данных: {e}'}, status=400)
+
+        available_tables = await TableAvailability.afree_tables(hall_id, date_obj, time_obj, guests)
+        return JsonResponse({'tables': available_tables})
+
 
-            tables = Table.objects.filter(hall_id=hall_id, capacity__gte=guests)
+class HallDayAvailabilityView(ReplicaReadMixin, HallConditionalMixin, View):
+    """
+    Занятость столиков зала на весь день одним ответом (асинхронное представление).
+    Форма бронирования загружает её при смене зала или даты и дальше
+    подбирает столики по времени и числу гостей без запросов к серверу.
+    Повторная загрузка неизменившегося дня возвращает 304 без расчёта.
+    """
 
-            available_tables = []
+    async def get(self, request, hall_id):
+        return await self.conditional_response(request, hall_id, lambda: self.matrix(request, hall_id))
 
-            for table in tables:
-                temp_reservation = Reservation(
-                    table=table,
-                    date=date_obj,
-                    start_time=time_obj,
-                    guests_count=guests,
-                    duration=timedelta(hours=3)
-                )
+    async def matrix(self, request, hall_id):
+        try:
+            date_obj = datetime.strptime(request.GET['date'], '%Y-%m-%d').date()
+            exclude_pk = int(request.GET['exclude']) if request.GET.get('exclude') else None
+        except (KeyError, ValueError) as e:
+            return JsonResponse({'error': f'Неверный формат данных: {e}'}, status=400)
+
+        matrix = await TableAvailability.aday_matrix(hall_id, date_obj, exclude_pk=exclude_pk)
+        return HttpResponse(json.dumps(matrix, separators=(',', ':')), content_type='application/json')
 
-                try:
-                    ReservationValidator.validate_availability(temp_reservation)
-                    available_tables.append({
-                        'id': table.id,
-                        'number': table.number,
-                        'capacity': table.capacity
-                    })
-                except ValidationError:
-                    pass
 
+class NearestSlotsView(ReplicaReadMixin, View):
+    """
+    Ближайшие свободные варианты брони по всем залам для желаемых даты, времени
+    и числа гостей (асинхронное представление, залы проверяются параллельно).
+    """
 
-            return JsonResponse({'tables': available_tables})
+    async def get(self, request):
+        try:
+            date_obj = datetime.strptime(request.GET['date'], '%Y-%m-%d').date()
+            time_obj = datetime.strptime(request.GET['time'], '%H:%M').time()
+            guests = int(request.GET.get('guests') or 1)
+            limit = min(int(request.GET.get('limit') or 5), 20)
+            window = timedelta(minutes=min(int(request.GET.get('window') or 120), 12 * 60))
+        except (KeyError, ValueError) as e:
+            return JsonResponse({'error': f'Неверный формат данных: {e}'}, status=400)
 
+        try:
+            ReservationValidator.validate_date_not_in_past(date_obj)
+        except ValidationError as e:
+            return JsonResponse({'error': e.message}, status=400)
+
+        slots = await TableAvailability.anearest_slots(date_obj, time_obj, guests, limit=limit, window=window)
+        return JsonResponse({'slots': slots})
+
+
+class SeriesBookingView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Создание серии броней персоналом (JSON API).
+    Тело запроса — поля ReservationSeriesForm, tables — список id столиков.
+    Занятые даты возвращаются с кодом 409, если не передан skip_conflicts.
+    """
+
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
         except ValueError as e:
             return JsonResponse({'error': f'Неверный формат данных: {e}'}, status=400)
-        except Exception as e:
-            logger.exception("Error in TablesByHallView:")
-            return JsonResponse({'error': 'Внутренняя ошибка сервера'}, status=500)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Ожидается JSON-объект'}, status=400)
+
+        form = ReservationSeriesForm(data)
+        if not form.is_valid():
+            conflicts = form.plan.conflicts if form.plan else {}
+            return JsonResponse(
+                {'errors': form.errors.get_json_data(), 'conflicts': self.conflicts_json(conflicts)},
+                status=409 if conflicts else 400,
+            )
 
-class HallListView(ListView):
+        try:
+            with transaction.atomic():
+                series = form.save(commit=False)
+                series.staff_user = request.user
+                series.save()
+                form.save_m2m()
+                reservations = SeriesBooking.create(series, form.plan)
+        except IntegrityError:
+            return JsonResponse(
+                {'error': 'Во время проверки столик заняла другая бронь, повторите запрос'},
+                status=409,
+            )
+        return JsonResponse({
+            'series': series.pk,
+            'reservations': [reservation.pk for reservation in reservations],
+            'skipped': self.conflicts_json(form.plan.conflicts),
+        }, status=201)
+
+    @staticmethod
+    def conflicts_json(conflicts):
+        return [
+            {'date': date_val.isoformat(), 'reasons': reasons}
+            for date_val, reasons in sorted(conflicts.items())
+        ]
+
+
+class HallListView(ReplicaReadMixin, ListView):
     model = Hall
     template_name = 'reservation/hall_list.html'
+    context_object_name = 'halls'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['halls'] = Hall.objects.all()
-        return context
+    def get_queryset(self):
+        return ReferenceCache.halls_with_stats()
 
 
-class ReservationCreateView(LoginRequiredMixin, CreateView):
-    model = Reservation
+def add_save_error(form, error):
+    """Переносит нарушение ограничения при сохранении брони в ошибку формы"""
+    if Reservation.OVERLAP_CONSTRAINT in str(error):
+        form.add_error('table', 'Столик на это время уже забронирован. Пожалуйста, выберите другой столик или время.')
+    else:
+        form.add_error(None, 'Произошла ошибка при сохранении. Возможно, столик на это время уже был забронирован кем-то другим. Пожалуйста, попробуйте еще раз.')
+
+
+class ReservationCreateView(ContextMixin, View):
+    """
+    Создание брони (асинхронное представление).
+    Проверка входа и показ формы не держат поток воркера; проверка формы
+    и сохранение идут в одном синхронном вызове, потому что транзакции
+    асинхронному ORM недоступны.
+    """
+
     form_class = ReservationForm
     template_name = 'reservation/reservation_form.html'
     success_url = reverse_lazy('reservation:profile')
 
-    def get_form_kwargs(self):
-        kwargs = super().get_form_kwargs()
-        kwargs['user'] = self.request.user
-        return kwargs
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def get(self, request):
+        return await sync_to_async(self.render_form)(self.form_class(user=request.user))
+
+    async def post(self, request):
+        return await sync_to_async(self.process_form)(request)
+
+    def render_form(self, form):
+        return render(self.request, self.template_name, self.get_context_data(form=form))
+
+    def process_form(self, request):
+        form = self.form_class(request.POST, request.FILES, user=request.user)
+        if not form.is_valid():
+            return self.render_form(form)
 
-    def form_valid(self, form):
         try:
             reservation = form.save(commit=False)
-            reservation.user = self.request.user
-            reservation.save()
+            reservation.user = request.user
+            with transaction.atomic():
+                reservation.save()
 
             messages.success(
-                self.request,
+                request,
                 f"Бронь успешно создана! Столик #{reservation.table.number} на {reservation.date} {reservation.start_time}"
             )
             return redirect(self.success_url)
 
         except IntegrityError as e:
-            form.add_error(None, 'Произошла ошибка при сохранении. Возможно, столик на это время уже был забронирован кем-то другим. Пожалуйста, попробуйте еще раз.')
-            return self.form_invalid(form)
+            add_save_error(form, e)
+            return self.render_form(form)
 
 
 class ReservationDetailView(LoginRequiredMixin, DetailView):
@@ -113,18 +309,58 @@ class ReservationDetailView(LoginRequiredMixin, DetailView):
         return reservation
 
 
-class ReservationListView(LoginRequiredMixin, ListView):
+class ReservationListView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     model = Reservation
     template_name = 'reservation/reservation_list.html'
     context_object_name = 'reservations'
+    page_size = 30
 
     def get_queryset(self):
-        now = timezone.now().date()
-        Reservation.objects.filter(status='confirmed', date__lt=now).update(status='completed')
-        if self.request.user.is_staff:
-            return Reservation.objects.all().order_by('-date', '-start_time')
-        else:
-            return Reservation.objects.filter(user=self.request.user).order_by('-date', '-start_time')
+        queryset = Reservation.objects.select_related('table__hall', 'user')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+
+        date_str = self.request.GET.get('date')
+        hall_id = self.request.GET.get('hall')
+        status = self.request.GET.get('status')
+        if date_str:
+            try:
+                queryset = queryset.filter(date=datetime.strptime(date_str, '%Y-%m-%d').date())
+            except ValueError:
+                pass
+        if hall_id and hall_id.isdigit():
+            queryset = queryset.filter(table__hall_id=hall_id)
+        if status in dict(Reservation.STATUS_CHOICES):
+            queryset = queryset.filter(status=status)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        """Постраничный вывод по курсору вместо OFFSET-пагинации ListView"""
+        paginator = ReservationKeysetPaginator(self.object_list, self.page_size)
+        try:
+            page = paginator.page(
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before'),
+            )
+        except ValueError:
+            page = paginator.page()
+
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        context['halls'] = Hall.objects.all()
+        context['status_choices'] = Reservation.STATUS_CHOICES
+        context['filters'] = {
+            key: self.request.GET.get(key, '') for key in ('date', 'hall', 'status')
+        }
+        query = self.request.GET.copy()
+        for key in ('after', 'before'):
+            query.pop(key, None)
+        if page.has_next:
+            context['next_query'] = f"{query.urlencode()}&after={page.next_cursor}".lstrip('&')
+        if page.has_previous:
+            context['previous_query'] = f"{query.urlencode()}&before={page.previous_cursor}".lstrip('&')
+        return context
+
 
 
 class ReservationUpdateView(LoginRequiredMixin, UpdateView):
@@ -141,10 +377,17 @@ class ReservationUpdateView(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         reservation = form.save(commit=False)
         original_duration = Reservation.objects.get(pk=self.object.pk).duration
-        if self.request.user.is_staff and original_duration != reservation.duration:
+        extended = self.request.user.is_staff and original_duration != reservation.duration
+        if extended:
             reservation.extended_by_admin = True
+        try:
+            with transaction.atomic():
+                reservation.save()
+        except IntegrityError as e:
+            add_save_error(form, e)
+            return self.form_invalid(form)
+        if extended:
             messages.info(self.request, f"Длительность брони изменена. Новое время окончания: {reservation.end_time}")
-        reservation.save()
         messages.success(self.request, "Бронь успешно обновлена!")
         return redirect(self.get_success_url())
 
@@ -165,6 +408,49 @@ class ReservationDeleteView(LoginRequiredMixin, DeleteView):
         return redirect(self.success_url)
 
 
+class WaitlistCreateView(LoginRequiredMixin, CreateView):
+    """
+    Запись в лист ожидания. Столик бронируется автоматически, когда в зале
+    на эту дату отменяют бронь; если место есть уже сейчас — сразу.
+    """
+
+    model = WaitlistEntry
+    form_class = WaitlistForm
+    template_name = 'reservation/waitlist_form.html'
+    success_url = reverse_lazy('reservation:profile')
+
+    def get_initial(self):
+        return {
+            name: self.request.GET[name]
+            for name in ('hall', 'date', 'guests_count')
+            if self.request.GET.get(name)
+        }
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        form.instance.user = self.request.user
+        response = super().form_valid(form)
+        Waitlist.schedule([(self.object.hall_id, self.object.date)])
+        messages.success(
+            self.request,
+            "Вы в листе ожидания. Когда столик освободится, мы забронируем его и пришлём письмо."
+        )
+        return response
+
+
+class WaitlistCancelView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        entry = get_object_or_404(WaitlistEntry, pk=pk, user=request.user, status='waiting')
+        entry.status = 'canceled'
+        entry.save(update_fields=['status'])
+        messages.success(request, "Запись в листе ожидания отменена")
+        return redirect('reservation:profile')
+
+
 class AboutView(TemplateView):
     template_name = "reservation/about.html"
 
@@ -177,8 +463,6 @@ class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = 'reservation/profile.html'
 
     def get_context_data(self, **kwargs):
-        now = timezone.now().date()
-        Reservation.objects.filter(status='confirmed', date__lt=now).update(status='completed')
         context = super().get_context_data(**kwargs)
         user_reservations = Reservation.objects.filter(
             user=self.request.user
@@ -191,6 +475,11 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         context['past_reservations'] = user_reservations.filter(
             date__lt=today
         )
+        context['waitlist_entries'] = WaitlistEntry.objects.filter(
+            user=self.request.user,
+            status='waiting',
+            date__gte=today,
+        ).select_related('hall')
         context['user'] = self.request.user
 
         return context
@@ -202,9 +491,15 @@ def reservation_welcome(request):
     return render(request, 'reservation/reservation_welcome.html')
 
 
+@replica_reads
+@condition(etag_func=hall_etag)
+@cache_control(private=True, no_cache=True)
+@vary_on_cookie
 def hall_schema(request, hall_id):
-    hall = get_object_or_404(Hall, id=hall_id)
-    tables = Table.objects.filter(hall=hall, is_active=True)
+    hall = ReferenceCache.hall(hall_id)
+    if hall is None:
+        raise Http404("Зал не найден")
+    tables = [table for table in ReferenceCache.tables(hall_id) if table.is_active]
 
     grid = [[None for _ in range(hall.width)] for _ in range(hall.height)]
 
@@ -238,12 +533,11 @@ class FeedbackView(FormView):
         Дата: {timezone.now()}
         '''
 
-        send_mail(
+        queue_email(
             subject,
             email_message,
-            settings.DEFAULT_FROM_EMAIL,
             [settings.ADMIN_EMAIL],
-            fail_silently=False,
+            settings.DEFAULT_FROM_EMAIL,
         )
         messages.success(self.request, "Спасибо за ваше сообщение!")
         return super().form_valid(form)
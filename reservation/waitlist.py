@@ -0,0 +1,115 @@
+from bisect import insort
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from reservation.availability import TableAvailability
+from reservation.caching import ReferenceCache
+from reservation.models import Reservation, WaitlistEntry
+from reservation.occupancy import OccupancyIndex
+
+SLOT_STEP = timedelta(minutes=15)
+
+
+class Waitlist:
+    """
+    Перевод гостей из листа ожидания в брони.
+
+    Отмена или удаление активной брони ставит задачу promote_waitlist для
+    каждого освободившегося (зал, дата). Задача одним запросом по частичному
+    индексу waitlist_waiting_idx берёт ожидающих этого дня в порядке очереди,
+    занятость зала читает из базы один раз и подбирает каждому самый
+    маленький подходящий столик на самое раннее время в его окне.
+    """
+
+    @staticmethod
+    def schedule(pairs):
+        """Ставит проверку листа ожидания для пар (зал, дата) после фиксации транзакции"""
+        from reservation.tasks import promote_waitlist
+
+        today = timezone.localdate()
+        pairs = {(hall_id, day) for hall_id, day in pairs if hall_id and day >= today}
+        if pairs:
+            transaction.on_commit(lambda: [
+                promote_waitlist.delay(hall_id, day.isoformat()) for hall_id, day in sorted(pairs)
+            ])
+
+    @staticmethod
+    def candidate_starts(entry, now):
+        """Время начала в окне записи с шагом SLOT_STEP, прошедшее время пропускается"""
+        start = datetime.combine(entry.date, entry.earliest_time)
+        last = datetime.combine(entry.date, entry.latest_time)
+        while start <= last:
+            if start > now:
+                yield start
+            start += SLOT_STEP
+
+    @classmethod
+    def find_slot(cls, entry, tables, busy, now):
+        """Первый свободный (столик, начало) для записи или None"""
+        suitable = [table for table in tables if table.capacity >= entry.guests_count]
+        for start in cls.candidate_starts(entry, now):
+            for table in suitable:
+                if TableAvailability.is_free(busy.get(table.pk, ()), start, start + entry.duration):
+                    return table, start
+        return None
+
+    @classmethod
+    def promote(cls, hall_id, date_val):
+        """
+        Переводит ожидающих зала на дату в подтверждённые брони.
+        Возвращает список переведённых записей (с заполненной reservation).
+        """
+        now = timezone.localtime().replace(tzinfo=None)
+        promoted = []
+        with transaction.atomic():
+            # Параллельная задача того же дня пропускает заблокированные записи
+            entries = list(
+                WaitlistEntry.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(hall_id=hall_id, date=date_val, status='waiting')
+                .select_related('user')
+                .order_by('created_at')
+            )
+            if not entries:
+                return promoted
+
+            tables = sorted(
+                (table for table in ReferenceCache.tables(hall_id) if table.is_active),
+                key=lambda table: (table.capacity, table.pk),
+            )
+            busy = OccupancyIndex.intervals_from_rows(OccupancyIndex.load(hall_id, date_val))
+            for entry in entries:
+                slot = cls.find_slot(entry, tables, busy, now)
+                if slot is None:
+                    continue
+                table, start = slot
+                reservation = Reservation(
+                    user=entry.user,
+                    table=table,
+                    date=entry.date,
+                    start_time=start.time(),
+                    duration=entry.duration,
+                    guests_count=entry.guests_count,
+                    status='confirmed',
+                    source='guest',
+                )
+                try:
+                    with transaction.atomic():
+                        reservation.save()
+                except IntegrityError:
+                    # Столик заняли после чтения занятости — ждём следующей отмены
+                    continue
+                insort(busy.setdefault(table.pk, []), (start, start + entry.duration, reservation.pk))
+                entry.status = 'promoted'
+                entry.reservation = reservation
+                entry.promoted_at = timezone.now()
+                entry.save(update_fields=['status', 'reservation', 'promoted_at'])
+                promoted.append(entry)
+        return promoted
+
+    @staticmethod
+    def expire(today=None):
+        """Закрывает записи на прошедшие даты; возвращает их количество"""
+        today = today or timezone.localdate()
+        return WaitlistEntry.objects.filter(status='waiting', date__lt=today).update(status='expired')
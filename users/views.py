@@ -1,7 +1,8 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.http import Http404
 from django.urls import reverse
-from django.core.mail import send_mail
+from reservation.routers import ReplicaReadMixin
+from reservation.tasks import queue_email
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.contrib import messages
@@ -27,7 +28,7 @@ class UserCreateView(CreateView):
          user.save()
          host = self.request.get_host()
          url = f'http://{host}/users/email-confirm/{token}/'
-         send_mail(
+         queue_email(
              subject='Подтверждение почты',
              message=f'Здравствуйте! Для завершения регистрации пожалуйста перейдите по ссылке {url}.',
              from_email=EMAIL_HOST_USER,
@@ -51,7 +52,7 @@ class UserDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         return context
 
 
-class UserListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class UserListView(ReplicaReadMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = User
     template_name = "users/users_list.html"
     paginate_by = 10
@@ -134,7 +135,7 @@ def change_password(
                 new_password = User.objects.make_random_password(12)
                 user.set_password(new_password)
                 user.save()
-                send_mail(
+                queue_email(
                     subject="Новый пароль",
                     message=f"Ваш новый пароль: {new_password}",
                     from_email=EMAIL_HOST_USER,